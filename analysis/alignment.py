@@ -0,0 +1,197 @@
+import numpy as np
+import globals
+from analysis import stacking
+
+def cross_correlation_lags(matrix, target, max_lag, centers=None):
+    """
+    Find the lag (in points) that best aligns each row of matrix to target.
+
+    Cross-correlation is computed for all rows at once with zero-padded FFTs.
+    Lags are searched within +/- max_lag of centers (0 when None) and refined
+    to sub-point precision with a parabolic fit around the maximum.
+    """
+    n = matrix.shape[1]
+    n_fft = int(2 ** np.ceil(np.log2(2 * n)))
+
+    rows = matrix - matrix.mean(axis=1, keepdims=True)
+    ref = target - target.mean()
+
+    X = np.fft.rfft(rows, n_fft, axis=1)
+    T = np.conj(np.fft.rfft(ref, n_fft))
+    corr = np.fft.irfft(X * T[np.newaxis, :], n_fft, axis=1)
+
+    if centers is None:
+        centers = np.zeros(matrix.shape[0], dtype=int)
+    centers = np.round(centers).astype(int)
+
+    # Candidate lags per row; negative lags wrap to the end of the FFT buffer
+    offsets = np.arange(-max_lag, max_lag + 1)
+    lags = centers[:, np.newaxis] + offsets[np.newaxis, :]
+    window = np.take_along_axis(corr, lags % n_fft, axis=1)
+
+    best = window.argmax(axis=1)
+    row_idx = np.arange(len(best))
+    inner = (best > 0) & (best < window.shape[1] - 1)
+
+    delta = np.zeros(len(best))
+    b = best[inner]
+    r = row_idx[inner]
+    y0, y1, y2 = window[r, b - 1], window[r, b], window[r, b + 1]
+    denom = y0 - 2 * y1 + y2
+    valid = denom < 0
+    delta_inner = np.zeros(len(b))
+    delta_inner[valid] = 0.5 * (y0[valid] - y2[valid]) / denom[valid]
+    delta[inner] = np.clip(delta_inner, -0.5, 0.5)
+
+    return lags[row_idx, best] + delta
+
+def build_target(spectra, grid, index_slice=slice(None), target="mean", chunk_size=64):
+    """Build the alignment target: the mean spectrum or the first spectrum."""
+    if target == "first":
+        ppm_scale, data, _, _ = spectra[0]
+        return np.asarray(stacking.on_grid(ppm_scale, data, grid, index_slice), dtype=np.float64)
+
+    total = None
+    for _, matrix in stacking.iter_stacked_chunks(spectra, grid, index_slice, chunk_size):
+        chunk_sum = matrix.sum(axis=0)
+        total = chunk_sum if total is None else total + chunk_sum
+    return total / len(spectra)
+
+def padded_slice(grid, start_ppm, end_ppm, pad):
+    """Index slice of a ppm window widened by pad points on both sides."""
+    region = stacking.region_slice(grid, start_ppm, end_ppm)
+    return slice(max(0, region.start - pad), min(len(grid), region.stop + pad))
+
+def align_spectra(spectra, max_shift_ppm=0.02, reference_region=None, segments=None,
+                  target="mean", chunk_size=64):
+    """
+    Align all spectra with FFT cross-correlation in two stages.
+
+    1. A global shift per spectrum, found on reference_region (e.g. the TSP
+       window) or on the whole spectrum when None.
+    2. icoshift-style per-segment shifts for each (start, end) ppm window in
+       segments, searched around the global shift.
+
+    Returns (segment_bounds, offsets, state) where segment_bounds are sorted
+    by lower bound and offsets maps pdata_dir to (global_offset_ppm,
+    segment_offsets_ppm). No spectral data is copied; shifts are stored as
+    offsets and applied by aligned_data on demand. state carries the grid
+    and targets, so spectra added later are aligned to the same targets.
+    """
+    grid = stacking.reference_grid(spectra)
+    step = grid[1] - grid[0]
+    max_lag = max(1, int(round(max_shift_ppm / abs(step))))
+
+    # Global shift
+    if reference_region is not None:
+        global_slice = padded_slice(grid, reference_region[0], reference_region[1], max_lag)
+    else:
+        global_slice = slice(None)
+
+    # Per-segment shifts, searched within max_lag of each spectrum's global shift
+    segments = list(segments) if segments is not None else []
+    segment_bounds = np.array([[min(s, e), max(s, e)] for s, e in segments], dtype=float).reshape(-1, 2)
+    segment_bounds = segment_bounds[np.argsort(segment_bounds[:, 0], kind="stable")]
+    segment_slices = [padded_slice(grid, low, high, 2 * max_lag) for low, high in segment_bounds]
+
+    state = {
+        "grid": grid,
+        "max_lag": max_lag,
+        "global_slice": global_slice,
+        "global_target": build_target(spectra, grid, global_slice, target, chunk_size),
+        "segment_slices": segment_slices,
+        "segment_targets": [build_target(spectra, grid, seg_slice, target, chunk_size)
+                            for seg_slice in segment_slices],
+    }
+    return segment_bounds, spectra_offsets(spectra, state, chunk_size), state
+
+def spectra_offsets(spectra, state, chunk_size=64):
+    """Global and per-segment offsets (ppm) of each spectrum against the targets in state."""
+    grid = state["grid"]
+    step = grid[1] - grid[0]
+    max_lag = state["max_lag"]
+
+    global_lags = np.zeros(len(spectra))
+    for row, matrix in stacking.iter_stacked_chunks(spectra, grid, state["global_slice"], chunk_size):
+        global_lags[row:row + len(matrix)] = cross_correlation_lags(matrix, state["global_target"], max_lag)
+
+    segment_lags = np.zeros((len(spectra), len(state["segment_slices"])))
+    for k, (seg_slice, seg_target) in enumerate(zip(state["segment_slices"], state["segment_targets"])):
+        for row, matrix in stacking.iter_stacked_chunks(spectra, grid, seg_slice, chunk_size):
+            centers = global_lags[row:row + len(matrix)]
+            segment_lags[row:row + len(matrix), k] = cross_correlation_lags(
+                matrix, seg_target, max_lag, centers)
+
+    return {pdata_dir: (global_lags[i] * step, segment_lags[i] * step)
+            for i, (_, _, _, pdata_dir) in enumerate(spectra)}
+
+def set_alignment(segment_bounds, offsets, state=None):
+    """Store alignment results (segments sorted by lower bound) and the targets globally."""
+    globals.alignment_segments = segment_bounds
+    globals.alignment_offsets = dict(offsets)
+    globals.alignment_settings = state
+    globals.trigger_event('alignment_updated')
+
+def add_spectra(new_spectra):
+    """Align newly added spectra to the stored targets."""
+    state = globals.alignment_settings
+    if state is None or not new_spectra:
+        return
+    globals.alignment_offsets.update(spectra_offsets(new_spectra, state))
+
+def clear_alignment():
+    """Remove all stored alignment shifts."""
+    globals.alignment_segments = np.empty((0, 2))
+    globals.alignment_offsets = {}
+    globals.alignment_settings = None
+    globals.trigger_event('alignment_updated')
+
+def offset_at(pdata_dir, ppm):
+    """
+    Shift (ppm) of a spectrum at the given reference-frame ppm value(s); 0
+    when not aligned. Inside a segment its own shift applies, elsewhere the
+    global one; where segments overlap, the one starting last wins.
+    """
+    entry = globals.alignment_offsets.get(pdata_dir)
+    if entry is None:
+        return np.zeros_like(ppm, dtype=float) if np.ndim(ppm) else 0.0
+
+    global_offset, segment_offsets = entry
+    ppm_arr = np.atleast_1d(np.asarray(ppm, dtype=float))
+    result = np.full(ppm_arr.shape, global_offset, dtype=float)
+
+    # Segments are sorted by lower bound, so later (higher-starting) ones overwrite
+    for (low, high), segment_offset in zip(globals.alignment_segments, segment_offsets):
+        result[(ppm_arr >= low) & (ppm_arr <= high)] = segment_offset
+
+    return result if np.ndim(ppm) else float(result[0])
+
+def region_offset(pdata_dir, start_ppm, end_ppm):
+    """Shift (ppm) to apply to an integration window of a spectrum."""
+    if pdata_dir not in globals.alignment_offsets:
+        return 0.0
+    return offset_at(pdata_dir, (start_ppm + end_ppm) / 2)
+
+def shifted_windows(pdata_dir, peak_limits):
+    """Start and end ppm arrays of every peak_limits window, shifted for this spectrum."""
+    starts = peak_limits["ppm start"].to_numpy(dtype=float)
+    ends = peak_limits["ppm end"].to_numpy(dtype=float)
+    offsets = np.array([region_offset(pdata_dir, s, e) for s, e in zip(starts, ends)])
+    return starts + offsets, ends + offsets
+
+def aligned_data(ppm_scale, data, pdata_dir):
+    """
+    Intensities of a spectrum with its alignment shifts removed, on its own
+    (unshifted, monotonic) ppm axis.
+
+    The value at each ppm is read from ppm + offset_at(ppm) of the raw
+    spectrum by linear interpolation, so every segment is shifted by its own
+    offset and the axis never folds where segment and global shifts differ.
+    Unaligned spectra are returned as they are.
+    """
+    if pdata_dir not in globals.alignment_offsets:
+        return data
+    source = ppm_scale + offset_at(pdata_dir, ppm_scale)
+    if ppm_scale[0] > ppm_scale[-1]:
+        return np.interp(source, ppm_scale[::-1], data[::-1]).astype(data.dtype, copy=False)
+    return np.interp(source, ppm_scale, data).astype(data.dtype, copy=False)
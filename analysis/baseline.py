@@ -0,0 +1,125 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import globals
+
+def second_difference_bands(n, lam):
+    """
+    Upper banded form of lam * D'D, D being the second-difference operator.
+
+    D'D is symmetric pentadiagonal, so the system (W + lam * D'D) z = W y can be
+    solved with a banded Cholesky factorisation in O(n).
+    """
+    ab = np.zeros((3, n))
+    main = np.full(n, 6.0)
+    main[[0, -1]] = 1.0
+    main[[1, -2]] = 5.0
+    off1 = np.full(n - 1, -4.0)
+    off1[[0, -1]] = -2.0
+    ab[2] = main * lam
+    ab[1, 1:] = off1 * lam
+    ab[0, 2:] = lam
+    return ab
+
+def asls_baseline(y, lam=1e5, p=0.01, niter=10):
+    """Asymmetric least squares baseline (Eilers & Boelens)."""
+    from scipy.linalg import solveh_banded
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    bands = second_difference_bands(n, lam)
+    w = np.ones(n)
+    z = y
+    for _ in range(niter):
+        ab = bands.copy()
+        ab[2] += w
+        z = solveh_banded(ab, w * y, check_finite=False)
+        new_w = np.where(y > z, p, 1 - p)
+        if np.array_equal(new_w, w):
+            break
+        w = new_w
+    return z
+
+def arpls_baseline(y, lam=1e5, ratio=1e-6, niter=50):
+    """Asymmetrically reweighted penalized least squares baseline (Baek et al.)."""
+    from scipy.linalg import solveh_banded
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    bands = second_difference_bands(n, lam)
+    w = np.ones(n)
+    z = y
+    for _ in range(niter):
+        ab = bands.copy()
+        ab[2] += w
+        z = solveh_banded(ab, w * y, check_finite=False)
+        d = y - z
+        dn = d[d < 0]
+        if len(dn) == 0:
+            break
+        m = dn.mean()
+        s = dn.std()
+        if s == 0:
+            break
+        exponent = np.clip(2 * (d - (2 * s - m)) / s, -500, 500)
+        new_w = 1.0 / (1.0 + np.exp(exponent))
+        if np.linalg.norm(w - new_w) / np.linalg.norm(w) < ratio:
+            break
+        w = new_w
+    return z
+
+BASELINE_METHODS = {
+    "arPLS": arpls_baseline,
+    "AsLS": asls_baseline,
+}
+
+def _correct_one(args):
+    """Worker: return baseline-corrected intensities for one spectrum."""
+    data, method, lam = args
+    baseline = BASELINE_METHODS[method](data, lam=lam)
+    return (data - baseline).astype(data.dtype, copy=False)
+
+def correct_spectra(spectra, method="arPLS", lam=1e7, workers=None):
+    """
+    Baseline-correct whole spectra, in parallel across a process pool.
+
+    Returns a dict mapping pdata_dir to the corrected intensity array.
+    """
+    if method not in BASELINE_METHODS:
+        raise ValueError(f"Unknown baseline method: {method}")
+
+    workers = workers or os.cpu_count() or 1
+    jobs = [(data, method, lam) for _, data, _, _ in spectra]
+
+    if workers == 1 or len(jobs) < 4:
+        corrected = [_correct_one(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            corrected = list(executor.map(_correct_one, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+
+    return {pdata_dir: c for (_, _, _, pdata_dir), c in zip(spectra, corrected)}
+
+def set_corrected(corrected, method, lam):
+    """Store corrected spectra in the global cache."""
+    globals.baseline_corrected.update(corrected)
+    globals.baseline_settings = {"method": method, "lambda": lam}
+    globals.trigger_event('baseline_updated')
+
+def add_spectra(new_spectra):
+    """Baseline-correct newly added spectra with the stored settings."""
+    settings = globals.baseline_settings
+    if settings is None or not new_spectra:
+        return
+    globals.baseline_corrected.update(correct_spectra(new_spectra, settings["method"], settings["lambda"]))
+
+def clear_corrected():
+    """Drop all cached baseline-corrected spectra."""
+    globals.baseline_corrected = {}
+    globals.baseline_settings = None
+    globals.trigger_event('baseline_updated')
+
+def is_corrected(pdata_dir):
+    """Whether a baseline-corrected copy of this spectrum is cached."""
+    return pdata_dir in globals.baseline_corrected
+
+def corrected_data(pdata_dir, data):
+    """Return the cached baseline-corrected intensities, or data when none are cached."""
+    return globals.baseline_corrected.get(pdata_dir, data)
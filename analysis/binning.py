@@ -1,11 +1,35 @@
 import numpy as np
 import pandas as pd
+from scipy.signal import find_peaks
 from tkinter import messagebox
 import file_io
+from analysis import alignment
+from analysis import baseline
+from analysis import interval_index
+from analysis import normalization
+from analysis import spectrum_index
+from analysis import stacking
 import globals
+import diagnostics
 
-def perform_binning(bin_size):
-    """Perform uniform binning on all spectra."""
+BINNING_MODES = ("Uniform", "Adaptive")
+PROFILES = ("Mean", "Max")
+
+# Adaptive bins: points of the profile more than NOISE_FACTOR noise levels
+# above its median are signal, and valleys shallower than that are not
+# bin edges. Signal stretches narrower than the minimum width are noise.
+NOISE_FACTOR = 5.0
+MIN_BIN_WIDTH = 0.002  # ppm
+
+def perform_binning(bin_size, mode="Uniform", profile="Mean", noise_factor=NOISE_FACTOR,
+                    min_width=MIN_BIN_WIDTH):
+    """
+    Bin all spectra into uniform bins of bin_size ppm, or into adaptive bins
+    whose edges follow the valleys of the dataset's mean or max spectrum
+    (see adaptive_bin_edges; bin_size is then unused).
+    """
+    if mode not in BINNING_MODES:
+        raise ValueError(f"Unknown binning mode '{mode}'")
     if not globals.selected_pdata_dirs:
         messagebox.showerror("Error", "Select dataset first.")
         return None
@@ -13,45 +37,163 @@ def perform_binning(bin_size):
     all_ppm_scales = []
     PDATA = []
     sample_names = []
+    df = None
+
+    # Spectra that are already loaded are binned from memory (or their memory
+    # map) instead of being read into a second copy
+    loaded = {pdata_dir: (ppm_scale, data) for ppm_scale, data, _, pdata_dir in globals.spectra}
+
+    with diagnostics.track_stage("Binning") as record:
+        for root_dir in globals.selected_pdata_dirs:
+            for pdata_dir in file_io.find_pdata_directories(root_dir):
+                try:
+                    if pdata_dir in loaded:
+                        ppm_scale, data = loaded[pdata_dir]
+                    else:
+                        # Load spectrum data
+                        import nmrglue as ng
+                        dic, data = ng.bruker.read_pdata(pdata_dir, scale_data=True)
+                        data = file_io.to_storage_dtype(data)
+                        udic = ng.bruker.guess_udic(dic, data)
+                        uc = ng.fileiobase.uc_from_udic(udic)
+                        ppm_scale = uc.ppm_scale()
+                    sample_name = file_io.get_sample_name(pdata_dir)
+
+                    all_ppm_scales.append(ppm_scale)
+                    PDATA.append((pdata_dir, data))
+                    sample_names.append(sample_name)
+                except:
+                    continue
+        record["Spectra"] = len(PDATA)
+
+        if all_ppm_scales:
+            # Calculate global ppm range
+            minppm = min([p.min() for p in all_ppm_scales])
+            maxppm = max([p.max() for p in all_ppm_scales])
+
+            # Create bins
+            if mode == "Uniform":
+                bins = np.arange(minppm, maxppm, bin_size)
+                keep = np.ones(len(bins) - 1, dtype=bool)
+            else:
+                # The first spectrum's own (raw, monotonic) axis; alignment moves the data, not the axis
+                grid = all_ppm_scales[0]
+                bins, keep = adaptive_bin_edges(grid, dataset_profile(PDATA, all_ppm_scales, grid, profile),
+                                                noise_factor, min_width)
+
+            # Perform binning
+            matrix = []
+
+            for (pdata_dir, data), ppm in zip(PDATA, all_ppm_scales):
+                # Scaling the bin sums leaves the spectrum itself uncopied
+                matrix.append(bin_spectrum(ppm, preprocessed(ppm, data, pdata_dir), bins)[keep]
+                              / normalization.factor(pdata_dir))
+
+            # Create DataFrame
+            # Adaptive edges can lie closer than 0.001 ppm, so their names carry a fourth decimal
+            precision = 3 if mode == "Uniform" else 4
+            df = pd.DataFrame(matrix, columns=[f"{start:.{precision}f}" for start in bins[:-1][keep]])
+            df.index = sample_names
+            if mode == "Adaptive":
+                df.attrs["bin_ends"] = bins[1:][keep]
 
-    for root_dir in globals.selected_pdata_dirs:
-        for pdata_dir in file_io.find_pdata_directories(root_dir):
-            try:
-                # Load spectrum data
-                import nmrglue as ng
-                dic, data = ng.bruker.read_pdata(pdata_dir, scale_data=True)
-                udic = ng.bruker.guess_udic(dic, data)
-                uc = ng.fileiobase.uc_from_udic(udic)
-                ppm_scale = uc.ppm_scale()
-                sample_name = file_io.get_sample_name(pdata_dir)
-
-                all_ppm_scales.append(ppm_scale)
-                PDATA.append((pdata_dir, data))
-                sample_names.append(sample_name)
-            except:
-                continue
-
-    if not all_ppm_scales:
+    if df is None:
         messagebox.showerror("Error", "No spectra found to process.")
         return None
+    
+    return df
 
-    # Calculate global ppm range
-    minppm = min([p.min() for p in all_ppm_scales])
-    maxppm = max([p.max() for p in all_ppm_scales])
+def preprocessed(ppm_scale, data, pdata_dir):
+    """
+    Spectrum data as binned: baseline-corrected (like the normalization
+    factors) and with its alignment shifts removed, one spectrum at a time.
+    """
+    return alignment.aligned_data(ppm_scale, baseline.corrected_data(pdata_dir, data), pdata_dir)
 
-    # Create bins
-    bins = np.arange(minppm, maxppm, bin_size)
+def bin_spectrum(ppm_scale, data, bins):
+    """
+    Sum intensities into bins in a single pass.
 
-    # Perform binning
-    matrix = []
+    np.bincount accumulates its weights in float64, so float32 spectra are
+    summed at full precision. Points outside [bins[0], bins[-1]) are dropped.
+    """
+    idx = np.digitize(ppm_scale, bins)
+    sums = np.bincount(idx, weights=data, minlength=len(bins) + 1)
+    return sums[1:len(bins)]
 
-    for (pdata_dir, data), ppm in zip(PDATA, all_ppm_scales):
-        idx = np.digitize(ppm, bins)
-        binned = [data[idx == i].sum() for i in range(1, len(bins))]
-        matrix.append(binned)
+def dataset_profile(pdata, ppm_scales, grid, profile="Mean"):
+    """Mean or max of the (normalized) spectra on the common grid, one spectrum at a time."""
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown profile '{profile}'")
+    result = None
+    for (pdata_dir, data), ppm in zip(pdata, ppm_scales):
+        row = normalization.normalized(pdata_dir, stacking.on_grid(ppm, preprocessed(ppm, data, pdata_dir), grid))
+        row = row.astype(np.float64)
+        if result is None:
+            result = row.copy()
+        elif profile == "Mean":
+            result += row
+        else:
+            np.maximum(result, row, out=result)
+    return result / len(pdata) if profile == "Mean" else result
 
-    # Create DataFrame
-    df = pd.DataFrame(matrix, columns=[f"{bins[i]:.3f}" for i in range(len(bins)-1)])
-    df.index = sample_names
-    
-    return df
\ No newline at end of file
+def adaptive_bin_edges(grid, profile, noise_factor=NOISE_FACTOR, min_width=MIN_BIN_WIDTH):
+    """
+    Ascending bin edges (ppm) from the valleys of a dataset profile, and a
+    mask of the bins to keep.
+
+    Points more than noise_factor times the profile's noise level above its
+    median are signal; the edges of each signal stretch are bin edges, and
+    inside a stretch so are local minima with a prominence above the same
+    threshold (found once with scipy.signal.find_peaks on -profile) at least
+    min_width apart. Each noise stretch between signals becomes one merged
+    bin, and bins inside globals.excluded_regions are dropped.
+    """
+    ascending = grid[0] < grid[-1]
+    x = grid if ascending else grid[::-1]
+    y = np.asarray(profile if ascending else profile[::-1], dtype=np.float64)
+    if np.any(np.diff(x) <= 0):
+        raise ValueError("Adaptive binning needs a strictly monotonic ppm grid.")
+    spacing = abs(x[-1] - x[0]) / max(len(x) - 1, 1)
+    min_points = max(1, int(np.ceil(min_width / spacing)))
+    threshold = noise_factor * spectrum_index.estimate_noise(y)
+
+    excluded = ~normalization.included_mask(x)
+    signal = (y - np.median(y) > threshold) & ~excluded
+
+    # Signal stretches narrower than the minimum width are spikes
+    changes = np.flatnonzero(np.diff(np.concatenate(([0], signal.astype(np.int8), [0]))))
+    for start, end in zip(changes[::2], changes[1::2]):
+        if end - start < min_points:
+            signal[start:end] = False
+
+    category = np.where(excluded, 2, signal.astype(np.int8))
+    boundaries = np.flatnonzero(np.diff(category)) + 1
+    valleys, _ = find_peaks(-y, prominence=threshold, distance=min_points)
+    valleys = valleys[signal[valleys]]
+    edges = np.unique(np.concatenate(([0], boundaries, valleys, [len(x)])))
+
+    # Edges lie halfway between grid points; the outer edges take in the end points
+    padded = np.concatenate(([x[0] - spacing / 2], (x[:-1] + x[1:]) / 2, [x[-1] + spacing / 2]))
+    return padded[edges], category[edges[:-1]] != 2
+
+def bin_bounds(binning_results):
+    """Start and end ppm of every bin column (uniform widths unless the ends are stored)."""
+    starts = np.array([float(column) for column in binning_results.columns])
+    if "bin_ends" in binning_results.attrs:
+        return starts, np.asarray(binning_results.attrs["bin_ends"], dtype=float)
+    width = abs(np.median(np.diff(starts))) if len(starts) > 1 else globals.binning_step
+    return starts, starts + width
+
+def bin_annotations(binning_results):
+    """
+    Metabolite region(s) overlapping every bin column, as a DataFrame of
+    Bin, PPM_Start, PPM_End and Metabolite.
+    """
+    starts, ends = bin_bounds(binning_results)
+    return pd.DataFrame({
+        "Bin": list(binning_results.columns),
+        "PPM_Start": starts,
+        "PPM_End": ends,
+        "Metabolite": interval_index.overlap_labels(starts, ends),
+    })
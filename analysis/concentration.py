@@ -2,7 +2,10 @@ import numpy as np
 import pandas as pd
 from tkinter import messagebox
 import file_io
+from analysis import alignment
+from analysis import baseline
 import globals
+import diagnostics
 
 def calculate_concentrations(tsp_concentration):
     """Calculate concentrations for all spectra."""
@@ -17,57 +20,113 @@ def calculate_concentrations(tsp_concentration):
     results_concentration = []
     results_area = []
 
-    for root_dir in globals.selected_pdata_dirs:
-        pdata_dirs = file_io.find_pdata_directories(root_dir)
+    with diagnostics.track_stage("Concentration") as record:
+        for root_dir in globals.selected_pdata_dirs:
+            pdata_dirs = file_io.find_pdata_directories(root_dir)
 
-        for pdata_dir in pdata_dirs:
-            try:
-                dic, data = file_io.load_bruker_data(pdata_dir)
-                if dic is None:
-                    continue
+            for pdata_dir in pdata_dirs:
+                try:
+                    if globals.region_only_loading:
+                        conc, area = quantify_regions(pdata_dir, file_io.get_sample_name(pdata_dir),
+                                                      tsp_concentration)
+                        results_concentration.extend(conc)
+                        results_area.extend(area)
+                        continue
+
+                    dic, data = file_io.load_bruker_data(pdata_dir)
+                    if dic is None:
+                        continue
                     
-                ppm_scale, sample_name = file_io.get_spectrum_info(dic, data, pdata_dir)
+                    ppm_scale, sample_name = file_io.get_spectrum_info(dic, data, pdata_dir)
                 
-                # Calculate reference peak area
-                ref_start = globals.peak_limits.at[0, "ppm start"]
-                ref_end = globals.peak_limits.at[0, "ppm end"]
-                ref_protons = globals.peak_limits.at[0, "# protons"]
-
-                ref_area = calculate_peak_area(ppm_scale, data, ref_start, ref_end)
-
-                # Calculate concentrations for other peaks
-                for _, row in globals.peak_limits.iloc[1:].iterrows():
-                    name = row["Peak identity"]
-                    start = row["ppm start"]
-                    end = row["ppm end"]
-                    nprotons = row["# protons"]
-
-                    area = calculate_peak_area(ppm_scale, data, start, end)
-                    results_area.append({
-                        "Sample": sample_name, 
-                        "Peak": name, 
-                        "Area": area, 
-                        "Parent File Path": pdata_dir
-                    })
-
-                    if tsp_concentration != 0:
-                        conc = (area/ref_area)*tsp_concentration*(ref_protons/nprotons)
-                        results_concentration.append({
-                            "Sample": sample_name, 
-                            "Peak": name, 
-                            "Concentration": conc, 
-                            "Parent File Path": pdata_dir
-                        })
+                    conc, area = quantify_spectrum(ppm_scale, data, sample_name, pdata_dir, tsp_concentration)
+                    results_concentration.extend(conc)
+                    results_area.extend(area)
+
+                except Exception as e:
+                    continue
+        record["Spectra"] = len({r["Parent File Path"] for r in results_area})
+
+    return results_concentration, results_area
 
+def calculate_concentrations_for_spectra(spectra, tsp_concentration):
+    """Calculate concentrations for the given spectra only."""
+    results_concentration = []
+    results_area = []
+
+    if globals.peak_limits.empty:
+        return results_concentration, results_area
+
+    with diagnostics.track_stage("Concentration", len(spectra)):
+        for ppm_scale, data, sample_name, pdata_dir in spectra:
+            try:
+                conc, area = quantify_spectrum(ppm_scale, data, sample_name, pdata_dir, tsp_concentration)
             except Exception as e:
+                print(f"Error quantifying {sample_name}: {e}")
                 continue
+            results_concentration.extend(conc)
+            results_area.extend(area)
+
+    return results_concentration, results_area
+
+def quantify_spectrum(ppm_scale, data, sample_name, pdata_dir, tsp_concentration):
+    """Calculate peak areas and concentrations for a single spectrum."""
+    data = baseline.corrected_data(pdata_dir, data)
+
+    # Calculate reference peak area
+    ref_start = globals.peak_limits.at[0, "ppm start"]
+    ref_end = globals.peak_limits.at[0, "ppm end"]
+
+    ref_offset = alignment.region_offset(pdata_dir, ref_start, ref_end)
+    ref_area = calculate_peak_area(ppm_scale, data, ref_start + ref_offset, ref_end + ref_offset)
+
+    areas = []
+    for _, row in globals.peak_limits.iloc[1:].iterrows():
+        offset = alignment.region_offset(pdata_dir, row["ppm start"], row["ppm end"])
+        areas.append(calculate_peak_area(ppm_scale, data, row["ppm start"] + offset, row["ppm end"] + offset))
+
+    return concentration_rows(ref_area, areas, sample_name, pdata_dir, tsp_concentration)
+
+def quantify_regions(pdata_dir, sample_name, tsp_concentration):
+    """
+    Calculate peak areas and concentrations for a spectrum on disk, reading
+    only the peak_limits windows from its 1r file (no baseline correction).
+    """
+    starts, ends = alignment.shifted_windows(pdata_dir, globals.peak_limits)
+    areas = file_io.read_region_sums(pdata_dir, starts, ends)
+    return concentration_rows(areas[0], areas[1:], sample_name, pdata_dir, tsp_concentration)
+
+def concentration_rows(ref_area, areas, sample_name, pdata_dir, tsp_concentration):
+    """Area and concentration rows for the peak_limits rows after the reference."""
+    results_concentration = []
+    results_area = []
+    ref_protons = globals.peak_limits.at[0, "# protons"]
+
+    # Calculate concentrations for other peaks
+    for name, nprotons, area in zip(globals.peak_limits["Peak identity"].iloc[1:].tolist(),
+                                    globals.peak_limits["# protons"].iloc[1:].tolist(), areas):
+        results_area.append({
+            "Sample": sample_name, 
+            "Peak": name, 
+            "Area": area, 
+            "Parent File Path": pdata_dir
+        })
+
+        if tsp_concentration != 0:
+            conc = (area/ref_area)*tsp_concentration*(ref_protons/nprotons)
+            results_concentration.append({
+                "Sample": sample_name, 
+                "Peak": name, 
+                "Concentration": conc, 
+                "Parent File Path": pdata_dir
+            })
 
     return results_concentration, results_area
 
 def calculate_peak_area(ppm_scale, data, start_ppm, end_ppm):
-    """Calculate peak area by summation."""
+    """Calculate peak area by summation (accumulated in float64)."""
     s = np.abs(ppm_scale - start_ppm).argmin()
     e = np.abs(ppm_scale - end_ppm).argmin()
     if s > e: 
         s, e = e, s
-    return data[s:e+1].sum()
\ No newline at end of file
+    return data[s:e+1].sum(dtype=np.float64)
\ No newline at end of file
@@ -1,11 +1,31 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
-from scipy.signal import find_peaks, savgol_filter
+from scipy.signal import find_peaks, peak_widths, savgol_filter
 from scipy.integrate import simpson as simps
 from scipy.optimize import curve_fit
 from tkinter import messagebox
 import matplotlib.pyplot as plt
 import gui
 import globals
+import diagnostics
+from analysis import interval_index
+from analysis import deconvolution_cache
+from analysis import spectrum_index
+
+# Whole-spectrum deconvolution: points more than SEGMENT_THRESHOLD_SIGMA noise
+# levels above the local baseline belong to a signal; signals closer than
+# twice SEGMENT_PAD_PPM are fitted together as one cluster
+SEGMENT_THRESHOLD_SIGMA = 5.0
+SEGMENT_PAD_PPM = 0.005
+SEGMENT_BLOCK_POINTS = 1024
+MAX_CLUSTER_PEAKS = 10
+
+# Model-order selection: largest peak count tried, and how many larger
+# counts must fail to improve the criterion before the search stops
+MAX_ORDER_PEAKS = 8
+ORDER_PATIENCE = 2
+ORDER_CRITERIA = ("AIC", "BIC")
 
 def lorentzian(x, amplitude, mean, gamma):
     """Lorentzian function for peak fitting - better for NMR peaks."""
@@ -21,6 +41,77 @@ def multi_lorentzian(x, *params):
         y += lorentzian(x, amplitude, mean, gamma)
     return y
 
+# Multiplet lineshapes: number of coupling constants, line offsets in units of
+# each J, and relative line intensities (strongest line = 1). Lines of a
+# multiplet share one amplitude, one centre and one linewidth.
+FREE_MODEL = "Free"
+MULTIPLET_MODELS = {
+    "Singlet": (0, [[]], [1]),
+    "Doublet": (1, [[-0.5], [0.5]], [1, 1]),
+    "Triplet": (1, [[-1], [0], [1]], [0.5, 1, 0.5]),
+    "Doublet of doublets": (2, [[-0.5, -0.5], [-0.5, 0.5], [0.5, -0.5], [0.5, 0.5]], [1, 1, 1, 1]),
+    "Quartet": (1, [[-1.5], [-0.5], [0.5], [1.5]], [1/3, 1, 1, 1/3]),
+}
+MULTIPLICITY_SYMBOLS = {"Singlet": "s", "Doublet": "d", "Triplet": "t", "Doublet of doublets": "dd", "Quartet": "q"}
+LINESHAPE_MODELS = [FREE_MODEL] + list(MULTIPLET_MODELS)
+
+def multiplet_lines(params, model):
+    """Expand multiplet parameters (amplitude, centre, gamma, J...) into Lorentzian triples."""
+    n_couplings, offsets, weights = MULTIPLET_MODELS[model]
+    size = 3 + n_couplings
+    lines = []
+    for i in range(0, len(params), size):
+        amplitude, center, gamma = params[i:i+3]
+        couplings = params[i+3:i+size]
+        for offset, weight in zip(offsets, weights):
+            lines.extend([amplitude * weight, center + sum(o * j for o, j in zip(offset, couplings)), gamma])
+    return lines
+
+def multiplet_function(model):
+    """curve_fit model for a region made of multiplets of one type."""
+    def multi_multiplet(x, *params):
+        return multi_lorentzian(x, *multiplet_lines(params, model))
+    return multi_multiplet
+
+def initial_multiplet_parameters(x_data, y_data, num_multiplets, baseline, model):
+    """
+    Initial (amplitude, centre, gamma, J...) per multiplet.
+
+    The strongest local maxima are taken as lines (falling back to the free
+    peak estimate when there are too few), sorted by position and grouped
+    into consecutive multiplets; J comes from the spacing within a group.
+    """
+    n_couplings, offsets, weights = MULTIPLET_MODELS[model]
+    n_lines = len(weights)
+    n_needed = num_multiplets * n_lines
+
+    # Multiplet lines are often closer than the spacing estimate_initial_parameters assumes
+    y_above = y_data - baseline
+    maxima, _ = find_peaks(y_above, prominence=np.max(y_above) * 0.02)
+    if len(maxima) >= n_needed:
+        maxima = np.sort(maxima[np.argsort(y_above[maxima])[::-1][:n_needed]])
+        widths = peak_widths(y_above, maxima, rel_height=0.5)[0]
+        spacing = abs(x_data[-1] - x_data[0]) / (len(x_data) - 1)
+        lines = [(y_above[i], x_data[i], max(w * spacing / 2, spacing)) for i, w in zip(maxima, widths)]
+    else:
+        line_params = estimate_initial_parameters(x_data, y_data, n_needed, baseline)
+        lines = list(zip(line_params[0::3], line_params[1::3], line_params[2::3]))
+    lines.sort(key=lambda l: l[1])
+
+    params = []
+    for m in range(num_multiplets):
+        group = lines[m * n_lines:(m + 1) * n_lines]
+        positions = [mean for _, mean, _ in group]
+        params.extend([max(amplitude for amplitude, _, _ in group), float(np.mean(positions)),
+                       float(np.mean([gamma for _, _, gamma in group]))])
+        if n_couplings == 1:
+            span = offsets[-1][0] - offsets[0][0]
+            params.append((positions[-1] - positions[0]) / span)
+        elif n_couplings == 2:
+            # dd lines in order: c-J1/2-J2/2, c-J1/2+J2/2, c+J1/2-J2/2, c+J1/2+J2/2
+            params.extend([positions[2] - positions[0], positions[1] - positions[0]])
+    return params
+
 def find_optimal_peak_count(x_data, y_data, max_peaks=10):
     """
     Suggest optimal number of peaks for deconvolution based on peak prominence.
@@ -246,11 +337,12 @@ def estimate_initial_parameters(x_data, y_data, num_peaks, baseline):
     
     return initial_params
 
-def perform_deconvolution(ppm_scale, data, sample_name, start_ppm, end_ppm, num_peaks, max_iterations,
-                         deconv_fig, deconv_canvas):
-    """Perform spectral deconvolution with Lorentzian peaks."""
-    import globals
-    
+def extract_region(ppm_scale, data, start_ppm, end_ppm, num_peaks):
+    """
+    Validate the region and return (start_ppm, end_ppm, x_data, y_data).
+
+    Raises ValueError with a user-facing message when the region cannot be fitted.
+    """
     # Validate and adjust region boundaries
     start_ppm, end_ppm = validate_region_boundaries(ppm_scale, start_ppm, end_ppm)
     
@@ -259,8 +351,7 @@ def perform_deconvolution(ppm_scale, data, sample_name, start_ppm, end_ppm, num_
         start_idx = np.abs(ppm_scale - start_ppm).argmin()
         end_idx = np.abs(ppm_scale - end_ppm).argmin()
     except Exception as e:
-        messagebox.showerror("Error", f"Failed to find region boundaries: {str(e)}")
-        return False
+        raise ValueError(f"Failed to find region boundaries: {str(e)}")
     
     # Ensure proper ordering
     if start_idx > end_idx:
@@ -272,34 +363,53 @@ def perform_deconvolution(ppm_scale, data, sample_name, start_ppm, end_ppm, num_
     
     # Ensure we have enough data points
     if end_idx - start_idx < 10:  # Minimum 10 data points
-        messagebox.showerror("Error", "Selected region is too small. Please select a larger region.")
-        return False
+        raise ValueError("Selected region is too small. Please select a larger region.")
     
     x_data = ppm_scale[start_idx:end_idx+1]
-    y_data = data[start_idx:end_idx+1]
-    
-    print(f"Deconvolution region: {len(x_data)} points, {x_data[0]:.2f} to {x_data[-1]:.2f} ppm")
+    y_data = data[start_idx:end_idx+1].astype(np.float64)
     
     if len(x_data) < num_peaks * 3:
-        messagebox.showerror("Error", f"Region too small for {num_peaks} peaks. Region has {len(x_data)} points, need at least {num_peaks * 3}.")
-        return False
+        raise ValueError(f"Region too small for {num_peaks} peaks. Region has {len(x_data)} points, need at least {num_peaks * 3}.")
     
-    # Estimate baseline using advanced method
-    baseline = estimate_baseline_advanced(x_data, y_data)
+    return start_ppm, end_ppm, x_data, y_data
+
+def fit_region(x_data, y_data, start_ppm, end_ppm, num_peaks, max_iterations,
+               baseline_corrected=False, baseline_window=51, model=FREE_MODEL):
+    """
+    Fit num_peaks Lorentzians, or num_peaks multiplets of one type, to one region.
+
+    Returns a dict with the fitted Lorentzian line parameters (popt), the
+    component each line belongs to, the regional baseline, one result row
+    per peak or multiplet (without the sample name) and the integration
+    regions used for plotting. Raises when curve fitting fails.
+    """
+    print(f"Deconvolution region: {len(x_data)} points, {x_data[0]:.2f} to {x_data[-1]:.2f} ppm")
+    
+    # Estimate baseline using advanced method, unless already corrected
+    if baseline_corrected:
+        baseline = 0.0
+    else:
+        baseline = estimate_baseline_advanced(x_data, y_data, window_size=baseline_window)
     print(f"Estimated baseline: {baseline:.1f}")
     
     # Subtract baseline for fitting
     y_data_corrected = y_data - baseline
     
+    x_range = x_data.max() - x_data.min()
+    n_couplings = 0 if model == FREE_MODEL else MULTIPLET_MODELS[model][0]
+    
     # Get better initial parameters using refined local maxima
-    initial_params = estimate_initial_parameters(x_data, y_data, num_peaks, baseline)
+    if model == FREE_MODEL:
+        function = multi_lorentzian
+        initial_params = estimate_initial_parameters(x_data, y_data, num_peaks, baseline)
+    else:
+        function = multiplet_function(model)
+        initial_params = initial_multiplet_parameters(x_data, y_data, num_peaks, baseline, model)
     
     # Set bounds for parameters
     lower_bounds = []
     upper_bounds = []
     
-    x_range = x_data.max() - x_data.min()
-    
     for i in range(num_peaks):
         # Wider bounds for mean to allow peak positions to adjust
         mean_lower = x_data.min() - 0.1
@@ -312,111 +422,425 @@ def perform_deconvolution(ppm_scale, data, sample_name, start_ppm, end_ppm, num_
         gamma_lower = 0.001
         gamma_upper = min(0.2, x_range * 0.4)
         
-        lower_bounds.extend([0, mean_lower, gamma_lower])
-        upper_bounds.extend([amp_upper, mean_upper, gamma_upper])
+        lower_bounds.extend([0, mean_lower, gamma_lower] + [0] * n_couplings)
+        upper_bounds.extend([amp_upper, mean_upper, gamma_upper] + [x_range] * n_couplings)
     
-    try:
-        print("Starting curve fitting with Lorentzian peaks...")
+    # Start inside the bounds
+    initial_params = np.clip(initial_params, lower_bounds, upper_bounds)
+    
+    print(f"Starting curve fitting with Lorentzian peaks ({model})...")
+    
+    # Perform curve fitting on baseline-corrected data with Lorentzian
+    model_params, pcov = curve_fit(function, x_data, y_data_corrected, 
+                                   p0=initial_params, 
+                                   maxfev=max_iterations,
+                                   bounds=(lower_bounds, upper_bounds),
+                                   method='trf')
+    
+    print("Lorentzian curve fitting completed successfully")
+    
+    # Each component (a free peak or a whole multiplet) is reported and integrated as one peak
+    size = 3 + n_couplings
+    components = [model_params[i:i+size] for i in range(0, len(model_params), size)]
+    if model == FREE_MODEL:
+        component_lines = [list(c) for c in components]
+    else:
+        component_lines = [multiplet_lines(c, model) for c in components]
+    
+    # Calculate individual peaks and integrals - ACCEPT ALL PEAKS
+    peaks = []
+    integration_regions = []
+    popt = []
+    line_components = []
+    
+    for component, lines in zip(components, component_lines):
+        amplitude, mean, gamma = component[:3]
         
-        # Perform curve fitting on baseline-corrected data with Lorentzian
-        popt, pcov = curve_fit(multi_lorentzian, x_data, y_data_corrected, 
-                              p0=initial_params, 
-                              maxfev=max_iterations,
-                              bounds=(lower_bounds, upper_bounds),
-                              method='trf')
+        print(f"Fitted peak {len(peaks) + 1}: pos={mean:.3f}, amp={amplitude:.1f}, gamma={gamma:.4f}")
         
-        print("Lorentzian curve fitting completed successfully")
+        # ACCEPT ALL FITTED PEAKS
+        individual_lorentzian = multi_lorentzian(x_data, *lines)
+        individual_lorentzian_with_baseline = individual_lorentzian + baseline
+        popt.extend(lines)
+        line_components.extend([len(peaks)] * (len(lines) // 3))
         
-        # Calculate individual peaks and integrals - ACCEPT ALL PEAKS
-        globals.deconvolution_results = []
-        integration_regions = []
+        # Find integration boundaries with bounds checking
+        start_int_idx, end_int_idx = find_peak_integration_bounds(x_data, individual_lorentzian_with_baseline, baseline)
         
-        for i in range(0, len(popt), 3):
-            amplitude = popt[i]
-            mean = popt[i+1]
-            gamma = popt[i+2]
-            
-            print(f"Fitted peak {i//3 + 1}: pos={mean:.3f}, amp={amplitude:.1f}, gamma={gamma:.4f}")
-            
-            # ACCEPT ALL FITTED PEAKS
-            individual_lorentzian = lorentzian(x_data, amplitude, mean, gamma)
-            individual_lorentzian_with_baseline = individual_lorentzian + baseline
-            
-            # Find integration boundaries with bounds checking
-            start_int_idx, end_int_idx = find_peak_integration_bounds(x_data, individual_lorentzian_with_baseline, baseline)
-            
-            # Ensure integration indices are valid
-            start_int_idx = max(0, start_int_idx)
-            end_int_idx = min(len(x_data)-1, end_int_idx)
-            
-            if start_int_idx >= end_int_idx:
-                start_int_idx = max(0, end_int_idx - 1)
-                end_int_idx = min(len(x_data)-1, start_int_idx + 1)
+        # Ensure integration indices are valid
+        start_int_idx = max(0, start_int_idx)
+        end_int_idx = min(len(x_data)-1, end_int_idx)
+        
+        if start_int_idx >= end_int_idx:
+            start_int_idx = max(0, end_int_idx - 1)
+            end_int_idx = min(len(x_data)-1, start_int_idx + 1)
+        
+        # Extract integration region
+        x_integrate = x_data[start_int_idx:end_int_idx+1]
+        y_peak_region = individual_lorentzian_with_baseline[start_int_idx:end_int_idx+1]
+        
+        # Calculate integral - USE RAW DATA APPROACH like integration.py
+        if len(x_integrate) > 1:
+            # Get the corresponding raw data for this integration region
+            start_raw_idx = np.abs(x_data - x_integrate[0]).argmin()
+            end_raw_idx = np.abs(x_data - x_integrate[-1]).argmin()
             
-            # Extract integration region
-            x_integrate = x_data[start_int_idx:end_int_idx+1]
-            y_peak_region = individual_lorentzian_with_baseline[start_int_idx:end_int_idx+1]
+            # Ensure indices are valid
+            start_raw_idx = max(0, start_raw_idx)
+            end_raw_idx = min(len(y_data)-1, end_raw_idx)
             
-            # Calculate integral - USE RAW DATA APPROACH like integration.py
-            if len(x_integrate) > 1:
-                # Get the corresponding raw data for this integration region
-                start_raw_idx = np.abs(x_data - x_integrate[0]).argmin()
-                end_raw_idx = np.abs(x_data - x_integrate[-1]).argmin()
-                
-                # Ensure indices are valid
-                start_raw_idx = max(0, start_raw_idx)
-                end_raw_idx = min(len(y_data)-1, end_raw_idx)
-                
-                if start_raw_idx < end_raw_idx:
-                    # Use the same summation method as integration.py
-                    integral = y_data[start_raw_idx:end_raw_idx+1].sum()
-                else:
-                    integral = 0
+            if start_raw_idx < end_raw_idx:
+                # Use the same summation method as integration.py
+                integral = y_data[start_raw_idx:end_raw_idx+1].sum()
             else:
                 integral = 0
-            
-            # STORE ALL PEAKS
-            integration_regions.append({
-                'x': x_integrate,
-                'y_peak': y_peak_region,
-                'y_baseline': np.full_like(y_peak_region, baseline),
-                'peak_number': len(globals.deconvolution_results) + 1,
-                'integral': integral
-            })
-            
-            globals.deconvolution_results.append({
-                "Sample": sample_name,
-                "Region": f"{start_ppm:.2f}-{end_ppm:.2f}",
-                "Peak": f"Peak_{len(globals.deconvolution_results) + 1}",
-                "Center_PPM": mean,
-                "Amplitude": amplitude,
-                "Width": gamma * 2,  # FWHM for Lorentzian = 2*gamma
-                "Integral": integral,
-                "Gamma": gamma,
-                "Region_Start": start_ppm,
-                "Region_End": end_ppm,
-                "Integration_Start_PPM": x_data[start_int_idx] if len(x_data) > start_int_idx else start_ppm,
-                "Integration_End_PPM": x_data[end_int_idx] if len(x_data) > end_int_idx else end_ppm,
-                "Baseline": baseline
-            })
+        else:
+            integral = 0
         
-        # Plot results with integration regions
-        plot_deconvolution_results(x_data, y_data, popt, sample_name, 
-                                 start_ppm, end_ppm, deconv_fig, deconv_canvas, 
-                                 baseline, integration_regions)
+        # STORE ALL PEAKS
+        integration_regions.append({
+            'x': x_integrate,
+            'y_peak': y_peak_region,
+            'y_baseline': np.full_like(y_peak_region, baseline),
+            'peak_number': len(peaks) + 1,
+            'integral': integral
+        })
         
-        return True
+        peak = {
+            "Region": f"{start_ppm:.2f}-{end_ppm:.2f}",
+            "Peak": f"Peak_{len(peaks) + 1}",
+            "Center_PPM": mean,
+            "Amplitude": amplitude,
+            "Width": gamma * 2,  # FWHM for Lorentzian = 2*gamma
+            "Integral": integral,
+            "Gamma": gamma,
+            "Region_Start": start_ppm,
+            "Region_End": end_ppm,
+            "Integration_Start_PPM": x_data[start_int_idx] if len(x_data) > start_int_idx else start_ppm,
+            "Integration_End_PPM": x_data[end_int_idx] if len(x_data) > end_int_idx else end_ppm,
+            "Baseline": baseline
+        }
+        if model != FREE_MODEL:
+            peak["Multiplicity"] = MULTIPLICITY_SYMBOLS[model]
+            for n, coupling in enumerate(component[3:]):
+                peak[f"J{n + 1}_PPM" if n_couplings > 1 else "J_PPM"] = coupling
+        peaks.append(peak)
+    
+    return {
+        "popt": np.asarray(popt),
+        "line_components": line_components,
+        "model": model,
+        "baseline": baseline,
+        "peaks": peaks,
+        "integration_regions": integration_regions,
+    }
+
+def baseline_cache_key(baseline_corrected, baseline_window):
+    """Baseline settings that a fit depends on, as part of the memo key."""
+    if baseline_corrected:
+        settings = globals.baseline_settings or {}
+        return ("corrected", settings.get("method"), settings.get("lambda"))
+    return ("window", baseline_window)
+
+def perform_deconvolution(ppm_scale, data, sample_name, start_ppm, end_ppm, num_peaks, max_iterations,
+                         deconv_fig, deconv_canvas, baseline_corrected=False, baseline_window=51,
+                         model=FREE_MODEL):
+    """
+    Perform spectral deconvolution with Lorentzian peaks.
+
+    model is FREE_MODEL (independent peaks) or one of MULTIPLET_MODELS, in
+    which case num_peaks counts multiplets. When baseline_corrected is True
+    the data is already baseline-corrected and the regional baseline is
+    fixed at zero. Fits are memoized, so repeating a deconvolution with the
+    same data and parameters is instant.
+    """
+    try:
+        start_ppm, end_ppm, x_data, y_data = extract_region(ppm_scale, data, start_ppm, end_ppm, num_peaks)
+    except ValueError as e:
+        messagebox.showerror("Error", str(e))
+        return False
+    
+    error = None
+    with diagnostics.track_stage("Deconvolution", 1):
+        key = deconvolution_cache.fit_key(x_data, y_data, start_ppm, end_ppm, num_peaks, max_iterations,
+                                          baseline_cache_key(baseline_corrected, baseline_window), model)
+        fit = deconvolution_cache.get(key)
         
-    except Exception as e:
-        error_msg = f"Deconvolution failed: {str(e)}\n\nTry:\n- Adjusting the region boundaries\n- Reducing the number of peaks\n- Increasing max iterations\n\nDebug info: {len(x_data)} points, {num_peaks} peaks"
+        if fit is not None:
+            print(f"Deconvolution cache hit for {sample_name} ({start_ppm:.2f}-{end_ppm:.2f} ppm)")
+        else:
+            try:
+                fit = fit_region(x_data, y_data, start_ppm, end_ppm, num_peaks, max_iterations,
+                                 baseline_corrected, baseline_window, model)
+                deconvolution_cache.put(key, fit)
+            except Exception as e:
+                error = e
+    
+    if error is not None:
+        error_msg = f"Deconvolution failed: {str(error)}\n\nTry:\n- Adjusting the region boundaries\n- Reducing the number of peaks\n- Increasing max iterations\n\nDebug info: {len(x_data)} points, {num_peaks} peaks"
         messagebox.showerror("Error", error_msg)
-        print(f"Deconvolution error details: {e}")
+        print(f"Deconvolution error details: {error}")
         return False
+    
+    globals.deconvolution_results = interval_index.annotate(
+        [{"Sample": sample_name, **peak} for peak in fit["peaks"]], ppm_key="Center_PPM")
+    
+    # Plot results with integration regions
+    plot_deconvolution_results(x_data, y_data, fit["popt"], sample_name, 
+                             start_ppm, end_ppm, deconv_fig, deconv_canvas, 
+                             fit["baseline"], fit["integration_regions"], fit.get("line_components"))
+    
+    return True
+
+def local_baseline(data, block=SEGMENT_BLOCK_POINTS):
+    """Slowly varying baseline: medians of consecutive blocks, interpolated to every point."""
+    n = len(data)
+    n_blocks = max(1, n // block)
+    edges = np.linspace(0, n, n_blocks + 1).astype(int)
+    medians = [np.median(data[a:b]) for a, b in zip(edges[:-1], edges[1:])]
+    centers = (edges[:-1] + edges[1:] - 1) / 2
+    return np.interp(np.arange(n), centers, medians)
+
+def segment_spectrum(ppm_scale, data, threshold_sigma=SEGMENT_THRESHOLD_SIGMA, pad_ppm=SEGMENT_PAD_PPM):
+    """
+    Split a spectrum into independent clusters of signal separated by baseline.
+
+    Returns a list of (start_idx, end_idx) index ranges, end inclusive, in
+    index order. Clusters shorter than 10 points are dropped.
+    """
+    y = np.asarray(data, dtype=np.float64)
+    noise = spectrum_index.estimate_noise(y)
+    above = (y - local_baseline(y)) > threshold_sigma * max(noise, np.finfo(float).tiny)
+
+    # Widen every signal by pad_ppm on both sides so line tails are fitted too;
+    # signals whose padded ranges touch end up in the same cluster
+    spacing = abs(ppm_scale[-1] - ppm_scale[0]) / max(len(ppm_scale) - 1, 1)
+    pad = max(1, int(round(pad_ppm / spacing)))
+    counts = np.cumsum(np.concatenate(([0], above.astype(np.int64))))
+    idx = np.arange(len(y))
+    lo = np.clip(idx - pad, 0, len(y))
+    hi = np.clip(idx + pad + 1, 0, len(y))
+    mask = counts[hi] - counts[lo] > 0
+
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], mask.astype(np.int8), [0]))))
+    return [(start, end - 1) for start, end in zip(edges[::2], edges[1::2]) if end - start >= 10]
+
+def _fit_cluster(args):
+    """Worker: fit one cluster, returning the fit or the error message."""
+    x_data, y_data, num_peaks, max_iterations, baseline_corrected, baseline_window = args
+    try:
+        return fit_region(x_data, y_data, x_data[0], x_data[-1], num_peaks, max_iterations,
+                          baseline_corrected, baseline_window), None
+    except Exception as e:
+        return None, str(e)
+
+def deconvolve_spectrum(ppm_scale, data, max_iterations, baseline_corrected=False, baseline_window=51,
+                        threshold_sigma=SEGMENT_THRESHOLD_SIGMA, max_peaks=MAX_CLUSTER_PEAKS, workers=None):
+    """
+    Deconvolve a whole spectrum cluster by cluster.
+
+    The spectrum is segmented with segment_spectrum, the peak count of every
+    cluster is estimated with find_optimal_peak_count, and clusters not in
+    the fit cache are fitted in parallel on a process pool. Returns
+    (clusters, failures): clusters is a list of (x_data, fit) in spectrum
+    order, failures a list of (start_ppm, end_ppm, error message).
+    """
+    jobs = []
+    keys = []
+    fits = []
+    baseline_key = baseline_cache_key(baseline_corrected, baseline_window)
+    for start_idx, end_idx in segment_spectrum(ppm_scale, data, threshold_sigma):
+        x_data = ppm_scale[start_idx:end_idx+1]
+        y_data = data[start_idx:end_idx+1].astype(np.float64)
+        num_peaks = min(find_optimal_peak_count(x_data, y_data, max_peaks), len(x_data) // 3)
+        key = deconvolution_cache.fit_key(x_data, y_data, x_data[0], x_data[-1], num_peaks, max_iterations,
+                                          baseline_key)
+        keys.append(key)
+        fits.append(deconvolution_cache.get(key))
+        jobs.append((x_data, y_data, num_peaks, max_iterations, baseline_corrected, baseline_window))
+
+    pending = [i for i, fit in enumerate(fits) if fit is None]
+    print(f"Whole-spectrum deconvolution: {len(jobs)} clusters, {len(jobs) - len(pending)} cached")
+
+    workers = workers or os.cpu_count() or 1
+    pending_jobs = [jobs[i] for i in pending]
+    if workers == 1 or len(pending_jobs) < 4:
+        outcomes = [_fit_cluster(job) for job in pending_jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(_fit_cluster, pending_jobs,
+                                         chunksize=max(1, len(pending_jobs) // (workers * 4))))
+
+    failures = []
+    for i, (fit, error) in zip(pending, outcomes):
+        if fit is None:
+            x_data = jobs[i][0]
+            failures.append((x_data[0], x_data[-1], error))
+        else:
+            deconvolution_cache.put(keys[i], fit)
+            fits[i] = fit
+
+    clusters = [(job[0], fit) for job, fit in zip(jobs, fits) if fit is not None]
+    return clusters, failures
+
+def information_criteria(x_data, y_data, fit, n_params):
+    """Residual sum of squares, AIC and BIC of a fit with n_params free parameters."""
+    residuals = y_data - fit["baseline"] - multi_lorentzian(x_data, *fit["popt"])
+    n = len(y_data)
+    rss = max(float(np.dot(residuals, residuals)), np.finfo(float).tiny)
+    log_likelihood_term = n * np.log(rss / n)
+    return {"RSS": rss, "AIC": log_likelihood_term + 2 * n_params,
+            "BIC": log_likelihood_term + n_params * np.log(n)}
+
+def _fit_order(args):
+    """Worker: fit one candidate peak count, returning the fit or the error message."""
+    x_data, y_data, start_ppm, end_ppm, num_peaks, max_iterations, baseline_corrected, baseline_window, model = args
+    try:
+        return fit_region(x_data, y_data, start_ppm, end_ppm, num_peaks, max_iterations,
+                          baseline_corrected, baseline_window, model), None
+    except Exception as e:
+        return None, str(e)
+
+def select_peak_count(x_data, y_data, start_ppm, end_ppm, max_iterations, baseline_corrected=False,
+                      baseline_window=51, model=FREE_MODEL, criterion="BIC", max_peaks=MAX_ORDER_PEAKS,
+                      patience=ORDER_PATIENCE, workers=None):
+    """
+    Choose the number of peaks (or multiplets) of a region by AIC or BIC.
+
+    Candidate counts 1..max_peaks are fitted concurrently on a process pool
+    in waves of one count per worker. The search stops once the best count
+    is more than patience counts below the largest one fitted, so with
+    enough workers it takes about as long as the slowest single fit. Fits
+    go through the fit cache. Returns (best count or None, rows) where rows
+    hold Peaks, RSS, AIC, BIC and Error for every count tried.
+    """
+    if criterion not in ORDER_CRITERIA:
+        raise ValueError(f"Unknown criterion: {criterion}")
+
+    n_couplings = 0 if model == FREE_MODEL else MULTIPLET_MODELS[model][0]
+    n_lines = 1 if model == FREE_MODEL else len(MULTIPLET_MODELS[model][2])
+    max_peaks = max(1, min(max_peaks, len(x_data) // (3 * n_lines)))
+    baseline_key = baseline_cache_key(baseline_corrected, baseline_window)
+    workers = workers or os.cpu_count() or 1
+
+    rows = {}
+    fits = {}
+
+    def record(k, fit, error, key):
+        if fit is None:
+            rows[k] = {"Peaks": k, "RSS": None, "AIC": None, "BIC": None, "Error": error}
+            return
+        deconvolution_cache.put(key, fit)
+        fits[k] = fit
+        rows[k] = {"Peaks": k, **information_criteria(x_data, y_data, fit, k * (3 + n_couplings)), "Error": None}
+
+    def best_count():
+        scored = [k for k in rows if rows[k][criterion] is not None]
+        return min(scored, key=lambda k: rows[k][criterion]) if scored else None
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        next_k = 1
+        while next_k <= max_peaks:
+            wave = range(next_k, min(next_k + workers, max_peaks + 1))
+            next_k = wave[-1] + 1
+            jobs = {}
+            for k in wave:
+                key = deconvolution_cache.fit_key(x_data, y_data, start_ppm, end_ppm, k, max_iterations,
+                                                  baseline_key, model)
+                fit = deconvolution_cache.get(key)
+                if fit is not None:
+                    record(k, fit, None, key)
+                else:
+                    jobs[k] = (key, (x_data, y_data, start_ppm, end_ppm, k, max_iterations,
+                                     baseline_corrected, baseline_window, model))
+
+            if executor is None:
+                for k, (key, job) in jobs.items():
+                    record(k, *_fit_order(job), key)
+            else:
+                futures = {executor.submit(_fit_order, job): (k, key) for k, (key, job) in jobs.items()}
+                for future in as_completed(futures):
+                    k, key = futures[future]
+                    record(k, *future.result(), key)
+
+            best = best_count()
+            if best is not None and next_k - 1 - best >= patience:
+                print(f"Peak count search stopped at {next_k - 1}: {criterion} best at {best}")
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return best_count(), [rows[k] for k in sorted(rows)]
+
+def perform_full_deconvolution(ppm_scale, data, sample_name, max_iterations, deconv_fig, deconv_canvas,
+                               baseline_corrected=False, baseline_window=51,
+                               threshold_sigma=SEGMENT_THRESHOLD_SIGMA):
+    """
+    Deconvolve the whole spectrum and store one row per fitted peak.
+
+    Peaks are numbered across the spectrum; "Region" names the cluster each
+    peak was fitted in.
+    """
+    with diagnostics.track_stage("Full Deconvolution", 1):
+        clusters, failures = deconvolve_spectrum(ppm_scale, data, max_iterations, baseline_corrected,
+                                                 baseline_window, threshold_sigma)
+
+    for start_ppm, end_ppm, error in failures:
+        print(f"Cluster {start_ppm:.3f}-{end_ppm:.3f} ppm could not be fitted: {error}")
+
+    if not clusters:
+        messagebox.showerror("Error", "No peaks could be fitted in this spectrum. "
+                                      "Try a lower segmentation threshold.")
+        return None
+
+    results = []
+    for x_data, fit in clusters:
+        for peak in fit["peaks"]:
+            results.append({"Sample": sample_name, **peak, "Peak": f"Peak_{len(results) + 1}"})
+    globals.deconvolution_results = interval_index.annotate(results, ppm_key="Center_PPM")
+
+    plot_full_deconvolution(ppm_scale, data, sample_name, clusters, deconv_fig, deconv_canvas)
+
+    return {"clusters": len(clusters) + len(failures), "failed": len(failures), "peaks": len(results)}
+
+def plot_full_deconvolution(ppm_scale, data, sample_name, clusters, deconv_fig, deconv_canvas):
+    """Plot the spectrum with the fitted curve of every cluster and the fitted peak centres."""
+    deconv_fig.clear()
+    ax = deconv_fig.add_subplot(111)
+    
+    gui.setup_plot_style(ax)
+    
+    ax.plot(ppm_scale, data, color=gui.Theme.SPECTRUM_COLORS[0], linewidth=1, label='Original Data')
+    
+    for n, (x_data, fit) in enumerate(clusters):
+        fitted_curve = multi_lorentzian(x_data, *fit["popt"]) + fit["baseline"]
+        ax.plot(x_data, fitted_curve, color=gui.Theme.TEXT_ERROR, linestyle='--', linewidth=1,
+                label='Fitted Clusters' if n == 0 else "", alpha=0.8)
+        ax.axvspan(x_data[0], x_data[-1], color=gui.Theme.get_deconvolution_color(n),
+                   alpha=gui.Theme.INTEGRATION_ALPHA / 2)
+    
+    centers = [fit["popt"][i+1] for _, fit in clusters for i in range(0, len(fit["popt"]), 3)]
+    tops = [fit["popt"][i] + fit["baseline"] for _, fit in clusters for i in range(0, len(fit["popt"]), 3)]
+    ax.plot(centers, tops, 'v', color=gui.Theme.TEXT_ERROR, markersize=4, label=f'{len(centers)} Peaks')
+    
+    ax.set_xlabel("Chemical Shift (ppm)")
+    ax.set_ylabel("Intensity")
+    ax.set_title(f"Whole-Spectrum Deconvolution (Lorentzian): {sample_name}\n{len(clusters)} clusters")
+    ax.invert_xaxis()
+    ax.legend(fontsize=8)
+    deconv_canvas.draw()
 
 def plot_deconvolution_results(x_data, y_data, popt, sample_name, 
                              start_ppm, end_ppm, deconv_fig, deconv_canvas, 
-                             baseline, integration_regions):
-    """Plot deconvolution results with properly shaded integration areas."""
+                             baseline, integration_regions, line_components=None):
+    """
+    Plot deconvolution results with properly shaded integration areas.
+
+    line_components gives the peak (or multiplet) each Lorentzian line of
+    popt belongs to; lines of one multiplet share its colour and label.
+    """
     deconv_fig.clear()
     ax = deconv_fig.add_subplot(111)
     
@@ -435,10 +859,15 @@ def plot_deconvolution_results(x_data, y_data, popt, sample_name,
             linewidth=2, label='Fitted Curve', alpha=0.8)
     
     # Plot individual peaks
+    if line_components is None:
+        line_components = list(range(len(popt) // 3))
+    labelled = set()
     for i in range(0, len(popt), 3):
-        color = gui.Theme.get_deconvolution_color(i // 3)
+        component = line_components[i // 3]
+        color = gui.Theme.get_deconvolution_color(component)
         individual_peak = lorentzian(x_data, popt[i], popt[i+1], popt[i+2]) + baseline
-        peak_name = f"Peak_{i//3 + 1}"
+        peak_name = f"Peak_{component + 1}" if component not in labelled else ""
+        labelled.add(component)
         ax.plot(x_data, individual_peak, color=color, linestyle=':', 
                 linewidth=1.5, label=peak_name, alpha=0.8)
         
@@ -0,0 +1,103 @@
+import os
+import hashlib
+import pickle
+import numpy as np
+import globals
+
+def fit_key(x_data, y_data, start_ppm, end_ppm, num_peaks, max_iterations, baseline_key, model="Free"):
+    """
+    Memo key of a deconvolution fit.
+
+    The key hashes the region's ppm axis and intensities together with the
+    fit parameters, so a re-aligned or re-corrected spectrum never hits a
+    stale entry.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(np.ascontiguousarray(x_data, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(y_data, dtype=np.float64).tobytes())
+    digest.update(repr((round(start_ppm, 6), round(end_ppm, 6), num_peaks,
+                        max_iterations, baseline_key, model)).encode())
+    return digest.hexdigest()
+
+def entry_size(fit):
+    """Approximate memory footprint of a cached fit in bytes."""
+    size = 1024 * (1 + len(fit.get("peaks", [])))
+    for value in fit.values():
+        if isinstance(value, np.ndarray):
+            size += value.nbytes
+    for region in fit.get("integration_regions", []):
+        size += sum(v.nbytes for v in region.values() if isinstance(v, np.ndarray))
+    return size
+
+def _disk_path(key):
+    return os.path.join(globals.deconvolution_cache_dir, f"{key}.pkl")
+
+def get(key):
+    """Return the cached fit for key, or None. Disk hits are promoted to memory."""
+    fit = globals.deconvolution_cache.get(key)
+    if fit is not None:
+        globals.deconvolution_cache.move_to_end(key)
+        return fit
+
+    if globals.deconvolution_cache_dir:
+        path = _disk_path(key)
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as f:
+                    fit = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError) as e:
+                print(f"Ignoring unreadable cache file {path}: {e}")
+                return None
+            _store(key, fit)
+            return fit
+    return None
+
+def put(key, fit):
+    """Cache a fit in memory, and on disk when a cache folder is set."""
+    _store(key, fit)
+    if globals.deconvolution_cache_dir:
+        try:
+            os.makedirs(globals.deconvolution_cache_dir, exist_ok=True)
+            with open(_disk_path(key), 'wb') as f:
+                pickle.dump(fit, f, protocol=pickle.HIGHEST_PROTOCOL)
+            _prune_disk()
+        except OSError as e:
+            print(f"Could not write deconvolution cache file: {e}")
+
+def _prune_disk():
+    """Remove the least recently written cache files beyond the disk entry budget."""
+    folder = globals.deconvolution_cache_dir
+    paths = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('.pkl')]
+    excess = len(paths) - globals.deconvolution_cache_max_disk_entries
+    if excess > 0:
+        for path in sorted(paths, key=os.path.getmtime)[:excess]:
+            os.remove(path)
+
+def _store(key, fit):
+    """Insert into the in-memory LRU and evict down to the entry/byte budget."""
+    cache = globals.deconvolution_cache
+    if key in cache:
+        globals.deconvolution_cache_bytes -= entry_size(cache.pop(key))
+    cache[key] = fit
+    globals.deconvolution_cache_bytes += entry_size(fit)
+
+    while cache and (len(cache) > globals.deconvolution_cache_max_entries
+                     or globals.deconvolution_cache_bytes > globals.deconvolution_cache_max_bytes):
+        _, evicted = cache.popitem(last=False)
+        globals.deconvolution_cache_bytes -= entry_size(evicted)
+
+def clear(include_disk=False):
+    """Empty the in-memory cache, and the on-disk tier when include_disk is True."""
+    globals.deconvolution_cache.clear()
+    globals.deconvolution_cache_bytes = 0
+    if include_disk and globals.deconvolution_cache_dir and os.path.isdir(globals.deconvolution_cache_dir):
+        for name in os.listdir(globals.deconvolution_cache_dir):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(globals.deconvolution_cache_dir, name))
+
+def stats():
+    """Entry count and memory use of the in-memory cache."""
+    return {
+        "entries": len(globals.deconvolution_cache),
+        "bytes": globals.deconvolution_cache_bytes,
+    }
@@ -1,7 +1,11 @@
 import numpy as np
 from tkinter import messagebox
 import file_io
+from analysis import alignment
+from analysis import baseline
+from analysis import normalization
 import globals
+import diagnostics
 
 def calculate_integrals():
     """Calculate integrals for all peak regions in all spectra."""
@@ -15,46 +19,168 @@ def calculate_integrals():
 
     integration_results = []
     
-    for root_dir in globals.selected_pdata_dirs:
-        pdata_dirs = file_io.find_pdata_directories(root_dir)
-
-        for pdata_dir in pdata_dirs:
-            try:
-                # Load spectrum data
-                import nmrglue as ng
-                dic, data = ng.bruker.read_pdata(pdata_dir, scale_data=True)
-                udic = ng.bruker.guess_udic(dic, data)
-                uc = ng.fileiobase.uc_from_udic(udic)
-                ppm_scale = uc.ppm_scale()
+    with diagnostics.track_stage("Integration") as record:
+        for root_dir in globals.selected_pdata_dirs:
+            pdata_dirs = file_io.find_pdata_directories(root_dir)
+
+            for pdata_dir in pdata_dirs:
+                try:
+                    if globals.region_only_loading:
+                        integration_results.extend(
+                            integrate_regions(pdata_dir, file_io.get_sample_name(pdata_dir)))
+                        continue
+
+                    # Load spectrum data
+                    import nmrglue as ng
+                    dic, data = ng.bruker.read_pdata(pdata_dir, scale_data=True)
+                    data = file_io.to_storage_dtype(data)
+                    udic = ng.bruker.guess_udic(dic, data)
+                    uc = ng.fileiobase.uc_from_udic(udic)
+                    ppm_scale = uc.ppm_scale()
                 
-                sample_name = file_io.get_sample_name(pdata_dir)
+                    sample_name = file_io.get_sample_name(pdata_dir)
                 
-                # Calculate integrals for each peak region
-                for _, row in globals.peak_limits.iterrows():
-                    name = row["Peak identity"]
-                    start = row["ppm start"]
-                    end = row["ppm end"]
-                    
-                    integral = calculate_peak_area(ppm_scale, data, start, end)
-                    
-                    integration_results.append({
-                        "Sample": sample_name,
-                        "Peak": name,
-                        "Start (ppm)": start,
-                        "End (ppm)": end,
-                        "Integral": integral,
-                        "File Path": pdata_dir
-                    })
+                    integration_results.extend(
+                        integrate_spectrum(ppm_scale, data, sample_name, pdata_dir))
     
-            except Exception as e:
-                continue
+                except Exception as e:
+                    continue
+        record["Spectra"] = len({r["File Path"] for r in integration_results})
     
     return integration_results
 
+def integrate_spectra(spectra):
+    """Calculate integrals for every peak region of the given spectra only."""
+    if globals.peak_limits.empty:
+        return []
+
+    integration_results = []
+    with diagnostics.track_stage("Integration", len(spectra)):
+        for ppm_scale, data, sample_name, pdata_dir in spectra:
+            integration_results.extend(integrate_spectrum(ppm_scale, data, sample_name, pdata_dir))
+    return integration_results
+
+def integrate_spectrum(ppm_scale, data, sample_name, pdata_dir):
+    """Calculate integrals for each peak region of a single spectrum."""
+    results = []
+    data = baseline.corrected_data(pdata_dir, data)
+    factor = normalization.factor(pdata_dir)
+    for _, row in globals.peak_limits.iterrows():
+        name = row["Peak identity"]
+        start = row["ppm start"]
+        end = row["ppm end"]
+        
+        offset = alignment.region_offset(pdata_dir, start, end)
+        integral = calculate_peak_area(ppm_scale, data, start + offset, end + offset) / factor
+        
+        results.append({
+            "Sample": sample_name,
+            "Peak": name,
+            "Start (ppm)": start,
+            "End (ppm)": end,
+            "Integral": integral,
+            "File Path": pdata_dir
+        })
+    return results
+
+def integrate_regions(pdata_dir, sample_name):
+    """
+    Integrate each peak region of a spectrum on disk, reading only the
+    windows from its 1r file (raw intensities; no baseline correction).
+    """
+    starts, ends = alignment.shifted_windows(pdata_dir, globals.peak_limits)
+    integrals = file_io.read_region_sums(pdata_dir, starts, ends) / normalization.factor(pdata_dir)
+    # Plain column lists; iterrows would cost more than the reads themselves
+    return [{
+        "Sample": sample_name,
+        "Peak": name,
+        "Start (ppm)": start,
+        "End (ppm)": end,
+        "Integral": integral,
+        "File Path": pdata_dir
+    } for name, start, end, integral in zip(globals.peak_limits["Peak identity"].tolist(),
+                                            globals.peak_limits["ppm start"].tolist(),
+                                            globals.peak_limits["ppm end"].tolist(), integrals)]
+
+def check_region_reads(pdata_dirs, max_spectra=20):
+    """
+    Compare peak_limits integrals read as windows of the 1r file against the
+    full nmrglue read_pdata path.
+
+    Returns the number of integrals compared and the maximum and median
+    relative error (relative to the summed absolute intensity of the window).
+    """
+    import nmrglue as ng
+
+    errors = []
+    for pdata_dir in pdata_dirs[:max_spectra]:
+        dic, data = ng.bruker.read_pdata(pdata_dir, scale_data=True)
+        uc = ng.fileiobase.uc_from_udic(ng.bruker.guess_udic(dic, data))
+        ppm_scale = uc.ppm_scale()
+
+        starts, ends = alignment.shifted_windows(pdata_dir, globals.peak_limits)
+        sums = file_io.read_region_sums(pdata_dir, starts, ends)
+        for start, end, region_sum in zip(starts, ends, sums):
+            s = np.abs(ppm_scale - start).argmin()
+            e = np.abs(ppm_scale - end).argmin()
+            if s > e:
+                s, e = e, s
+            scale = np.abs(data[s:e+1]).sum()
+            if scale > 0:
+                errors.append(abs(region_sum - data[s:e+1].sum(dtype=np.float64)) / scale)
+
+    if not errors:
+        return {"Integrals Compared": 0, "Max Relative Error": 0.0, "Median Relative Error": 0.0}
+
+    return {
+        "Integrals Compared": len(errors),
+        "Max Relative Error": float(np.max(errors)),
+        "Median Relative Error": float(np.median(errors)),
+    }
+
+def check_float32_accuracy(spectra, max_spectra=20):
+    """
+    Compare peak_limits integrals from float32 storage against the float64 path.
+
+    Spectra already held as float32 are re-read from disk at full precision.
+    Returns the number of integrals compared and the maximum and median
+    relative error, where the error is taken relative to the summed absolute
+    intensity of the window (so near-zero integrals do not blow up the ratio).
+    """
+    import nmrglue as ng
+
+    errors = []
+    for ppm_scale, data, sample_name, pdata_dir in spectra[:max_spectra]:
+        if data.dtype == np.float64:
+            data64 = data
+        else:
+            _, data64 = ng.bruker.read_pdata(pdata_dir, scale_data=True)
+        data32 = data64.astype(np.float32)
+
+        for _, row in globals.peak_limits.iterrows():
+            s = np.abs(ppm_scale - row["ppm start"]).argmin()
+            e = np.abs(ppm_scale - row["ppm end"]).argmin()
+            if s > e:
+                s, e = e, s
+            exact = data64[s:e+1].sum()
+            approx = data32[s:e+1].sum(dtype=np.float64)
+            scale = np.abs(data64[s:e+1]).sum()
+            if scale > 0:
+                errors.append(abs(approx - exact) / scale)
+
+    if not errors:
+        return {"Integrals Compared": 0, "Max Relative Error": 0.0, "Median Relative Error": 0.0}
+
+    return {
+        "Integrals Compared": len(errors),
+        "Max Relative Error": float(np.max(errors)),
+        "Median Relative Error": float(np.median(errors)),
+    }
+
 def calculate_peak_area(ppm_scale, data, start_ppm, end_ppm):
-    """Calculate peak area by summation."""
+    """Calculate peak area by summation (accumulated in float64)."""
     s = np.abs(ppm_scale - start_ppm).argmin()
     e = np.abs(ppm_scale - end_ppm).argmin()
     if s > e: 
         s, e = e, s
-    return data[s:e+1].sum()
\ No newline at end of file
+    return data[s:e+1].sum(dtype=np.float64)
\ No newline at end of file
@@ -0,0 +1,86 @@
+import numpy as np
+import globals
+
+# Label of ppm values outside every defined region
+UNASSIGNED = ""
+
+def build_index(peak_limits):
+    """
+    Interval index over the peak_limits windows.
+
+    The region edges split the ppm axis into elementary segments, and every
+    segment stores which regions cover it. A lookup is then one
+    np.searchsorted over the sorted edges for a whole array of ppm values.
+    Region ends are inclusive, and overlapping regions are all reported.
+    """
+    if peak_limits is None or peak_limits.empty:
+        starts = ends = np.empty(0)
+        names = []
+    else:
+        first = peak_limits["ppm start"].to_numpy(dtype=float)
+        second = peak_limits["ppm end"].to_numpy(dtype=float)
+        starts = np.minimum(first, second)
+        ends = np.maximum(first, second)
+        names = [str(name) for name in peak_limits["Peak identity"]]
+
+    # Half-open segments [edge_i, edge_i+1); ends are pushed up by one ulp so they stay inside
+    edges = np.unique(np.concatenate((starts, np.nextafter(ends, np.inf))))
+    covers = (starts[None, :] <= edges[:, None]) & (edges[:, None] < np.nextafter(ends, np.inf)[None, :])
+    segment_regions = [tuple(int(i) for i in np.flatnonzero(row)) for row in covers]
+    segment_labels = np.array(["; ".join(names[i] for i in regions) for regions in segment_regions] + [UNASSIGNED],
+                              dtype=object)
+
+    return {
+        "source": peak_limits,
+        "starts": starts,
+        "ends": ends,
+        "names": names,
+        "edges": edges,
+        "segment_regions": segment_regions,
+        "segment_labels": segment_labels,
+    }
+
+def get_index():
+    """Interval index of the current globals.peak_limits, rebuilt when they are replaced."""
+    index = globals.peak_limits_index
+    if index is None or index["source"] is not globals.peak_limits:
+        index = build_index(globals.peak_limits)
+        globals.peak_limits_index = index
+    return index
+
+def segments(ppm_values, index=None):
+    """Segment number of every ppm value, -1 outside all regions (vectorized)."""
+    index = index or get_index()
+    ppm_values = np.asarray(ppm_values, dtype=float)
+    return np.searchsorted(index["edges"], ppm_values, side='right') - 1
+
+def labels(ppm_values, index=None):
+    """Metabolite name(s) of the regions containing each ppm value; overlaps are joined with '; '."""
+    index = index or get_index()
+    return index["segment_labels"][segments(ppm_values, index)]
+
+def containing_regions(ppm_values, index=None):
+    """Tuple of peak_limits row numbers containing each ppm value."""
+    index = index or get_index()
+    return [index["segment_regions"][s] if s >= 0 else () for s in segments(ppm_values, index)]
+
+def overlap_labels(lower, upper, index=None):
+    """
+    Metabolite name(s) of the regions overlapping each [lower, upper] range
+    (for bins, which can be wider than a region).
+    """
+    index = index or get_index()
+    lower, upper = np.asarray(lower, dtype=float), np.asarray(upper, dtype=float)
+    lower, upper = np.minimum(lower, upper), np.maximum(lower, upper)
+    if not index["names"]:
+        return np.full(len(lower), UNASSIGNED, dtype=object)
+    overlaps = (index["starts"][None, :] <= upper[:, None]) & (index["ends"][None, :] >= lower[:, None])
+    names = index["names"]
+    return np.array(["; ".join(names[i] for i in np.flatnonzero(row)) for row in overlaps], dtype=object)
+
+def annotate(rows, ppm_key="PPM", column="Metabolite"):
+    """Add the containing region name(s) to every result row dict, in place."""
+    if rows:
+        for row, name in zip(rows, labels([row[ppm_key] for row in rows])):
+            row[column] = name
+    return rows
@@ -0,0 +1,200 @@
+import numpy as np
+import pandas as pd
+from scipy.linalg import qr, svd, eigh
+import globals
+import diagnostics
+
+SCALING_METHODS = ("None", "Pareto", "UV")
+
+# Randomized SVD: extra random directions and power iterations beyond the
+# requested components (Halko, Martinsson & Tropp)
+OVERSAMPLES = 10
+POWER_ITERATIONS = 4
+
+# Rows per block when accumulating column statistics
+CHUNK_ROWS = 1024
+
+CV_FOLDS = 5
+
+# The scaled matrix Z = (X - mean) / scale is never formed: products with it
+# are computed from products with X, so a 5,000 x 20,000 binning matrix is
+# not copied for centring or scaling.
+
+def column_statistics(X, scaling="Pareto", rows=None):
+    """
+    Column means and scale factors of X (over the selected rows).
+
+    Scaling is "None" (centring only), "Pareto" (divide by sqrt of the
+    standard deviation) or "UV" (unit variance). Also returns the total sum
+    of squares of the scaled matrix, for explained-variance fractions.
+    """
+    if scaling not in SCALING_METHODS:
+        raise ValueError(f"Unknown scaling '{scaling}'")
+    row_index = np.arange(len(X)) if rows is None else np.flatnonzero(rows)
+    mean = np.zeros(X.shape[1])
+    for start in range(0, len(row_index), CHUNK_ROWS):
+        mean += X[row_index[start:start + CHUNK_ROWS]].sum(axis=0, dtype=np.float64)
+    mean /= len(row_index)
+
+    squares = np.zeros(X.shape[1])
+    for start in range(0, len(row_index), CHUNK_ROWS):
+        squares += ((X[row_index[start:start + CHUNK_ROWS]] - mean) ** 2).sum(axis=0)
+    std = np.sqrt(squares / max(len(row_index) - 1, 1))
+    std[std == 0] = 1.0
+
+    scale = {"None": np.ones_like(std), "Pareto": np.sqrt(std), "UV": std}[scaling]
+    return mean, scale, float((squares / scale**2).sum())
+
+def scaled_dot(X, mean, scale, M):
+    """Z @ M for the centred and scaled matrix Z."""
+    M = M / scale[:, None]
+    return X @ M - mean @ M
+
+def scaled_tdot(X, mean, scale, N, rows=None):
+    """Z.T @ N; rows of N outside the selected rows are ignored."""
+    if rows is not None:
+        N = np.where(rows[:, None], N, 0.0)
+    return (X.T @ N - np.outer(mean, N.sum(axis=0))) / scale[:, None]
+
+def randomized_svd(X, mean, scale, n_components, seed=0):
+    """
+    Leading singular triplets (U, S, Vt) of Z by randomized subspace iteration.
+
+    Costs a few passes of thin products over X instead of a full SVD.
+    """
+    rng = np.random.default_rng(seed)
+    size = min(n_components + OVERSAMPLES, *X.shape)
+    Q, _ = qr(scaled_dot(X, mean, scale, rng.standard_normal((X.shape[1], size))), mode='economic')
+    for _ in range(POWER_ITERATIONS):
+        Q, _ = qr(scaled_tdot(X, mean, scale, Q), mode='economic')
+        Q, _ = qr(scaled_dot(X, mean, scale, Q), mode='economic')
+    U, S, Vt = svd(scaled_tdot(X, mean, scale, Q).T, full_matrices=False)
+    return (Q @ U)[:, :n_components], S[:n_components], Vt[:n_components]
+
+def pca(binning_results, n_components=5, scaling="Pareto"):
+    """
+    Principal component analysis of a samples x bins DataFrame.
+
+    Returns a dict with scores and loadings DataFrames, the explained
+    variance fraction per component and the scaling used.
+    """
+    X = binning_results.to_numpy(dtype=np.float64)
+    n_components = max(1, min(n_components, *X.shape))
+    with diagnostics.track_stage("PCA", len(X)):
+        mean, scale, total = column_statistics(X, scaling)
+        U, S, Vt = randomized_svd(X, mean, scale, n_components)
+
+    names = [f"PC{i + 1}" for i in range(n_components)]
+    return {
+        "method": "PCA",
+        "scaling": scaling,
+        "scores": pd.DataFrame(U * S, index=binning_results.index, columns=names),
+        "loadings": pd.DataFrame(Vt.T, index=binning_results.columns, columns=names),
+        "explained": S**2 / total if total else np.zeros(n_components),
+    }
+
+def simpls(X, mean, scale, Y, n_components, rows=None):
+    """
+    SIMPLS regression of Y (centred) on Z, without deflating Z.
+
+    Returns weights R (Z @ R gives the scores), X loadings P, Y loadings Q
+    and the unnormalised scores T.
+    """
+    S = scaled_tdot(X, mean, scale, Y, rows)
+    R, P, Q, T, V = [], [], [], [], []
+    for _ in range(n_components):
+        # Dominant direction of the remaining covariance
+        _, vectors = eigh(S.T @ S)
+        r = S @ vectors[:, -1]
+        t = scaled_dot(X, mean, scale, r[:, None])[:, 0]
+        if rows is not None:
+            t = np.where(rows, t, 0.0)
+        norm = np.linalg.norm(t)
+        if norm == 0:
+            break
+        T.append(t.copy())
+        t, r = t / norm, r / norm
+        p = scaled_tdot(X, mean, scale, t[:, None], rows)[:, 0]
+        v = p - (np.column_stack(V) @ (np.column_stack(V).T @ p) if V else 0)
+        v /= np.linalg.norm(v)
+        S -= np.outer(v, v @ S)
+        R.append(r)
+        P.append(p)
+        Q.append(Y.T @ t)
+        V.append(v)
+    return np.column_stack(R), np.column_stack(P), np.column_stack(Q), np.column_stack(T)
+
+def pls_da(binning_results, groups, n_components=2, scaling="UV", cv_folds=CV_FOLDS, seed=0):
+    """
+    PLS discriminant analysis of a samples x bins DataFrame.
+
+    groups maps each sample to its class; samples without a class are left
+    out. Returns scores and X loadings DataFrames, the fraction of the class
+    matrix explained per component, the training accuracy and (with at least
+    two samples per class) the cross-validated accuracy.
+    """
+    groups = pd.Series(groups).reindex(binning_results.index)
+    keep = groups.notna().to_numpy()
+    data = binning_results if keep.all() else binning_results[keep]
+    labels = groups[keep].astype(str).to_numpy()
+    classes = np.unique(labels)
+    if len(classes) < 2:
+        raise ValueError("PLS-DA needs at least two groups.")
+
+    X = data.to_numpy(dtype=np.float64)
+    Y = (labels[:, None] == classes[None, :]).astype(float)
+    n_components = max(1, min(n_components, len(X) - 1, X.shape[1]))
+
+    def fit(rows):
+        mean, scale, _ = column_statistics(X, scaling, rows)
+        y_mean = Y[rows].mean(axis=0) if rows is not None else Y.mean(axis=0)
+        Yc = Y - y_mean
+        if rows is not None:
+            Yc = np.where(rows[:, None], Yc, 0.0)
+        R, P, Q, T = simpls(X, mean, scale, Yc, n_components, rows)
+        return mean, scale, y_mean, R, P, Q, T, Yc
+
+    with diagnostics.track_stage("PLS-DA", len(X)):
+        mean, scale, y_mean, R, P, Q, T, Yc = fit(None)
+        fitted = scaled_dot(X, mean, scale, R @ Q.T) + y_mean
+        accuracy = float((classes[fitted.argmax(axis=1)] == labels).mean())
+
+        # Cross-validated class predictions over stratified folds
+        folds = min(cv_folds, min(np.sum(labels == c) for c in classes))
+        cv_accuracy = None
+        if folds >= 2:
+            rng = np.random.default_rng(seed)
+            fold_of = np.empty(len(labels), dtype=int)
+            for c in classes:
+                members = rng.permutation(np.flatnonzero(labels == c))
+                fold_of[members] = np.arange(len(members)) % folds
+            predicted = np.empty(len(labels), dtype=object)
+            for fold in range(folds):
+                test = fold_of == fold
+                f_mean, f_scale, f_y_mean, f_R, _, f_Q, _, _ = fit(~test)
+                predicted[test] = classes[(scaled_dot(X[test], f_mean, f_scale, f_R @ f_Q.T) + f_y_mean).argmax(axis=1)]
+            cv_accuracy = float((predicted == labels).mean())
+
+    names = [f"LV{i + 1}" for i in range(T.shape[1])]
+    # Fraction of the centred class matrix explained by each latent variable
+    explained = (np.linalg.norm(Q, axis=0) ** 2) / (Yc ** 2).sum()
+    return {
+        "method": "PLS-DA",
+        "scaling": scaling,
+        "scores": pd.DataFrame(T, index=data.index, columns=names),
+        "loadings": pd.DataFrame(P, index=data.columns, columns=names),
+        "explained": explained,
+        "groups": pd.Series(labels, index=data.index),
+        "accuracy": accuracy,
+        "cv_accuracy": cv_accuracy,
+    }
+
+def sample_groups(column, samples):
+    """
+    Value of a globals.sample_metadata column for each of the given samples
+    (NaN where a sample has no metadata row), or None without that column.
+    """
+    if globals.sample_metadata is None or column not in globals.sample_metadata:
+        return None
+    values = globals.sample_metadata[column].reindex([str(sample) for sample in samples])
+    return pd.Series(values.to_numpy(), index=samples)
@@ -0,0 +1,145 @@
+import numpy as np
+import globals
+import diagnostics
+from analysis import alignment
+from analysis import baseline
+from analysis import stacking
+
+METHODS = ("None", "Total Area", "PQN", "Reference Region")
+
+# Spectra stacked per row block, and grid points per column block when the
+# PQN reference (a per-point median over all spectra) is taken
+CHUNK_SIZE = 64
+MEDIAN_BLOCK_VALUES = 16 * 1024 * 1024
+
+# Only points where the PQN reference exceeds this fraction of its maximum
+# enter the quotients, so noise does not dominate the median
+PQN_SIGNAL_FRACTION = 0.01
+
+def included_mask(grid):
+    """Grid points outside globals.excluded_regions (water, TSP, urea)."""
+    mask = np.ones(len(grid), dtype=bool)
+    for start, end in globals.excluded_regions:
+        mask &= ~((grid >= min(start, end)) & (grid <= max(start, end)))
+    return mask
+
+def stacked_block(spectra, grid, index_slice=slice(None)):
+    """Aligned, baseline-corrected spectra on grid[index_slice] as one float64 matrix."""
+    return np.vstack([stacking.on_grid(ppm_scale, alignment.aligned_data(
+                                           ppm_scale, baseline.corrected_data(pdata_dir, data), pdata_dir),
+                                       grid, index_slice)
+                      for ppm_scale, data, _, pdata_dir in spectra]).astype(np.float64, copy=False)
+
+def compute_factors(spectra, method, region=None, state=None, chunk_size=CHUNK_SIZE):
+    """
+    Normalization factors of the given spectra, dividing each spectrum by its factor.
+
+    Total Area divides by the area outside the excluded regions, Reference
+    Region by the area of the region (start, end) in ppm, and PQN (Dieterle
+    et al.) divides the total-area normalized spectra by the median quotient
+    to the median spectrum. Areas are computed for blocks of stacked spectra
+    with one matrix-vector product; factors are relative to the median area,
+    so normalized intensities stay on the scale of the raw ones.
+
+    state carries the grid, median area and PQN reference of an earlier call,
+    so spectra added later are normalized against the same reference.
+    Returns (factors array, state).
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown normalization method '{method}'")
+    if method == "None" or not spectra:
+        return np.ones(len(spectra)), state
+
+    grid = stacking.reference_grid(spectra) if state is None else state["grid"]
+    if method == "Reference Region":
+        if region is None:
+            raise ValueError("Reference region normalization needs a ppm region.")
+        weights = np.zeros(len(grid))
+        weights[stacking.region_slice(grid, *region)] = 1.0
+    else:
+        weights = included_mask(grid).astype(np.float64)
+
+    with diagnostics.track_stage(f"Normalization ({method})", len(spectra)):
+        areas = np.concatenate([stacked_block(spectra[start:start + chunk_size], grid) @ weights
+                                for start in range(0, len(spectra), chunk_size)])
+        if np.any(areas <= 0):
+            raise ValueError("Some spectra have a non-positive area in the normalization region.")
+
+        median_area = float(np.median(areas)) if state is None else state["median_area"]
+        factors = areas / median_area
+        state = {"grid": grid, "median_area": median_area,
+                 "reference": None if state is None else state.get("reference")}
+
+        if method == "PQN":
+            if state["reference"] is None:
+                state["reference"] = median_spectrum(spectra, grid, factors)
+            reference = state["reference"]
+            points = np.flatnonzero((weights > 0) & (reference > PQN_SIGNAL_FRACTION * reference.max()))
+            quotients = np.concatenate([
+                np.median(stacked_block(spectra[start:start + chunk_size], grid)[:, points]
+                          / factors[start:start + chunk_size, None] / reference[points], axis=1)
+                for start in range(0, len(spectra), chunk_size)])
+            factors = factors * quotients
+
+    return factors, state
+
+def median_spectrum(spectra, grid, factors):
+    """Per-point median of the spectra divided by their factors, over column blocks of the grid."""
+    width = max(1, MEDIAN_BLOCK_VALUES // len(spectra))
+    reference = np.empty(len(grid))
+    for start in range(0, len(grid), width):
+        columns = slice(start, min(start + width, len(grid)))
+        reference[columns] = np.median(stacked_block(spectra, grid, columns) / factors[:, None], axis=0)
+    return reference
+
+def normalize_spectra(spectra, method, region=None):
+    """Compute and cache the factors of every spectrum."""
+    factors, state = compute_factors(spectra, method, region)
+    globals.normalization_factors = {pdata_dir: float(f)
+                                     for (_, _, _, pdata_dir), f in zip(spectra, factors)}
+    globals.normalization_settings = {"method": method, "region": region, "state": state}
+    globals.trigger_event('normalization_updated')
+
+def add_spectra(new_spectra):
+    """Normalize newly added spectra against the stored reference."""
+    settings = globals.normalization_settings
+    if settings is None or not new_spectra:
+        return
+    factors, _ = compute_factors(new_spectra, settings["method"], settings["region"], settings["state"])
+    globals.normalization_factors.update(
+        {pdata_dir: float(f) for (_, _, _, pdata_dir), f in zip(new_spectra, factors)})
+    globals.trigger_event('normalization_updated')
+
+def refresh_normalization():
+    """
+    Recompute the factors with the current settings after the data they were
+    computed from changed (baseline correction or alignment); clear them if
+    that fails.
+    """
+    settings = globals.normalization_settings
+    if settings is None:
+        return
+    try:
+        normalize_spectra(globals.spectra, settings["method"], settings["region"])
+    except Exception as e:
+        print(f"Normalization cleared: {e}")
+        clear_normalization()
+
+def clear_normalization():
+    """Drop all cached normalization factors."""
+    globals.normalization_factors = {}
+    globals.normalization_settings = None
+    globals.trigger_event('normalization_updated')
+
+def is_normalized():
+    """Whether normalization factors are cached."""
+    return bool(globals.normalization_factors)
+
+def factor(pdata_dir):
+    """Cached normalization factor of a spectrum (1.0 when not normalized)."""
+    return globals.normalization_factors.get(pdata_dir, 1.0)
+
+def normalized(pdata_dir, data):
+    """Intensities divided by the spectrum's factor; data itself when the factor is 1."""
+    f = factor(pdata_dir)
+    return data if f == 1.0 else data / f
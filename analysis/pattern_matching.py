@@ -0,0 +1,160 @@
+import numpy as np
+import pandas as pd
+import globals
+from analysis.deconvolution import MULTIPLET_MODELS, MULTIPLICITY_SYMBOLS
+
+# Used where the pattern library leaves a tolerance blank
+DEFAULT_SHIFT_TOLERANCE_PPM = 0.02
+DEFAULT_J_TOLERANCE_HZ = 1.0
+
+# Pattern library columns; the tolerance and coupling columns are optional
+LIBRARY_COLUMNS = ("Metabolite", "ppm", "Multiplicity")
+
+def multiplet_model(multiplicity):
+    """Multiplet model name from a symbol ("dd") or a name ("Doublet of doublets")."""
+    value = str(multiplicity).strip()
+    for model, symbol in MULTIPLICITY_SYMBOLS.items():
+        if value == symbol or value.lower() == model.lower():
+            return model
+    raise ValueError(f"Unknown multiplicity '{multiplicity}' "
+                     f"(use {', '.join(MULTIPLICITY_SYMBOLS.values())})")
+
+def compile_library(library, spectrometer_mhz=None):
+    """
+    Turn a pattern library table into arrays of signals.
+
+    Each row is one signal: Metabolite, ppm (centre), Multiplicity, optional
+    "J1 (Hz)"/"J2 (Hz)" couplings, "ppm tolerance" and "J tolerance (Hz)".
+    Line offsets from the centre are stored in ppm, padded with NaN to the
+    largest number of lines.
+    """
+    spectrometer_mhz = spectrometer_mhz or globals.spectrometer_mhz
+    metabolites = list(dict.fromkeys(str(name) for name in library["Metabolite"]))
+    metabolite_index = {name: i for i, name in enumerate(metabolites)}
+
+    def column(name, default):
+        if name not in library:
+            return np.full(len(library), default, dtype=float)
+        return library[name].astype(float).fillna(default).to_numpy()
+
+    couplings = np.column_stack((column("J1 (Hz)", 0.0), column("J2 (Hz)", 0.0))) / spectrometer_mhz
+    max_lines = max(len(offsets) for _, offsets, _ in MULTIPLET_MODELS.values())
+    offsets = np.full((len(library), max_lines), np.nan)
+    n_lines = np.empty(len(library), dtype=int)
+    for i, multiplicity in enumerate(library["Multiplicity"]):
+        _, line_offsets, _ = MULTIPLET_MODELS[multiplet_model(multiplicity)]
+        for k, offset in enumerate(line_offsets):
+            offsets[i, k] = sum(o * j for o, j in zip(offset, couplings[i]))
+        n_lines[i] = len(line_offsets)
+
+    return {
+        "metabolites": metabolites,
+        "signal_metabolite": np.array([metabolite_index[str(name)] for name in library["Metabolite"]], dtype=int),
+        "centers": library["ppm"].astype(float).to_numpy(),
+        "offsets": offsets,
+        "n_lines": n_lines,
+        "shift_tolerance": column("ppm tolerance", DEFAULT_SHIFT_TOLERANCE_PPM),
+        "j_tolerance": column("J tolerance (Hz)", DEFAULT_J_TOLERANCE_HZ) / spectrometer_mhz,
+    }
+
+def nearest_distance(sorted_ppm, values):
+    """Distance from every value to the nearest entry of an ascending array."""
+    right = np.searchsorted(sorted_ppm, values)
+    left = np.clip(right - 1, 0, len(sorted_ppm) - 1)
+    right = np.clip(right, 0, len(sorted_ppm) - 1)
+    return np.minimum(np.abs(sorted_ppm[left] - values), np.abs(sorted_ppm[right] - values))
+
+def score_signals(sorted_ppm, compiled):
+    """
+    Best score, centre and completeness of every library signal in one
+    spectrum's peak list.
+
+    Each expected line is anchored on the picked peaks on either side of its
+    expected position; every anchor proposes a multiplet centre, and the
+    proposal is scored by the fraction of its lines that have a picked peak
+    within the J tolerance, times 1 - 0.5 * (shift error / shift tolerance).
+    All signals are scored at once with searchsorted over the sorted peaks.
+    Returns (scores, centres, complete); complete marks signals whose best
+    candidate matched every line.
+    """
+    n_signals = len(compiled["centers"])
+    if len(sorted_ppm) == 0:
+        return np.zeros(n_signals), np.full(n_signals, np.nan), np.zeros(n_signals, dtype=bool)
+
+    centers = compiled["centers"][:, None]
+    offsets = compiled["offsets"]
+
+    # Candidate centres from the peaks just below and above each expected line (signals x 2 lines)
+    expected = centers + offsets
+    right = np.searchsorted(sorted_ppm, expected)
+    anchors = np.stack((np.clip(right - 1, 0, len(sorted_ppm) - 1),
+                        np.clip(right, 0, len(sorted_ppm) - 1)), axis=-1)
+    candidates = (sorted_ppm[anchors] - offsets[:, :, None]).reshape(n_signals, -1)
+    shift_error = np.abs(candidates - centers)
+    valid = shift_error <= compiled["shift_tolerance"][:, None]
+
+    # Lines of the candidate multiplets within the shift tolerance, matched against the peaks
+    signal, candidate = np.nonzero(valid)
+    lines = candidates[signal, candidate][:, None] + offsets[signal]
+    distance = nearest_distance(sorted_ppm, np.where(np.isnan(lines), np.inf, lines))
+    matched = (distance <= compiled["j_tolerance"][signal, None]) & ~np.isnan(lines)
+    fraction = np.zeros(candidates.shape)
+    fraction[signal, candidate] = matched.sum(axis=-1) / compiled["n_lines"][signal]
+
+    scores = np.zeros(candidates.shape)
+    scores[signal, candidate] = fraction[signal, candidate] * (1 - 0.5 * shift_error[signal, candidate]
+                                                               / compiled["shift_tolerance"][signal])
+    best = scores.argmax(axis=1)
+    rows = np.arange(n_signals)
+    found = scores[rows, best] > 0
+    complete = found & (fraction[rows, best] == 1)
+    return scores[rows, best], np.where(found, candidates[rows, best], np.nan), complete
+
+def split_by_sample(peaks, ppm_key="PPM"):
+    """Yield (sample, ascending ppm array) per sample from one sort of all peak dicts."""
+    samples = np.array([peak["Sample"] for peak in peaks], dtype=object)
+    ppm_values = np.array([peak[ppm_key] for peak in peaks], dtype=float)
+    sample_names, sample_codes = np.unique(samples.astype(str), return_inverse=True)
+    order = np.lexsort((ppm_values, sample_codes))
+    bounds = np.searchsorted(sample_codes[order], np.arange(len(sample_names) + 1))
+    for i, sample in enumerate(sample_names):
+        yield sample, ppm_values[order[bounds[i]:bounds[i + 1]]]
+
+def identify_metabolites(peaks, library=None, spectrometer_mhz=None):
+    """
+    Per-sample identification scores of every library metabolite.
+
+    Returns a DataFrame (one row per sample and metabolite, which can run to
+    millions) of Sample, Metabolite, Score (mean of its signal scores, 0-1),
+    Signals Found (signals with every line matched) and Signals.
+    """
+    library = globals.pattern_library if library is None else library
+    if library is None or library.empty or not peaks:
+        return pd.DataFrame(columns=["Sample", "Metabolite", "Score", "Signals Found", "Signals"])
+
+    compiled = compile_library(library, spectrometer_mhz)
+    metabolites = compiled["metabolites"]
+    signal_metabolite = compiled["signal_metabolite"]
+    n_signals = np.bincount(signal_metabolite, minlength=len(metabolites))
+
+    samples = []
+    totals = []
+    found = []
+    for sample, sorted_ppm in split_by_sample(peaks):
+        scores, _, complete = score_signals(sorted_ppm, compiled)
+        samples.append(sample)
+        totals.append(np.bincount(signal_metabolite, weights=scores, minlength=len(metabolites)))
+        found.append(np.bincount(signal_metabolite, weights=complete, minlength=len(metabolites)))
+
+    return pd.DataFrame({
+        "Sample": np.repeat(samples, len(metabolites)),
+        "Metabolite": np.tile(np.array(metabolites, dtype=object), len(samples)),
+        "Score": (np.array(totals) / n_signals).ravel(),
+        "Signals Found": np.array(found, dtype=int).ravel(),
+        "Signals": np.tile(n_signals, len(samples)),
+    })
+
+def score_matrix(identifications):
+    """Samples x metabolites table of identification scores, in library order."""
+    metabolites = list(dict.fromkeys(identifications["Metabolite"]))
+    return identifications.pivot(index="Sample", columns="Metabolite", values="Score")[metabolites]
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import globals
+
+def match_positions(ppm_values, tolerance_ppm):
+    """
+    Group peak positions into features with a sorted sweep.
+
+    Positions are sorted once (O(N log N)); a new feature starts wherever the
+    gap to the previous position exceeds tolerance_ppm, and features wider
+    than twice the tolerance are cut into consecutive slices of that width
+    so dense regions do not chain into one feature. Returns a feature label
+    per position, numbered from the highest ppm down.
+    """
+    ppm_values = np.asarray(ppm_values, dtype=float)
+    n = len(ppm_values)
+    if n == 0:
+        return np.empty(0, dtype=int)
+
+    order = np.argsort(-ppm_values, kind='stable')
+    ppm_sorted = ppm_values[order]
+
+    gaps = np.empty(n, dtype=bool)
+    gaps[0] = True
+    gaps[1:] = -np.diff(ppm_sorted) > tolerance_ppm
+
+    # Offset of every position from the first (highest) one of its gap-delimited run
+    run_starts = np.maximum.accumulate(np.where(gaps, np.arange(n), 0))
+    slices = np.floor((ppm_sorted[run_starts] - ppm_sorted) / (2 * tolerance_ppm)).astype(int)
+    new_feature = gaps.copy()
+    new_feature[1:] |= slices[1:] != slices[:-1]
+
+    labels = np.empty(n, dtype=int)
+    labels[order] = np.cumsum(new_feature) - 1
+    return labels
+
+def assign_features(peaks, tolerance_ppm=None, ppm_key="PPM"):
+    """
+    Label every peak dict with the consensus feature it belongs to.
+
+    Sets peak["Feature"] in place to "F0001_3.034" (feature number, median
+    ppm), numbered from the highest ppm down, and returns one summary row per
+    feature: Feature, PPM (median), PPM_Min, PPM_Max, Samples and Peaks.
+    """
+    tolerance_ppm = globals.peak_match_tolerance if tolerance_ppm is None else tolerance_ppm
+    if not peaks:
+        return []
+
+    ppm_values = np.array([peak[ppm_key] for peak in peaks], dtype=float)
+    labels = match_positions(ppm_values, tolerance_ppm)
+
+    df = pd.DataFrame({"label": labels, "ppm": ppm_values, "sample": [peak["Sample"] for peak in peaks]})
+    grouped = df.groupby("label")
+    summary = pd.DataFrame({
+        "PPM": grouped["ppm"].median(),
+        "PPM_Min": grouped["ppm"].min(),
+        "PPM_Max": grouped["ppm"].max(),
+        "Samples": grouped["sample"].nunique(),
+        "Peaks": grouped.size(),
+    })
+    summary.insert(0, "Feature", [f"F{label + 1:04d}_{ppm:.3f}" for label, ppm in zip(summary.index, summary["PPM"])])
+
+    names = summary["Feature"].tolist()
+    for peak, label in zip(peaks, labels):
+        peak["Feature"] = names[label]
+    return summary.to_dict("records")
+
+def feature_number(feature):
+    """Feature number of a name such as "F0012_3.034" (1 is the highest ppm)."""
+    return int(feature[1:feature.index("_")])
+
+def feature_matrix(peaks, values="Integral", aggfunc="sum"):
+    """
+    Spectra x feature matrix of one peak property.
+
+    peaks is a list of peak dicts or a DataFrame of them. Peaks of one
+    sample that fall into the same feature are combined with aggfunc
+    (summed integrals by default). A list of peaks without "Feature" is
+    matched first. Columns are ordered from the highest ppm down.
+    """
+    if isinstance(peaks, pd.DataFrame):
+        df = peaks
+    else:
+        if peaks and "Feature" not in peaks[0]:
+            assign_features(peaks)
+        df = pd.DataFrame(peaks)
+    table = df.pivot_table(index="Sample", columns="Feature", values=values, aggfunc=aggfunc, sort=True)
+    # Names sort as strings ("F10000_" before "F1000_") once past 9,999 features
+    return table[sorted(table.columns, key=feature_number)]
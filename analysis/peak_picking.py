@@ -1,8 +1,14 @@
 import numpy as np
 from scipy.signal import find_peaks
 
-def detect_peaks(ppm_scale, data, sample_name, height, distance, prominence, baseline_threshold):
-    """Detect peaks in spectrum with intelligent integration."""
+def detect_peaks(ppm_scale, data, sample_name, height, distance, prominence, baseline_threshold,
+                 baseline_corrected=False):
+    """
+    Detect peaks in spectrum with intelligent integration.
+
+    When baseline_corrected is True the data comes from the baseline cache and
+    the local baseline is taken as zero instead of being re-estimated per peak.
+    """
     peaks, properties = find_peaks(data, height=height, distance=distance, prominence=prominence)
     
     peak_results = []
@@ -12,15 +18,18 @@ def detect_peaks(ppm_scale, data, sample_name, height, distance, prominence, bas
         intensity = data[peak_idx]
         
         # Estimate baseline around this peak
-        baseline = estimate_baseline(ppm_scale, data, peak_idx)
+        if baseline_corrected:
+            baseline = 0.0
+        else:
+            baseline = estimate_baseline(ppm_scale, data, peak_idx)
         
         # Find peak boundaries where it intersects baseline
         left_bound, right_bound = find_peak_boundaries(ppm_scale, data, peak_idx, baseline, baseline_threshold)
         
         # Calculate integral above baseline
+        # Accumulate in float64 so float32-stored spectra integrate accurately
         peak_region = data[left_bound:right_bound+1]
-        baseline_region = np.full_like(peak_region, baseline)
-        integral = np.sum(peak_region - baseline_region)
+        integral = np.sum(peak_region, dtype=np.float64) - baseline * len(peak_region)
         
         # Store peak width information
         peak_width_ppm = ppm_scale[left_bound] - ppm_scale[right_bound]
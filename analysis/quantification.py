@@ -0,0 +1,233 @@
+import numpy as np
+from scipy.linalg import cholesky, solve_triangular
+from scipy.optimize import nnls
+from tkinter import messagebox
+import file_io
+from analysis import alignment
+from analysis import baseline
+from analysis import stacking
+from analysis.concentration import calculate_peak_area
+import globals
+import diagnostics
+
+# Spectra stacked and solved per block
+CHUNK_SIZE = 64
+
+# Relative ridge added to the Gram matrix so near-identical references stay solvable
+GRAM_RIDGE = 1e-10
+
+def load_reference_library(library_dir):
+    """
+    Load pure-compound reference spectra from a folder of Bruker experiments.
+
+    Each pdata directory is one compound, named like a sample (the experiment's
+    parent folder). Stores and returns {"directory", "names", "spectra"}.
+    """
+    names = []
+    spectra = []
+    for pdata_dir in file_io.find_pdata_directories(library_dir):
+        dic, data = file_io.load_bruker_data(pdata_dir)
+        if dic is None:
+            continue
+        ppm_scale, name = file_io.get_spectrum_info(dic, data, pdata_dir)
+        if ppm_scale is None:
+            continue
+        names.append(name)
+        spectra.append((ppm_scale, np.asarray(data, dtype=np.float64)))
+
+    if not spectra:
+        messagebox.showerror("Error", "No reference spectra found in the selected folder.")
+        return None
+
+    globals.reference_library = {"directory": library_dir, "names": names, "spectra": spectra}
+    return globals.reference_library
+
+def quantified_regions(names):
+    """
+    peak_limits rows (after the reference) quantified from the library, as
+    (row, compound index) pairs; rows are matched to compounds by name, ignoring case.
+    """
+    compounds = {name.strip().lower(): i for i, name in enumerate(names)}
+    pairs = []
+    for row in range(1, len(globals.peak_limits)):
+        identity = str(globals.peak_limits.at[row, "Peak identity"]).strip().lower()
+        if identity in compounds:
+            pairs.append((row, compounds[identity]))
+    return pairs
+
+def fit_mask(grid):
+    """Grid points inside any peak_limits region except the reference: the points the fit is made on."""
+    mask = np.zeros(len(grid), dtype=bool)
+    for row in range(1, len(globals.peak_limits)):
+        mask[stacking.region_slice(grid, globals.peak_limits.at[row, "ppm start"],
+                                   globals.peak_limits.at[row, "ppm end"])] = True
+    return mask
+
+def gram_factor(basis):
+    """Lower Cholesky factor of the Gram matrix basis @ basis.T of the reference spectra."""
+    gram = basis @ basis.T
+    ridge = GRAM_RIDGE * max(np.trace(gram) / len(gram), np.finfo(float).tiny)
+    return cholesky(gram + ridge * np.eye(len(gram)), lower=True)
+
+def solve_batch(factor, projections):
+    """
+    Non-negative least-squares coefficients for a block of spectra.
+
+    With G = L L^T the Gram matrix and b = basis @ y, ||basis^T a - y||^2
+    equals ||L^T a - L^-1 b||^2 plus a constant, so each spectrum only needs
+    a k x k NNLS (k compounds) instead of one over every grid point.
+    projections is (spectra x k); returns (spectra x k) coefficients.
+    """
+    targets = solve_triangular(factor, projections.T, lower=True).T
+    upper = factor.T
+    return np.array([nnls(upper, target)[0] for target in targets])
+
+def library_model(grid, library):
+    """
+    Reference spectra of the library prepared for fitting on grid: the
+    quantified (row, compound) pairs, the fitted points, the basis restricted
+    to them with its Cholesky factor, and each region's area per unit
+    coefficient of its compound.
+    """
+    pairs = quantified_regions(library["names"])
+
+    # Reference spectra on the common grid, restricted to the fitted points
+    mask = fit_mask(grid)
+    references = np.vstack([stacking.on_grid(ppm_scale, data, grid) for ppm_scale, data in library["spectra"]])
+    basis = references[:, mask]
+
+    # Area of each quantified region per unit coefficient of its compound
+    unit_areas = [references[compound, stacking.region_slice(grid, globals.peak_limits.at[row, "ppm start"],
+                                                              globals.peak_limits.at[row, "ppm end"])].sum()
+                  for row, compound in pairs]
+
+    return {"grid": grid, "pairs": pairs, "mask": mask, "basis": basis,
+            "factor": gram_factor(basis), "unit_areas": unit_areas}
+
+def quantify_library(spectra, tsp_concentration, library=None, model=None):
+    """
+    Concentrations of the library compounds in the given spectra.
+
+    Every spectrum is fitted as a non-negative combination of the reference
+    spectra on the grid points of the peak_limits regions. A region's area is
+    then the fitted compound's contribution summed over that region, so
+    overlapping metabolites are separated, and concentrations follow the same
+    TSP scaling as calculate_concentrations. model (from library_model) lets
+    successive blocks of spectra share one fit. Returns (concentration rows,
+    area rows) in the format of calculate_concentrations.
+    """
+    library = library or globals.reference_library
+    results_concentration = []
+    results_area = []
+    if not spectra or library is None or globals.peak_limits.empty:
+        return results_concentration, results_area
+
+    if not quantified_regions(library["names"]):
+        print("No peak_limits region matches a reference compound name")
+        return results_concentration, results_area
+
+    if model is None:
+        model = library_model(stacking.reference_grid(spectra), library)
+    grid, pairs, mask = model["grid"], model["pairs"], model["mask"]
+    basis, factor, unit_areas = model["basis"], model["factor"], model["unit_areas"]
+
+    ref_start = globals.peak_limits.at[0, "ppm start"]
+    ref_end = globals.peak_limits.at[0, "ppm end"]
+    ref_protons = globals.peak_limits.at[0, "# protons"]
+
+    for start in range(0, len(spectra), CHUNK_SIZE):
+        chunk = spectra[start:start + CHUNK_SIZE]
+        corrected = [baseline.corrected_data(pdata_dir, data) for _, data, _, pdata_dir in chunk]
+        matrix = np.vstack([stacking.on_grid(ppm_scale, alignment.aligned_data(ppm_scale, data, pdata_dir), grid)[mask]
+                            for (ppm_scale, _, _, pdata_dir), data in zip(chunk, corrected)])
+        coefficients = solve_batch(factor, matrix.astype(np.float64, copy=False) @ basis.T)
+
+        for (ppm_scale, _, sample_name, pdata_dir), data, coefs in zip(chunk, corrected, coefficients):
+            ref_offset = alignment.region_offset(pdata_dir, ref_start, ref_end)
+            ref_area = calculate_peak_area(ppm_scale, data, ref_start + ref_offset, ref_end + ref_offset)
+
+            for (row, compound), unit_area in zip(pairs, unit_areas):
+                name = globals.peak_limits.at[row, "Peak identity"]
+                area = coefs[compound] * unit_area
+                results_area.append({
+                    "Sample": sample_name,
+                    "Peak": name,
+                    "Area": area,
+                    "Parent File Path": pdata_dir
+                })
+
+                if tsp_concentration != 0:
+                    nprotons = globals.peak_limits.at[row, "# protons"]
+                    conc = (area/ref_area)*tsp_concentration*(ref_protons/nprotons)
+                    results_concentration.append({
+                        "Sample": sample_name,
+                        "Peak": name,
+                        "Concentration": conc,
+                        "Parent File Path": pdata_dir
+                    })
+
+    return results_concentration, results_area
+
+def calculate_library_concentrations(tsp_concentration):
+    """Quantify every spectrum of the selected datasets against the reference library."""
+    if not globals.selected_pdata_dirs:
+        messagebox.showerror("Error", "Select a dataset first.")
+        return None
+
+    if globals.peak_limits.empty:
+        messagebox.showerror("Error", "No peak limits loaded.")
+        return None
+
+    if globals.reference_library is None:
+        messagebox.showerror("Error", "Load a reference library first.")
+        return None
+
+    if not quantified_regions(globals.reference_library["names"]):
+        messagebox.showerror("Error", "No peak identity in the peak limits matches a reference compound.\n"
+                                      f"Reference compounds: {', '.join(globals.reference_library['names'])}")
+        return None
+
+    # Spectra are read and fitted one block at a time against the first block's grid
+    model = None
+    results_concentration = []
+    results_area = []
+    count = 0
+
+    with diagnostics.track_stage("Library Quantification") as record:
+        for chunk in dataset_chunks():
+            if model is None:
+                model = library_model(stacking.reference_grid(chunk), globals.reference_library)
+            concentrations, areas = quantify_library(chunk, tsp_concentration, model=model)
+            results_concentration.extend(concentrations)
+            results_area.extend(areas)
+            count += len(chunk)
+        record["Spectra"] = count
+
+    return results_concentration, results_area
+
+def dataset_chunks(chunk_size=CHUNK_SIZE):
+    """
+    Spectra of the selected datasets in lists of up to chunk_size. Loaded
+    spectra are used as they are; the rest are read from disk as their list
+    is reached, so only one block of unloaded spectra is held at a time.
+    """
+    loaded = {pdata_dir: (ppm_scale, data, sample_name, pdata_dir)
+              for ppm_scale, data, sample_name, pdata_dir in globals.spectra}
+    chunk = []
+    for root_dir in globals.selected_pdata_dirs:
+        for pdata_dir in file_io.find_pdata_directories(root_dir):
+            if pdata_dir in loaded:
+                chunk.append(loaded[pdata_dir])
+            else:
+                dic, data = file_io.load_bruker_data(pdata_dir)
+                if dic is None:
+                    continue
+                ppm_scale, sample_name = file_io.get_spectrum_info(dic, data, pdata_dir)
+                if ppm_scale is None:
+                    continue
+                chunk.append((ppm_scale, data, sample_name, pdata_dir))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
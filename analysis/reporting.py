@@ -1,6 +1,12 @@
 import pandas as pd
 from tkinter import messagebox, filedialog
 import globals
+import diagnostics
+import analysis.spectrum_index as spectrum_index
+import analysis.peak_matching as peak_matching
+import analysis.interval_index as interval_index
+import analysis.pattern_matching as pattern_matching
+import analysis.binning as binning_analysis
 
 def generate_comprehensive_report():
     """Export a comprehensive report with all selected results including deconvolution."""
@@ -19,7 +25,7 @@ def generate_comprehensive_report():
         return
     
     try:
-        with pd.ExcelWriter(filename) as writer:
+        with diagnostics.track_stage("Report Export", len(globals.spectra)), pd.ExcelWriter(filename) as writer:
             # 1. Dataset Overview
             dataset_overview = pd.DataFrame({
                 'Parameter': ['Total Spectra', 'Samples', 'Peak Limits Loaded', 'Deconvolution Analyses'],
@@ -35,11 +41,13 @@ def generate_comprehensive_report():
             # 2. Sample Information
             sample_info = []
             for ppm_scale, data, sample_name, pdata_dir in globals.spectra:
+                entry = spectrum_index.get_entry(ppm_scale, data, pdata_dir)
                 sample_info.append({
                     'Sample Name': sample_name,
-                    'Data Points': len(data),
-                    'PPM Range': f"{ppm_scale.min():.2f} - {ppm_scale.max():.2f}",
-                    'Max Intensity': f"{data.max():.2e}",
+                    'Data Points': entry['n_points'],
+                    'PPM Range': f"{entry['ppm_min']:.2f} - {entry['ppm_max']:.2f}",
+                    'Max Intensity': f"{entry['max']:.2e}",
+                    'Noise Level': f"{entry['noise']:.2e}",
                     'File Path': pdata_dir
                 })
             pd.DataFrame(sample_info).to_excel(writer, sheet_name='Sample Information', index=False)
@@ -63,25 +71,30 @@ def generate_comprehensive_report():
             # 6. Binning Results
             if globals.binning_results is not None:
                 globals.binning_results.to_excel(writer, sheet_name='Binning Results')
+                binning_analysis.bin_annotations(globals.binning_results).to_excel(
+                    writer, sheet_name='Bin Annotations', index=False)
             
             # 7. Peak Picking Summary
             if globals.all_peak_picking_results:
+                # Create summary tables over peaks matched across spectra
+                peak_features = interval_index.annotate(peak_matching.assign_features(globals.all_peak_picking_results))
+                interval_index.annotate(globals.all_peak_picking_results)
                 df_peaks = pd.DataFrame(globals.all_peak_picking_results)
-                # Create summary tables
-                peak_summary_ppm = df_peaks.pivot_table(
-                    index='Sample', 
-                    columns='Peak', 
-                    values='PPM',
-                    aggfunc='first'
-                )
-                peak_summary_integral = df_peaks.pivot_table(
-                    index='Sample', 
-                    columns='Peak', 
-                    values='Integral',
-                    aggfunc='first'
-                )
+                peak_summary_ppm = peak_matching.feature_matrix(df_peaks, "PPM", "mean")
+                peak_summary_integral = peak_matching.feature_matrix(df_peaks, "Integral")
+                pd.DataFrame(peak_features).to_excel(writer, sheet_name='Peak Features', index=False)
                 peak_summary_ppm.to_excel(writer, sheet_name='Peak Positions')
                 peak_summary_integral.to_excel(writer, sheet_name='Peak Integrals')
+                
+                # Metabolite identification scores against the pattern library
+                if globals.pattern_library is not None:
+                    identifications = pattern_matching.identify_metabolites(globals.all_peak_picking_results)
+                    pattern_matching.score_matrix(identifications).to_excel(writer, sheet_name='Identifications')
+            
+            # Per-bin group comparison
+            if globals.univariate_results is not None:
+                globals.univariate_results.sort_values("p-value").to_excel(
+                    writer, sheet_name='Univariate Statistics', index=False)
             
             # 8. Deconvolution Results
             if globals.deconvolution_results:
@@ -152,6 +165,13 @@ def generate_comprehensive_report():
                 ]
             }
             pd.DataFrame(summary_data).to_excel(writer, sheet_name='Analysis Summary', index=False)
+            
+            # 10. Performance (per-stage summary, then every recorded run)
+            if globals.performance_records:
+                perf_summary = pd.DataFrame(diagnostics.summarize_records())
+                perf_summary.to_excel(writer, sheet_name='Performance', index=False)
+                pd.DataFrame(globals.performance_records).to_excel(
+                    writer, sheet_name='Performance', index=False, startrow=len(perf_summary) + 3)
         
         messagebox.showinfo("Success", f"Report exported!\n\nFile saved as: {filename}")
         
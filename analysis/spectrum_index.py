@@ -0,0 +1,97 @@
+import numpy as np
+import globals
+from analysis import alignment
+from analysis import normalization
+
+def nearest_indices(ppm_scale, values):
+    """Vectorized equivalent of np.abs(ppm_scale - v).argmin() for each value."""
+    values = np.asarray(values, dtype=float)
+    descending = ppm_scale[0] > ppm_scale[-1]
+    axis = ppm_scale[::-1] if descending else ppm_scale
+    n = len(axis)
+
+    right = np.clip(np.searchsorted(axis, values), 1, n - 1)
+    left = right - 1
+    idx = np.where(np.abs(axis[left] - values) <= np.abs(axis[right] - values), left, right)
+
+    return (n - 1 - idx) if descending else idx
+
+def estimate_noise(data):
+    """Robust noise level: scaled median absolute deviation of the first difference."""
+    diff = np.diff(np.asarray(data, dtype=np.float64))
+    mad = np.median(np.abs(diff - np.median(diff)))
+    return 1.4826 * mad / np.sqrt(2)
+
+def region_bounds(ppm_scale, pdata_dir, peak_limits):
+    """Index bounds (start, end inclusive) of every peak_limits window in one spectrum."""
+    if peak_limits.empty:
+        return np.empty((0, 2), dtype=int)
+
+    starts = peak_limits["ppm start"].to_numpy(dtype=float)
+    ends = peak_limits["ppm end"].to_numpy(dtype=float)
+    offsets = np.array([alignment.region_offset(pdata_dir, s, e) for s, e in zip(starts, ends)])
+
+    s_idx = nearest_indices(ppm_scale, starts + offsets)
+    e_idx = nearest_indices(ppm_scale, ends + offsets)
+    return np.column_stack([np.minimum(s_idx, e_idx), np.maximum(s_idx, e_idx)])
+
+def region_maxima(data, bounds):
+    """Maximum intensity inside each index window."""
+    return np.array([data[s:e + 1].max() for s, e in bounds], dtype=float)
+
+def index_spectrum(ppm_scale, data, pdata_dir, peak_limits):
+    """Compute the statistics entry for one spectrum."""
+    bounds = region_bounds(ppm_scale, pdata_dir, peak_limits)
+    return {
+        "max": float(data.max()),
+        "min": float(data.min()),
+        "noise": float(estimate_noise(data)),
+        "ppm_min": float(ppm_scale.min()),
+        "ppm_max": float(ppm_scale.max()),
+        "n_points": len(data),
+        "region_bounds": bounds,
+        "region_max": region_maxima(data, bounds),
+    }
+
+# The rebuild and region updates run on the event worker while plots read the
+# index on the UI thread, so entries and the index itself are only ever
+# replaced whole, never modified in place.
+
+def rebuild_index(spectra):
+    """Build the statistics index from scratch for a freshly loaded dataset."""
+    globals.spectrum_index = {pdata_dir: index_spectrum(ppm_scale, data, pdata_dir, globals.peak_limits)
+                              for ppm_scale, data, sample_name, pdata_dir in spectra}
+
+def add_to_index(spectra):
+    """Index only the given spectra, leaving existing entries untouched."""
+    for ppm_scale, data, sample_name, pdata_dir in spectra:
+        globals.spectrum_index[pdata_dir] = index_spectrum(ppm_scale, data, pdata_dir, globals.peak_limits)
+
+def update_regions():
+    """Recompute region bounds and maxima after peak limits or alignment change."""
+    for ppm_scale, data, sample_name, pdata_dir in globals.spectra:
+        entry = globals.spectrum_index.get(pdata_dir)
+        if entry is None:
+            globals.spectrum_index[pdata_dir] = index_spectrum(ppm_scale, data, pdata_dir, globals.peak_limits)
+            continue
+        bounds = region_bounds(ppm_scale, pdata_dir, globals.peak_limits)
+        globals.spectrum_index[pdata_dir] = {**entry, "region_bounds": bounds,
+                                             "region_max": region_maxima(data, bounds)}
+
+def get_entry(ppm_scale, data, pdata_dir):
+    """Return the index entry of a spectrum, indexing it on first use."""
+    entry = globals.spectrum_index.get(pdata_dir)
+    if entry is None or len(entry["region_bounds"]) != len(globals.peak_limits):
+        entry = index_spectrum(ppm_scale, data, pdata_dir, globals.peak_limits)
+        globals.spectrum_index[pdata_dir] = entry
+    return entry
+
+def max_intensity(spectra):
+    """Largest (normalized) intensity over the given spectra."""
+    return max(get_entry(p, d, pdir)["max"] / normalization.factor(pdir) for p, d, _, pdir in spectra)
+
+def region_max_over(spectra):
+    """Per-region maximum (normalized) intensity across the given spectra."""
+    maxima = np.vstack([get_entry(p, d, pdir)["region_max"] / normalization.factor(pdir)
+                        for p, d, _, pdir in spectra])
+    return maxima.max(axis=0)
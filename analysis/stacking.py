@@ -0,0 +1,44 @@
+import numpy as np
+
+def reference_grid(spectra):
+    """Return the ppm axis of the first spectrum, used as the common grid."""
+    return spectra[0][0]
+
+def same_grid(ppm_scale, grid):
+    """Check whether a spectrum already lies on the common grid."""
+    return (len(ppm_scale) == len(grid)
+            and np.isclose(ppm_scale[0], grid[0])
+            and np.isclose(ppm_scale[-1], grid[-1]))
+
+def on_grid(ppm_scale, data, grid, index_slice=slice(None)):
+    """
+    Return the intensities of one spectrum at grid[index_slice].
+
+    Spectra on the common grid are returned as views; others are linearly
+    interpolated (ppm axes are descending, so both are reversed for np.interp).
+    """
+    if same_grid(ppm_scale, grid):
+        return data[index_slice]
+    target = grid[index_slice]
+    return np.interp(target[::-1], ppm_scale[::-1], data[::-1], left=0.0, right=0.0)[::-1]
+
+def iter_stacked_chunks(spectra, grid, index_slice=slice(None), chunk_size=64, dtype=np.float64):
+    """
+    Yield (row_offset, matrix) blocks of spectra stacked on the common grid.
+
+    Only chunk_size spectra are materialised at a time so memory stays bounded
+    regardless of dataset size.
+    """
+    for row in range(0, len(spectra), chunk_size):
+        chunk = spectra[row:row + chunk_size]
+        matrix = np.vstack([on_grid(ppm_scale, data, grid, index_slice)
+                            for ppm_scale, data, _, _ in chunk]).astype(dtype, copy=False)
+        yield row, matrix
+
+def region_slice(grid, start_ppm, end_ppm):
+    """Index slice of the grid covering a ppm window (inclusive)."""
+    s = np.abs(grid - start_ppm).argmin()
+    e = np.abs(grid - end_ppm).argmin()
+    if s > e:
+        s, e = e, s
+    return slice(int(s), int(e) + 1)
@@ -0,0 +1,64 @@
+import numpy as np
+import diagnostics
+from analysis import alignment
+from analysis import baseline
+from analysis import stacking
+
+# Spectra stacked per block; memory stays at chunk_size x grid points
+CHUNK_SIZE = 64
+
+def stocsy(spectra, driver_ppms, chunk_size=CHUNK_SIZE):
+    """
+    Statistical total correlation spectroscopy over the stacked spectra.
+
+    Correlates the intensity at each driver ppm with every point of the
+    common grid, across all spectra, in one blocked pass: each block of
+    spectra is centred on a per-point shift and contributes its column sums,
+    sums of squares and the driver x point cross products (a drivers x block
+    times block x points matrix product). Only the running sums are kept.
+
+    Returns {"ppm", "driver_ppm", "driver_index", "covariance",
+    "correlation"}, with one covariance/correlation row per driver.
+    """
+    if len(spectra) < 3:
+        raise ValueError("STOCSY needs at least three spectra.")
+
+    grid = stacking.reference_grid(spectra)
+    drivers = np.array([np.abs(grid - ppm).argmin() for ppm in np.atleast_1d(driver_ppms)])
+    n = len(spectra)
+
+    shift = None
+    sums = np.zeros(len(grid))
+    squares = np.zeros(len(grid))
+    cross = np.zeros((len(drivers), len(grid)))
+
+    with diagnostics.track_stage("STOCSY", n):
+        for start in range(0, n, chunk_size):
+            block = np.vstack([stacking.on_grid(ppm_scale, alignment.aligned_data(
+                                                    ppm_scale, baseline.corrected_data(pdata_dir, data), pdata_dir),
+                                                grid)
+                               for ppm_scale, data, _, pdata_dir in spectra[start:start + chunk_size]])
+            block = block.astype(np.float64, copy=False)
+            # Shifting by the first block's mean keeps the sums of squares from cancelling
+            if shift is None:
+                shift = block.mean(axis=0)
+            block -= shift
+
+            sums += block.sum(axis=0)
+            squares += np.einsum('ij,ij->j', block, block)
+            cross += block[:, drivers].T @ block
+
+    mean = sums / n
+    variance = (squares - n * mean**2) / (n - 1)
+    covariance = (cross - n * mean[drivers, None] * mean[None, :]) / (n - 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = covariance / np.sqrt(variance[drivers, None] * variance[None, :])
+    correlation = np.nan_to_num(np.clip(correlation, -1.0, 1.0))
+
+    return {
+        "ppm": grid,
+        "driver_ppm": grid[drivers],
+        "driver_index": drivers,
+        "covariance": covariance,
+        "correlation": correlation,
+    }
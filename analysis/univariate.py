@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+from scipy import stats
+import diagnostics
+from analysis import binning
+from analysis import interval_index
+
+TESTS = ("Welch t-test", "Mann-Whitney U")
+
+# Volcano plot thresholds
+SIGNIFICANCE_Q = 0.05
+FOLD_CHANGE_LOG2 = 1.0
+
+def benjamini_hochberg(p_values):
+    """Benjamini-Hochberg adjusted p-values (q-values); NaN p-values stay NaN."""
+    p_values = np.asarray(p_values, dtype=float)
+    q_values = np.full(p_values.shape, np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    if len(valid) == 0:
+        return q_values
+
+    order = valid[np.argsort(p_values[valid])]
+    ranked = p_values[order] * len(valid) / np.arange(1, len(valid) + 1)
+    # Enforce monotonicity from the largest p-value down
+    q_values[order] = np.minimum(np.minimum.accumulate(ranked[::-1])[::-1], 1.0)
+    return q_values
+
+def compare_groups(binning_results, groups, group_a, group_b, test=TESTS[0]):
+    """
+    Compare two sample groups in every bin at once.
+
+    groups gives the group of each sample (aligned to the binning rows).
+    Returns one row per bin: Bin, PPM, Metabolite, the group means, Fold
+    Change (mean B / mean A) and its log2, the test statistic, p-value and
+    Benjamini-Hochberg q-value.
+    """
+    if test not in TESTS:
+        raise ValueError(f"Unknown test '{test}'")
+    labels = pd.Series(groups).reindex(binning_results.index).astype(str).to_numpy()
+    X = binning_results.to_numpy(dtype=np.float64)
+    A = X[labels == str(group_a)]
+    B = X[labels == str(group_b)]
+    if len(A) < 2 or len(B) < 2:
+        raise ValueError("Each group needs at least two samples.")
+
+    with diagnostics.track_stage("Univariate Statistics", len(A) + len(B)):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if test == "Welch t-test":
+                statistic, p_values = stats.ttest_ind(A, B, axis=0, equal_var=False)
+            else:
+                statistic, p_values = stats.mannwhitneyu(A, B, axis=0, alternative='two-sided', method='asymptotic')
+
+            mean_a = A.mean(axis=0)
+            mean_b = B.mean(axis=0)
+            fold_change = mean_b / mean_a
+            # Fold changes of bins with non-positive means have no log
+            log2_fold_change = np.where((mean_a > 0) & (mean_b > 0), np.log2(fold_change), np.nan)
+
+        ppm, ends = binning.bin_bounds(binning_results)
+        results = pd.DataFrame({
+            "Bin": list(binning_results.columns),
+            "PPM": ppm,
+            "Metabolite": interval_index.overlap_labels(ppm, ends),
+            f"Mean {group_a}": mean_a,
+            f"Mean {group_b}": mean_b,
+            "Fold Change": fold_change,
+            "Log2 Fold Change": log2_fold_change,
+            "Statistic": statistic,
+            "p-value": p_values,
+            "q-value": benjamini_hochberg(p_values),
+        })
+
+    results.attrs.update({"test": test, "group_a": str(group_a), "group_b": str(group_b),
+                          "n_a": len(A), "n_b": len(B)})
+    return results
+
+def significant(results, q_threshold=SIGNIFICANCE_Q, log2_threshold=FOLD_CHANGE_LOG2):
+    """Boolean mask of bins with q below the threshold and |log2 fold change| above it."""
+    return ((results["q-value"] < q_threshold)
+            & (results["Log2 Fold Change"].abs() >= log2_threshold)).to_numpy()
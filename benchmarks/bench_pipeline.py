@@ -0,0 +1,191 @@
+"""
+Analysis pipeline benchmark.
+
+Generates synthetic Bruker datasets (see synthetic_data.py) and times every
+analysis stage at each dataset size: loading, binning, integration,
+concentrations, peak picking and deconvolution. Each stage is run once for
+wall/CPU time and once under tracemalloc for peak Python/NumPy memory.
+Results are written as JSON so runs from different versions can be compared.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--sizes 10 100 1000] [--output results.json]
+    python benchmarks/bench_pipeline.py --compare old.json new.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from tkinter import messagebox
+
+import globals
+import file_io
+import synthetic_data
+from analysis import binning, integration, concentration, peak_picking, deconvolution, deconvolution_cache
+
+# The analysis functions report problems with message boxes; without a
+# display these go to the console instead
+messagebox.showerror = lambda title, message, **kw: print(f"{title}: {message}")
+messagebox.showinfo = lambda title, message, **kw: print(f"{title}: {message}")
+
+# The benchmark runs its own tracemalloc pass; in-app stage tracking would
+# reset the traced peak mid-stage
+globals.trace_memory = False
+
+# Parameters matching the defaults of the peak picking and deconvolution tabs
+PEAK_PICKING_PARAMS = dict(height=5e6, distance=10, prominence=5e4, baseline_threshold=0.01)
+DECONVOLUTION_REGION = (1.31, 1.35, 2, 2000)  # lactate doublet
+TSP_CONCENTRATION = 0.5
+
+def stage_load(root_dir):
+    return file_io.load_spectra_from_directory(root_dir)
+
+def stage_binning(root_dir):
+    return binning.perform_binning(globals.binning_step)
+
+def stage_integration(root_dir):
+    return integration.calculate_integrals()
+
+def stage_concentration(root_dir):
+    return concentration.calculate_concentrations(TSP_CONCENTRATION)
+
+def stage_peak_picking(root_dir):
+    return [peak_picking.detect_peaks(ppm, data, name, **PEAK_PICKING_PARAMS)
+            for ppm, data, name, _ in globals.spectra]
+
+def stage_deconvolution(root_dir):
+    # Start cold so every spectrum is really fitted
+    deconvolution_cache.clear()
+    fig = Figure(figsize=(10, 8), dpi=100)
+    canvas = FigureCanvasAgg(fig)
+    start, end, num_peaks, max_iterations = DECONVOLUTION_REGION
+    return [deconvolution.perform_deconvolution(ppm, data, name, start, end, num_peaks, max_iterations,
+                                                fig, canvas)
+            for ppm, data, name, _ in globals.spectra]
+
+STAGES = [
+    ("load_spectra_from_directory", stage_load),
+    ("perform_binning", stage_binning),
+    ("calculate_integrals", stage_integration),
+    ("calculate_concentrations", stage_concentration),
+    ("detect_peaks", stage_peak_picking),
+    ("perform_deconvolution", stage_deconvolution),
+]
+
+def measure(func, root_dir, n_spectra, with_memory=True):
+    """Time one stage, then re-run it under tracemalloc for peak memory."""
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    func(root_dir)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    peak_mb = None
+    if with_memory:
+        tracemalloc.start()
+        func(root_dir)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024**2
+        tracemalloc.stop()
+
+    return {
+        "wall_s": wall,
+        "cpu_s": cpu,
+        "spectra_per_s": n_spectra / wall if wall > 0 else None,
+        "peak_memory_mb": peak_mb,
+    }
+
+def git_revision():
+    """Short commit hash of the benchmarked tree, or None outside git."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(sizes, n_points, data_dir, with_memory=True, seed=0):
+    """Run every stage at every dataset size and return the list of result rows."""
+    results = []
+    for n_spectra in sizes:
+        root_dir = os.path.join(data_dir, f"synthetic_{n_spectra}_{n_points}")
+        if not os.path.isdir(root_dir):
+            print(f"Generating {n_spectra} spectra x {n_points} points in {root_dir}...")
+            synthetic_data.generate_dataset(root_dir, n_spectra, n_points, seed=seed)
+
+        globals.selected_pdata_dirs = [root_dir]
+        globals.peak_limits = file_io.load_peak_limits(os.path.join(root_dir, "peak_limits.xlsx"))
+        globals.spectra = file_io.load_spectra_from_directory(root_dir)
+
+        for stage, func in STAGES:
+            row = {"stage": stage, "n_spectra": n_spectra, "n_points": n_points}
+            row.update(measure(func, root_dir, n_spectra, with_memory))
+            results.append(row)
+            memory = f"{row['peak_memory_mb']:8.1f} MB" if row["peak_memory_mb"] is not None else ""
+            print(f"{stage:30s} {n_spectra:6d} spectra  {row['wall_s']:8.3f} s  "
+                  f"{row['spectra_per_s']:9.1f} spectra/s  {memory}")
+    return results
+
+def compare(old_path, new_path):
+    """Print the wall-time ratio new/old for every stage and size present in both files."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    old_rows = {(r["stage"], r["n_spectra"], r["n_points"]): r for r in old["results"]}
+    print(f"{'stage':30s} {'spectra':>7s} {'old (s)':>9s} {'new (s)':>9s} {'ratio':>7s}")
+    for r in new["results"]:
+        key = (r["stage"], r["n_spectra"], r["n_points"])
+        if key in old_rows:
+            before = old_rows[key]["wall_s"]
+            print(f"{r['stage']:30s} {r['n_spectra']:7d} {before:9.3f} {r['wall_s']:9.3f} "
+                  f"{r['wall_s'] / before:7.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every PeakNMR analysis stage.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="dataset sizes in spectra (default 10 100 1000)")
+    parser.add_argument("--points", type=int, default=65536, help="points per spectrum")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "peaknmr_bench"),
+                        help="where synthetic datasets are generated and reused")
+    parser.add_argument("--output", default=None, help="JSON results file")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = run_benchmarks(args.sizes, args.points, args.data_dir, not args.no_memory)
+
+    output = args.output or f"bench_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(output, "w") as f:
+        json.dump({
+            "revision": git_revision(),
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "results": results,
+        }, f, indent=2)
+    print(f"Results written to {output}")
+
+if __name__ == "__main__":
+    main()
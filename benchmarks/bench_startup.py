@@ -0,0 +1,92 @@
+"""
+Startup timing benchmark.
+
+Runs the application start-up in a fresh interpreter and reports how long it
+takes to import main.py and to build the window up to the first idle event.
+Fails (exit code 1) when start-up exceeds the threshold or when a module that
+should only be imported on first use (scipy, nmrglue, pyplot) is loaded.
+
+Usage: python benchmarks/bench_startup.py [--threshold SECONDS] [--repeat N]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must not be imported before the user needs them
+DEFERRED_MODULES = ["scipy", "nmrglue", "matplotlib.pyplot", "matplotlib.backends.backend_tkagg"]
+
+CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+window = None
+try:
+    import tkinter as tk
+    tk.Tk().destroy()
+    display = True
+except Exception:
+    display = False
+
+if display:
+    app = main.NMRApplication()
+    app.build_window()
+    app.root.update()
+    window = time.perf_counter() - start
+    app.root.destroy()
+
+print(json.dumps({
+    "import_s": imported - start,
+    "window_s": window,
+    "loaded": [m for m in %r if m in sys.modules],
+}))
+"""
+
+def run_once():
+    """Measure one cold start in a subprocess."""
+    result = subprocess.run([sys.executable, "-c", CHILD_SCRIPT % DEFERRED_MODULES],
+                            cwd=REPO_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Time application start-up.")
+    parser.add_argument("--threshold", type=float, default=1.0,
+                        help="maximum start-up time in seconds (default 1.0)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of cold starts, the best is reported (default 3)")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.repeat)]
+    best_import = min(r["import_s"] for r in runs)
+    windows = [r["window_s"] for r in runs if r["window_s"] is not None]
+    best_window = min(windows) if windows else None
+    loaded = sorted(set(m for r in runs for m in r["loaded"]))
+
+    print(f"import main:         {best_import:.3f} s")
+    if best_window is None:
+        print("window interactive:  skipped (no display)")
+    else:
+        print(f"window interactive:  {best_window:.3f} s")
+    print(f"deferred modules loaded at start-up: {', '.join(loaded) or 'none'}")
+
+    startup = best_window if best_window is not None else best_import
+    failed = False
+    if startup > args.threshold:
+        print(f"FAIL: start-up {startup:.3f} s exceeds {args.threshold:.3f} s")
+        failed = True
+    if loaded:
+        print("FAIL: modules meant for first use were imported at start-up")
+        failed = True
+    if not failed:
+        print("OK")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
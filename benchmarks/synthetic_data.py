@@ -0,0 +1,144 @@
+"""
+Synthetic Bruker dataset generator.
+
+Writes <out_dir>/<sample>/pdata/1/{1r,procs} directories holding 1D 1H
+spectra built from Lorentzian multiplets of common urine metabolites, with a
+TSP reference, per-sample concentrations, chemical shift jitter, a slow
+baseline and Gaussian noise. A matching peak_limits.xlsx is written next to
+the samples so the dataset can be loaded in PeakNMR directly.
+
+Usage: python benchmarks/synthetic_data.py OUT_DIR [--spectra N] [--points N] ...
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+SPECTROMETER_MHZ = 600.13
+OFFSET_PPM = 10.0
+SWEEP_PPM = 12.0
+
+# name, center (ppm), lines as (offset Hz, relative intensity), protons,
+# integration window (ppm start, ppm end), mean concentration (mM)
+METABOLITES = [
+    ("TSP", 0.000, [(0.0, 1.0)], 9, (-0.03, 0.03), 0.5),
+    ("Lactate", 1.330, [(-3.45, 1.0), (3.45, 1.0)], 3, (1.31, 1.35), 1.0),
+    ("Alanine", 1.480, [(-3.6, 1.0), (3.6, 1.0)], 3, (1.46, 1.50), 0.4),
+    ("Acetate", 1.920, [(0.0, 1.0)], 3, (1.90, 1.94), 0.3),
+    ("Citrate", 2.605, [(-47.2, 0.6), (-31.3, 1.0), (31.3, 1.0), (47.2, 0.6)], 4, (2.50, 2.71), 2.0),
+    ("Creatinine", 3.050, [(0.0, 1.0)], 3, (3.03, 3.07), 8.0),
+    ("Glucose", 5.230, [(-1.9, 1.0), (1.9, 1.0)], 1, (5.21, 5.25), 0.5),
+    ("Hippurate", 7.840, [(-3.75, 1.0), (3.75, 1.0)], 2, (7.81, 7.87), 1.5),
+    ("Formate", 8.450, [(0.0, 1.0)], 1, (8.43, 8.47), 0.2),
+]
+
+def ppm_axis(n_points):
+    """Descending ppm axis matching the procs parameters written below."""
+    return OFFSET_PPM - np.arange(n_points) * (SWEEP_PPM / n_points)
+
+def procs_parameters(n_points):
+    """Minimal procs dictionary understood by nmrglue.bruker.read_pdata."""
+    return {
+        "SI": n_points,
+        "XDIM": n_points,
+        "FTSIZE": n_points,
+        "OFFSET": OFFSET_PPM,
+        "SW_p": SWEEP_PPM * SPECTROMETER_MHZ,
+        "SF": SPECTROMETER_MHZ,
+        "AXNUC": "1H",
+        "BYTORDP": 0,
+        "DTYPP": 0,
+        "NC_proc": 0,
+        "MC2": 0,
+        "PPARMOD": 0,
+        "_coreheader": ["##TITLE= Parameter file", "##JCAMPDX= 5.0"],
+        "_comments": ["$$ Synthetic spectrum written by benchmarks/synthetic_data.py"],
+    }
+
+def synthesize_spectrum(ppm, rng, concentrations, shift_ppm, linewidth_hz=0.8,
+                        noise_level=2e-4, baseline_level=5e-3):
+    """
+    Sum of Lorentzian lines for one sample, in arbitrary units where a 1 mM
+    single-proton singlet has height 1.
+    """
+    gamma_ppm = linewidth_hz / SPECTROMETER_MHZ
+    spectrum = np.zeros_like(ppm)
+
+    for (name, center, lines, protons, _, _), conc in zip(METABOLITES, concentrations):
+        # TSP defines 0 ppm; the other peaks move with pH/ionic strength
+        center = center if name == "TSP" else center + shift_ppm + rng.normal(0, abs(shift_ppm) / 4 + 1e-4)
+        total = sum(weight for _, weight in lines)
+        for offset_hz, weight in lines:
+            height = conc * protons * weight / total
+            position = center + offset_hz / SPECTROMETER_MHZ
+            spectrum += height * gamma_ppm**2 / ((ppm - position)**2 + gamma_ppm**2)
+
+    x = (ppm - ppm.mean()) / np.ptp(ppm)
+    spectrum += baseline_level * (1 + rng.normal(0, 0.3) * x + rng.normal(0, 0.3) * x**2)
+    spectrum += rng.normal(0, noise_level, len(ppm))
+    return spectrum
+
+def write_pdata(pdata_dir, data, n_points):
+    """Write a 1r file (int32, little endian) and procs for one spectrum."""
+    import nmrglue as ng
+
+    os.makedirs(pdata_dir, exist_ok=True)
+    ng.bruker.write_jcamp(procs_parameters(n_points), os.path.join(pdata_dir, "procs"), overwrite=True)
+    np.asarray(data, dtype='<i4').tofile(os.path.join(pdata_dir, "1r"))
+
+def write_peak_limits(path):
+    """Write a peak_limits.xlsx for the synthetic metabolites (TSP first)."""
+    df = pd.DataFrame([{
+        "Peak identity": name,
+        "ppm start": window[1],
+        "ppm end": window[0],
+        "# protons": protons,
+    } for name, _, _, protons, window, _ in METABOLITES])
+    df.to_excel(path, index=False)
+    return df
+
+def generate_dataset(out_dir, n_spectra, n_points=65536, shift_sd=0.002, noise_level=2e-4,
+                     linewidth_hz=0.8, seed=0):
+    """
+    Write n_spectra synthetic pdata directories under out_dir.
+
+    Returns the list of pdata directories. Intensities are scaled so the
+    largest expected peak sits near 2^28, as TopSpin does for integer data.
+    """
+    rng = np.random.default_rng(seed)
+    ppm = ppm_axis(n_points)
+    means = np.array([m[5] for m in METABOLITES])
+    scale = 2**28 / (means.max() * 3 * 2)
+
+    pdata_dirs = []
+    for i in range(n_spectra):
+        # Log-normal concentrations around the mean; TSP is fixed
+        concentrations = means * rng.lognormal(0, 0.4, len(means))
+        concentrations[0] = means[0]
+        shift = rng.normal(0, shift_sd)
+        spectrum = synthesize_spectrum(ppm, rng, concentrations, shift, linewidth_hz, noise_level)
+
+        pdata_dir = os.path.join(out_dir, f"sample_{i + 1:04d}", "pdata", "1")
+        write_pdata(pdata_dir, np.round(spectrum * scale), n_points)
+        pdata_dirs.append(pdata_dir)
+
+    write_peak_limits(os.path.join(out_dir, "peak_limits.xlsx"))
+    return pdata_dirs
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic Bruker 1D dataset.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--spectra", type=int, default=10)
+    parser.add_argument("--points", type=int, default=65536)
+    parser.add_argument("--shift-sd", type=float, default=0.002, help="chemical shift jitter (ppm)")
+    parser.add_argument("--noise", type=float, default=2e-4, help="noise level relative to a 1 mM 1H singlet")
+    parser.add_argument("--linewidth", type=float, default=0.8, help="Lorentzian half width (Hz)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    pdata_dirs = generate_dataset(args.out_dir, args.spectra, args.points, args.shift_sd,
+                                  args.noise, args.linewidth, args.seed)
+    print(f"Wrote {len(pdata_dirs)} spectra and peak_limits.xlsx to {args.out_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# --------------------------------------------------
+# PER-STAGE PERFORMANCE TELEMETRY
+# --------------------------------------------------
+import time
+import datetime
+import tracemalloc
+from contextlib import contextmanager
+import globals
+
+# Open stages, innermost last; used to keep peak memory correct when stages nest
+_stage_stack = []
+
+@contextmanager
+def track_stage(stage, n_spectra=None):
+    """
+    Record wall time, CPU time, throughput and peak memory of an analysis stage.
+
+    Yields the record so the caller can fill in record["Spectra"] once the
+    number of processed spectra is known. Records are appended to
+    globals.performance_records and announced with 'performance_recorded'.
+    """
+    record = {
+        "Stage": stage,
+        "Started": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "Spectra": n_spectra,
+    }
+
+    traced = globals.trace_memory
+    started_tracing = False
+    if traced:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started_tracing = True
+        current, peak = tracemalloc.get_traced_memory()
+        # Outer stages keep the peak seen so far before it is reset for this one
+        for frame in _stage_stack:
+            frame["peak"] = max(frame["peak"], peak)
+        tracemalloc.reset_peak()
+        _stage_stack.append({"base": current, "peak": current})
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+        peak_mb = None
+        if traced:
+            frame = _stage_stack.pop()
+            peak = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            for outer in _stage_stack:
+                outer["peak"] = max(outer["peak"], peak)
+            peak_mb = (peak - frame["base"]) / 1024**2
+        if started_tracing:
+            tracemalloc.stop()
+
+        n = record["Spectra"]
+        record.update({
+            "Wall (s)": wall,
+            "CPU (s)": cpu,
+            "Spectra/s": n / wall if n and wall > 0 else None,
+            "Peak Memory (MB)": peak_mb,
+        })
+        add_record(record)
+
+def add_record(record):
+    """Store a performance record, keeping only the most recent ones."""
+    globals.performance_records.append(record)
+    del globals.performance_records[:-globals.performance_records_limit]
+
+    throughput = f", {record['Spectra/s']:.1f} spectra/s" if record["Spectra/s"] else ""
+    memory = f", peak {record['Peak Memory (MB)']:.1f} MB" if record["Peak Memory (MB)"] is not None else ""
+    print(f"[{record['Stage']}] {record['Wall (s)']:.3f} s wall, {record['CPU (s)']:.3f} s CPU{throughput}{memory}")
+
+    globals.trigger_event('performance_recorded', record)
+
+def clear_records():
+    """Forget all performance records."""
+    globals.performance_records = []
+    globals.trigger_event('performance_recorded', None)
+
+def summarize_records(records=None):
+    """Aggregate records per stage: runs, total and mean wall time, best throughput, max peak memory."""
+    records = globals.performance_records if records is None else records
+    summary = {}
+    for r in records:
+        s = summary.setdefault(r["Stage"], {"Stage": r["Stage"], "Runs": 0, "Total Wall (s)": 0.0,
+                                            "Total CPU (s)": 0.0, "Best Spectra/s": None,
+                                            "Max Peak Memory (MB)": None})
+        s["Runs"] += 1
+        s["Total Wall (s)"] += r["Wall (s)"]
+        s["Total CPU (s)"] += r["CPU (s)"]
+        if r["Spectra/s"] is not None:
+            s["Best Spectra/s"] = max(s["Best Spectra/s"] or 0, r["Spectra/s"])
+        if r["Peak Memory (MB)"] is not None:
+            s["Max Peak Memory (MB)"] = max(s["Max Peak Memory (MB)"] or 0, r["Peak Memory (MB)"])
+
+    rows = list(summary.values())
+    for s in rows:
+        s["Mean Wall (s)"] = s["Total Wall (s)"] / s["Runs"]
+    return sorted(rows, key=lambda s: s["Total Wall (s)"], reverse=True)
@@ -1,10 +1,11 @@
-import nmrglue as ng
 import numpy as np
 import os
 import zipfile
 import pandas as pd
 from tkinter import messagebox
 import globals
+import diagnostics
+import memory_budget
 
 def find_pdata_directories(root_dir):
     """Find all Bruker pdata/1 directories recursively."""
@@ -14,25 +15,146 @@ def find_pdata_directories(root_dir):
             pdata_dirs.append(dirpath)
     return pdata_dirs
 
-def load_spectra_from_directory(root_dir):
-    """Load NMR spectra from Bruker pdata directories."""
-    spectra = []
-    pdata_dirs = find_pdata_directories(root_dir)
+def find_new_pdata_directories(root_dir, known_dirs, pending_sizes):
+    """
+    Find pdata directories under root_dir that are not yet loaded and whose
+    processed data has finished writing.
+
+    A directory counts as complete once both '1r' and 'procs' exist and the
+    size and modification time of '1r' are unchanged between two polls.
+    pending_sizes is updated in place with the last seen (size, mtime).
+    """
+    ready_dirs = []
+    for pdata_dir in find_pdata_directories(root_dir):
+        if pdata_dir in known_dirs:
+            continue
+
+        data_file = os.path.join(pdata_dir, "1r")
+        procs_file = os.path.join(pdata_dir, "procs")
+        if not (os.path.isfile(data_file) and os.path.isfile(procs_file)):
+            continue
 
-    for pdata_dir in pdata_dirs:
         try:
-            dic, data = ng.bruker.read_pdata(pdata_dir, scale_data=True)
-            udic = ng.bruker.guess_udic(dic, data)
-            uc = ng.fileiobase.uc_from_udic(udic)
-            ppm_scale = uc.ppm_scale()
-            sample_name = get_sample_name(pdata_dir)
-            spectra.append((ppm_scale, data, sample_name, pdata_dir))
-        except OSError as e:
-            print(f"Error loading {pdata_dir}: {e}")
+            stat = os.stat(data_file)
+        except OSError:
             continue
 
+        signature = (stat.st_size, stat.st_mtime)
+        if stat.st_size > 0 and pending_sizes.get(pdata_dir) == signature:
+            ready_dirs.append(pdata_dir)
+            del pending_sizes[pdata_dir]
+        else:
+            pending_sizes[pdata_dir] = signature
+
+    return ready_dirs
+
+def load_spectra_from_directory(root_dir):
+    """Load NMR spectra from Bruker pdata directories, to replace the current dataset."""
+    with diagnostics.track_stage("Discovery") as record:
+        pdata_dirs = find_pdata_directories(root_dir)
+        record["Spectra"] = len(pdata_dirs)
+    return load_spectra_from_pdata_dirs(pdata_dirs, replacing=True)
+
+def load_spectra_from_pdata_dirs(pdata_dirs, replacing=False):
+    """
+    Load NMR spectra from an explicit list of Bruker pdata directories.
+
+    replacing marks a load that replaces the current dataset, so the memory
+    of the outgoing spectra is available to the new ones.
+    """
+    import nmrglue as ng
+    spectra = []
+
+    with diagnostics.track_stage("Load") as record:
+        # Spectra beyond the memory budget go straight to memory-mapped files
+        headroom = memory_budget.headroom_bytes(replacing)
+        for pdata_dir in pdata_dirs:
+            try:
+                dic, data = ng.bruker.read_pdata(pdata_dir, scale_data=True)
+                data = to_storage_dtype(data)
+                udic = ng.bruker.guess_udic(dic, data)
+                uc = ng.fileiobase.uc_from_udic(udic)
+                (ppm_scale, data), headroom = memory_budget.admit((uc.ppm_scale(), data), headroom)
+                sample_name = get_sample_name(pdata_dir)
+                spectra.append((ppm_scale, data, sample_name, pdata_dir))
+            except OSError as e:
+                print(f"Error loading {pdata_dir}: {e}")
+                continue
+        record["Spectra"] = len(spectra)
+
     return natural_sort_spectra(spectra)
 
+def to_storage_dtype(data):
+    """
+    Convert scaled intensities to the configured storage precision.
+
+    Bruker scaling is a power of two (2**NC_proc), so casting the scaled data
+    to float32 loses nothing beyond float32's 24-bit mantissa; the procs
+    metadata is untouched and integration/binning accumulate in float64.
+    """
+    if globals.float32_storage:
+        return data.astype(np.float32)
+    return data
+
+# procs parameters needed to locate and scale ppm windows of a 1r file
+PROCS_KEYS = ("SI", "OFFSET", "SW_p", "SF", "BYTORDP", "NC_proc", "DTYPP")
+
+def read_procs(pdata_dir):
+    """
+    Read only the parameters in PROCS_KEYS from a pdata directory's procs
+    file (JCAMP-DX "##$KEY= value" lines) as floats.
+    """
+    procs = {}
+    with open(os.path.join(pdata_dir, "procs"), encoding="latin-1") as f:
+        for line in f:
+            if not line.startswith("##$"):
+                continue
+            key, _, value = line[3:].partition("=")
+            if key in PROCS_KEYS:
+                procs[key] = float(value.strip())
+                if len(procs) == len(PROCS_KEYS):
+                    break
+    return procs
+
+def procs_ppm_indices(procs, ppm_values):
+    """
+    Nearest point of the ppm axis for each value, as np.abs(ppm_scale - v).argmin()
+    would give on the axis nmrglue builds from procs (OFFSET at point 0, falling
+    by SW_p / SF / SI per point).
+    """
+    size = int(procs["SI"])
+    first = procs["OFFSET"]
+    last = first - procs["SW_p"] / procs["SF"] * (size - 1) / size
+    step = (last - first) / (size - 1)
+    ppm_values = np.asarray(ppm_values, dtype=float)
+
+    below = np.clip(np.floor((ppm_values - first) / step).astype(int), 0, size - 1)
+    above = np.clip(below + 1, 0, size - 1)
+    # Ties go to the lower index, as argmin does
+    closer_above = (np.abs(first + above * step - ppm_values)
+                    < np.abs(first + below * step - ppm_values))
+    return np.where(closer_above, above, below)
+
+def read_region_sums(pdata_dir, starts, ends):
+    """
+    Sum the scaled intensities of ppm windows straight from a memory-mapped 1r
+    file, without reading the rest of the spectrum.
+
+    Window bounds are matched to points as in calculate_peak_area, and the
+    sums are scaled by 2**NC_proc like nmrglue's read_pdata(scale_data=True).
+    """
+    procs = read_procs(pdata_dir)
+    byte_order = ">" if procs.get("BYTORDP", 0) == 1 else "<"
+    dtype = np.dtype(byte_order + ("f8" if procs.get("DTYPP", 0) == 2 else "i4"))
+    data = np.memmap(os.path.join(pdata_dir, "1r"), dtype=dtype, mode="r", shape=(int(procs["SI"]),))
+
+    s_idx = procs_ppm_indices(procs, starts)
+    e_idx = procs_ppm_indices(procs, ends)
+    # Only the pages of each window are read from disk
+    sums = np.array([data[s:e + 1].sum(dtype=np.float64)
+                     for s, e in zip(np.minimum(s_idx, e_idx), np.maximum(s_idx, e_idx))])
+    return sums * 2.0 ** procs.get("NC_proc", 0)
+
 def natural_sort_spectra(spectra_list):
     """Sort spectra naturally by sample name."""
     def natural_sort_key(s):
@@ -64,21 +186,63 @@ def load_peak_limits(file_path):
         messagebox.showerror("Error", f"Cannot read peak_limits.xlsx:\n{e}")
         return None
 
+def load_sample_metadata(file_path):
+    """
+    Load sample metadata (groups, covariates) from an Excel or CSV file.
+
+    Rows are indexed by the "Sample" column (else the first column), matched
+    against sample names.
+    """
+    try:
+        if file_path.lower().endswith(".csv"):
+            metadata = pd.read_csv(file_path)
+        else:
+            metadata = pd.read_excel(file_path)
+    except Exception as e:
+        messagebox.showerror("Error", f"Cannot read sample metadata:\n{e}")
+        return None
+
+    if metadata.empty:
+        messagebox.showerror("Error", "The sample metadata file is empty.")
+        return None
+    sample_column = "Sample" if "Sample" in metadata else metadata.columns[0]
+    metadata[sample_column] = metadata[sample_column].astype(str)
+    return metadata.drop_duplicates(sample_column).set_index(sample_column)
+
+def load_pattern_library(file_path):
+    """Load a metabolite multiplet pattern library from an Excel or CSV file."""
+    try:
+        if file_path.lower().endswith(".csv"):
+            library = pd.read_csv(file_path)
+        else:
+            library = pd.read_excel(file_path)
+    except Exception as e:
+        messagebox.showerror("Error", f"Cannot read pattern library:\n{e}")
+        return None
+
+    missing = [column for column in ("Metabolite", "ppm", "Multiplicity") if column not in library]
+    if missing:
+        messagebox.showerror("Error", f"Pattern library is missing the column(s): {', '.join(missing)}")
+        return None
+    return library.dropna(subset=["Metabolite", "ppm", "Multiplicity"]).reset_index(drop=True)
+
 def get_sample_name(pdata_dir):
     """Extract sample name from pdata directory path."""
     return os.path.basename(os.path.dirname(os.path.dirname(pdata_dir)))
 
 def load_bruker_data(pdata_dir):
     """Load Bruker data from pdata directory."""
+    import nmrglue as ng
     try:
         dic, data = ng.bruker.read_pdata(pdata_dir, scale_data=True)
-        return dic, data
+        return dic, to_storage_dtype(data)
     except Exception as e:
         print(f"Error loading Bruker data from {pdata_dir}: {e}")
         return None, None
 
 def get_spectrum_info(dic, data, pdata_dir):
     """Get spectrum information from Bruker data."""
+    import nmrglue as ng
     try:
         udic = ng.bruker.guess_udic(dic, data)
         uc = ng.fileiobase.uc_from_udic(udic)
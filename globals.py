@@ -1,6 +1,11 @@
 # --------------------------------------------------
 # GLOBAL VARIABLES AND EVENT SYSTEM
 # --------------------------------------------------
+import threading
+from collections import OrderedDict
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 from typing import List, Callable, Any
 
@@ -9,6 +14,7 @@ selected_pdata_dirs = []
 spectra = []
 peak_limits = pd.DataFrame()
 peak_limits_path = None
+peak_limits_index = None  # interval index over peak_limits (analysis.interval_index)
 
 # Analysis results
 integration_results = []
@@ -18,35 +24,196 @@ peak_picking_results = []
 all_peak_picking_results = []
 deconvolution_results = []
 
+# Pure-compound reference spectra for library quantification (analysis.quantification)
+reference_library = None
+
+# Sample metadata (one row per sample, indexed by sample name) and the last statistics results
+sample_metadata = None
+multivariate_results = None
+univariate_results = None  # per-bin group comparison (analysis.univariate)
+
+# Multiplet pattern library for metabolite identification (analysis.pattern_matching)
+pattern_library = None
+
+# Spectral alignment (offsets in ppm, keyed by pdata_dir) and the targets they were found against
+alignment_segments = np.empty((0, 2))
+alignment_offsets = {}
+alignment_settings = None
+
+# Baseline-corrected intensities, keyed by pdata_dir
+baseline_corrected = {}
+baseline_settings = None
+
+# Normalization factors (intensities are divided by them), keyed by pdata_dir
+normalization_factors = {}
+normalization_settings = None
+
+# ppm regions left out of total-area and PQN normalization: TSP, water, urea
+excluded_regions = [(-1.0, 0.5), (4.5, 5.0), (5.5, 6.1)]
+
+# Per-spectrum statistics (max/min, noise, peak region bounds), keyed by pdata_dir
+spectrum_index = {}
+
 # Default parameters
 tsp_concentration = 0
 binning_step = 0.05
+peak_match_tolerance = 0.01  # ppm; peaks of different spectra this close form one feature
+spectrometer_mhz = 600.0  # converts pattern library J couplings (Hz) to ppm
 selected_spectra_indices = []
 
+# Store intensities as float32 to halve memory (sums still accumulate in float64)
+float32_storage = False
+
+# Integrate and quantify spectra on disk by reading only the peak_limits
+# windows of their 1r files instead of the whole spectrum
+region_only_loading = False
+
+# Deconvolution fit memo cache (LRU, most recently used last)
+deconvolution_cache = OrderedDict()
+deconvolution_cache_bytes = 0
+deconvolution_cache_max_entries = 256
+deconvolution_cache_max_bytes = 64 * 1024 * 1024
+deconvolution_cache_dir = None  # set to a folder to keep fits across restarts
+deconvolution_cache_max_disk_entries = 2048
+
+# Per-stage performance records (wall/CPU time, throughput, peak memory)
+performance_records = []
+performance_records_limit = 1000
+trace_memory = False  # tracemalloc peak memory per stage; opt-in, since it slows every stage
+
+# Memory budget for spectra and caches; cold spectra beyond it are moved to
+# memory-mapped files (None: half of physical memory)
+memory_budget_mb = None
+spill_directory = None  # None: a temporary folder removed at exit
+spectrum_access = {}  # pdata_dir -> last access counter, for least-recently-used eviction
+
+# Folder-watch mode
+watch_directory = None
+watch_session = 0  # bumped on every start/stop; a polling chain stops once it is stale
+watch_interval_ms = 5000
+
 # Event system for cross-tab communication
+# Each listener is a dict with 'callback', 'key' and 'threaded' entries.
 _event_listeners = {}
 
-def add_event_listener(event_name: str, callback: Callable):
-    """Add an event listener for cross-tab communication."""
-    if event_name not in _event_listeners:
-        _event_listeners[event_name] = []
-    _event_listeners[event_name].append(callback)
+# State events whose listeners re-read global state; bursts of these are
+# coalesced into a single dispatch. Events carrying deltas (e.g.
+# 'spectra_added') are always delivered one by one.
+COALESCED_EVENTS = {'spectra_updated', 'peak_limits_updated', 'alignment_updated', 'baseline_updated',
+                    'normalization_updated', 'performance_recorded', 'memory_updated'}
+
+_dispatcher = None
+_pending_events = {}
+_worker = None
+_timing_lock = threading.Lock()
+listener_timings = {}
+
+def set_dispatcher(root):
+    """Dispatch coalesced events on root.after_idle instead of synchronously."""
+    global _dispatcher
+    _dispatcher = root
+
+def _listener_name(callback):
+    """Readable name of a listener for timing reports."""
+    qualname = getattr(callback, '__qualname__', None)
+    if qualname is None:
+        return repr(callback)
+    return f"{getattr(callback, '__module__', '')}.{qualname}"
+
+def add_event_listener(event_name: str, callback: Callable, key: str = None, threaded: bool = False):
+    """
+    Add an event listener for cross-tab communication.
+
+    Listeners are deduplicated: registering the same callback twice, or a
+    second callback under the same key, replaces the earlier registration.
+    threaded listeners run on a background worker and must not touch Tk.
+    """
+    listeners = _event_listeners.setdefault(event_name, [])
+    listeners[:] = [l for l in listeners
+                    if l['callback'] is not callback and (key is None or l['key'] != key)]
+    listeners.append({'callback': callback, 'key': key or _listener_name(callback), 'threaded': threaded})
+
+def remove_event_listener(event_name: str, key: str):
+    """Remove the listener registered under key."""
+    if event_name in _event_listeners:
+        _event_listeners[event_name] = [l for l in _event_listeners[event_name] if l['key'] != key]
+
+def _record_timing(event_name, key, elapsed):
+    """Accumulate call count, total and worst-case time per listener."""
+    with _timing_lock:
+        stats = listener_timings.setdefault((event_name, key), [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+
+def _call_listener(event_name, listener, args, kwargs):
+    """Call one listener, timing it and reporting errors."""
+    started = time.perf_counter()
+    try:
+        listener['callback'](*args, **kwargs)
+    except Exception as e:
+        print(f"Error in event listener for {event_name}: {e}")
+    _record_timing(event_name, listener['key'], time.perf_counter() - started)
+
+def _dispatch(event_name, args, kwargs):
+    """Deliver an event to every listener."""
+    global _worker
+    for listener in list(_event_listeners.get(event_name, [])):
+        if listener['threaded']:
+            if _worker is None:
+                _worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='event-worker')
+            _worker.submit(_call_listener, event_name, listener, args, kwargs)
+        else:
+            _call_listener(event_name, listener, args, kwargs)
+
+def _flush_event(event_name):
+    """Deliver the latest pending arguments of a coalesced event."""
+    pending = _pending_events.pop(event_name, None)
+    if pending is not None:
+        _dispatch(event_name, *pending)
 
 def trigger_event(event_name: str, *args, **kwargs):
     """Trigger an event and call all registered listeners."""
-    if event_name in _event_listeners:
-        for callback in _event_listeners[event_name]:
-            try:
-                callback(*args, **kwargs)
-            except Exception as e:
-                print(f"Error in event listener for {event_name}: {e}")
+    if event_name not in _event_listeners:
+        return
+
+    if _dispatcher is None or event_name not in COALESCED_EVENTS:
+        _dispatch(event_name, args, kwargs)
+        return
+
+    # Only the most recent arguments of a burst are delivered
+    already_scheduled = event_name in _pending_events
+    _pending_events[event_name] = (args, kwargs)
+    if not already_scheduled:
+        _dispatcher.after_idle(_flush_event, event_name)
+
+def get_listener_timings():
+    """Return listener timings as rows sorted by total time, slowest first."""
+    with _timing_lock:
+        rows = [{"Event": event_name, "Listener": key, "Calls": count,
+                 "Total (s)": total, "Max (s)": worst}
+                for (event_name, key), (count, total, worst) in listener_timings.items()]
+    return sorted(rows, key=lambda r: r["Total (s)"], reverse=True)
 
 def update_spectra(new_spectra):
     """Update spectra and notify all listeners."""
-    global spectra
+    global spectra, alignment_segments, alignment_offsets, alignment_settings
+    global baseline_corrected, baseline_settings, normalization_factors, normalization_settings
     spectra = new_spectra
+    alignment_segments = np.empty((0, 2))
+    alignment_offsets = {}
+    alignment_settings = None
+    baseline_corrected = {}
+    baseline_settings = None
+    normalization_factors = {}
+    normalization_settings = None
     trigger_event('spectra_updated', spectra)
 
+def add_spectra(new_spectra):
+    """Append newly loaded spectra and notify listeners with only the new ones."""
+    spectra.extend(new_spectra)
+    trigger_event('spectra_added', new_spectra)
+
 def update_peak_limits(new_peak_limits):
     """Update peak limits and notify all listeners."""
     global peak_limits
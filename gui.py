@@ -1,6 +1,6 @@
 import tkinter as tk
 from tkinter import ttk
-import matplotlib.pyplot as plt
+import matplotlib
 from matplotlib.colors import to_rgba
 import sv_ttk
 
@@ -63,7 +63,7 @@ class Theme:
     @classmethod
     def setup_matplotlib_style(cls):
         """Set up matplotlib with the application theme."""
-        plt.rcParams.update({
+        matplotlib.rcParams.update({
             'figure.facecolor': cls.PLOT_BACKGROUND,
             'axes.facecolor': cls.PLOT_BACKGROUND,
             'axes.edgecolor': cls.PLOT_AXES,
@@ -1,13 +1,12 @@
+import tkinter as tk
 import gui
 import globals
+import analysis.spectrum_index as spectrum_index
+import analysis.alignment as alignment
+import analysis.baseline as baseline
+import analysis.normalization as normalization
+import memory_budget
 from tabs.dataset_tab import create_dataset_tab
-from tabs.spectra_tab import create_spectra_tab, update_spectra_list
-from tabs.concentration_tab import create_concentration_tab
-from tabs.binning_tab import create_binning_tab
-from tabs.integration_tab import create_integration_tab
-from tabs.peak_picking_tab import create_peak_picking_tab, update_peak_picking_spectra_list
-from tabs.deconvolution_tab import create_deconvolution_tab, update_deconvolution_spectra_list
-from tabs.reporting_tab import create_reporting_tab
 
 class NMRApplication:
     def __init__(self):
@@ -17,14 +16,45 @@ class NMRApplication:
         self.spectra_listbox = None
         self.peak_picking_spectra_listbox = None
         self.deconvolution_spectra_listbox = None
+        # Placeholder frame -> builder for tabs whose contents are not built yet
+        self.pending_tabs = {}
         
     def setup_event_handlers(self):
         """Set up event handlers for cross-tab communication."""
-        # When spectra are updated, update all listboxes
+        # When spectra are updated, refresh the status (each tab refreshes its own listbox)
         globals.add_event_listener('spectra_updated', self.on_spectra_updated)
         
+        # The statistics index is not UI state, so it is rebuilt on the event worker
+        globals.add_event_listener('spectra_updated', spectrum_index.rebuild_index, threaded=True)
+        
+        # Spectra added while aligned or baseline-corrected get the same preprocessing
+        # first, so the index, factors, integrals and concentrations below see it
+        globals.add_event_listener('spectra_added', alignment.add_spectra)
+        globals.add_event_listener('spectra_added', baseline.add_spectra)
+        
+        # When watch mode appends spectra, only add the new rows
+        globals.add_event_listener('spectra_added', self.on_spectra_added)
+        
+        # Spectra added while normalized get factors against the stored reference
+        globals.add_event_listener('spectra_added', normalization.add_spectra)
+        
+        # Factors are computed on aligned, baseline-corrected data, so they follow both
+        for event_name in ('baseline_updated', 'alignment_updated'):
+            globals.add_event_listener(event_name, lambda *args: normalization.refresh_normalization(),
+                                       key='normalization.refresh_normalization')
+        
         # When peak limits are updated, notify relevant tabs
         globals.add_event_listener('peak_limits_updated', self.on_peak_limits_updated)
+        
+        # Region bounds in the statistics index follow peak limits and alignment shifts
+        globals.add_event_listener('peak_limits_updated', lambda peak_limits: spectrum_index.update_regions(),
+                                   key='spectrum_index.update_regions', threaded=True)
+        globals.add_event_listener('alignment_updated', spectrum_index.update_regions, threaded=True)
+        
+        # Keep spectra and caches within the memory budget, evicting cold spectra to memory maps
+        for event_name in ('spectra_updated', 'spectra_added', 'baseline_updated'):
+            globals.add_event_listener(event_name, lambda *args: memory_budget.enforce_budget(),
+                                       key='memory_budget.enforce_budget')
     
     def on_spectra_updated(self, spectra):
         """Handle spectra updated event."""
@@ -33,26 +63,91 @@ class NMRApplication:
         # Update status label
         if self.status_label:
             self.status_label.config(text=f"Loaded {len(spectra)} spectra")
+    
+    def on_spectra_added(self, new_spectra):
+        """Handle spectra appended by watch mode."""
+        print(f"Spectra added: {len(new_spectra)} new, {len(globals.spectra)} total")
+        spectrum_index.add_to_index(new_spectra)
         
-        # Update all listboxes
-        if self.spectra_listbox:
-            update_spectra_list(self.spectra_listbox)
+        if self.status_label:
+            self.status_label.config(text=f"Loaded {len(globals.spectra)} spectra")
         
-        if self.peak_picking_spectra_listbox:
-            update_peak_picking_spectra_list(self.peak_picking_spectra_listbox)
-            
-        if self.deconvolution_spectra_listbox:
-            update_deconvolution_spectra_list(self.deconvolution_spectra_listbox)
+        for listbox in (self.spectra_listbox, self.peak_picking_spectra_listbox,
+                        self.deconvolution_spectra_listbox):
+            if listbox:
+                for ppm_scale, data, sample_name, pdata_dir in new_spectra:
+                    listbox.insert(tk.END, sample_name)
     
     def on_peak_limits_updated(self, peak_limits):
         """Handle peak limits updated event."""
         print(f"Peak limits updated: {len(peak_limits)} peaks defined")
     
-    def run(self):
-        """Run the application."""
+    def add_lazy_tab(self, title, builder):
+        """Add an empty tab whose contents are built on first selection."""
+        frame = gui.create_themed_frame(self.tab_control)
+        self.tab_control.add(frame, text=title)
+        self.pending_tabs[str(frame)] = (frame, builder)
+    
+    def on_tab_changed(self, event):
+        """Build the selected tab if this is the first time it is shown."""
+        pending = self.pending_tabs.pop(self.tab_control.select(), None)
+        if pending:
+            frame, builder = pending
+            builder(frame)
+    
+    def build_spectra_tab(self, frame):
+        """Build the spectrum viewer tab inside its placeholder frame."""
+        from tabs.spectra_tab import create_spectra_tab
+        _, self.spectra_listbox = create_spectra_tab(self.tab_control, frame)
+    
+    def build_concentration_tab(self, frame):
+        """Build the concentration tab inside its placeholder frame."""
+        from tabs.concentration_tab import create_concentration_tab
+        create_concentration_tab(self.tab_control, frame)
+    
+    def build_binning_tab(self, frame):
+        """Build the binning tab inside its placeholder frame."""
+        from tabs.binning_tab import create_binning_tab
+        create_binning_tab(self.tab_control, frame)
+    
+    def build_statistics_tab(self, frame):
+        """Build the statistics tab inside its placeholder frame."""
+        from tabs.statistics_tab import create_statistics_tab
+        create_statistics_tab(self.tab_control, frame)
+
+    def build_integration_tab(self, frame):
+        """Build the integration tab inside its placeholder frame."""
+        from tabs.integration_tab import create_integration_tab
+        create_integration_tab(self.tab_control, frame)
+    
+    def build_peak_picking_tab(self, frame):
+        """Build the peak picking tab inside its placeholder frame."""
+        from tabs.peak_picking_tab import create_peak_picking_tab
+        _, self.peak_picking_spectra_listbox = create_peak_picking_tab(self.tab_control, frame)
+    
+    def build_deconvolution_tab(self, frame):
+        """Build the deconvolution tab inside its placeholder frame."""
+        from tabs.deconvolution_tab import create_deconvolution_tab
+        _, self.deconvolution_spectra_listbox = create_deconvolution_tab(self.tab_control, frame)
+    
+    def build_reporting_tab(self, frame):
+        """Build the reporting tab inside its placeholder frame."""
+        from tabs.reporting_tab import create_reporting_tab
+        create_reporting_tab(self.tab_control, frame)
+    
+    def build_diagnostics_tab(self, frame):
+        """Build the diagnostics tab inside its placeholder frame."""
+        from tabs.diagnostics_tab import create_diagnostics_tab
+        create_diagnostics_tab(self.tab_control, frame)
+    
+    def build_window(self):
+        """Create the main window, its header, the dataset tab and the lazy tab placeholders."""
         # Create main application window
         self.root = gui.create_main_window()
         
+        # Coalesce bursts of state events into one dispatch per idle cycle
+        globals.set_dispatcher(self.root)
+        
         # Create header and get status label
         self.status_label = gui.create_header(self.root)
         
@@ -62,15 +157,23 @@ class NMRApplication:
         # Setup event handlers
         self.setup_event_handlers()
         
-        # Create all tabs and store references to listboxes
-        dataset_tab = create_dataset_tab(self.tab_control, self.status_label)
-        spectra_tab, self.spectra_listbox = create_spectra_tab(self.tab_control)
-        concentration_tab = create_concentration_tab(self.tab_control)
-        binning_tab = create_binning_tab(self.tab_control)
-        integration_tab = create_integration_tab(self.tab_control)
-        peak_picking_tab, self.peak_picking_spectra_listbox = create_peak_picking_tab(self.tab_control)
-        deconvolution_tab, self.deconvolution_spectra_listbox = create_deconvolution_tab(self.tab_control)
-        reporting_tab = create_reporting_tab(self.tab_control)
+        # The dataset tab is shown first and is built right away; the others
+        # (matplotlib canvases, scipy) are built the first time they are selected
+        create_dataset_tab(self.tab_control, self.status_label)
+        self.add_lazy_tab("📊 Spectrum Viewer", self.build_spectra_tab)
+        self.add_lazy_tab("🧪 Concentrations", self.build_concentration_tab)
+        self.add_lazy_tab("📈 Binning", self.build_binning_tab)
+        self.add_lazy_tab("📐 Statistics", self.build_statistics_tab)
+        self.add_lazy_tab("📉 Integrations", self.build_integration_tab)
+        self.add_lazy_tab("🔍 Peak Picking", self.build_peak_picking_tab)
+        self.add_lazy_tab("📊 Spectral Deconvolution", self.build_deconvolution_tab)
+        self.add_lazy_tab("📋 Automated Reporting", self.build_reporting_tab)
+        self.add_lazy_tab("🩺 Diagnostics", self.build_diagnostics_tab)
+        self.tab_control.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+    
+    def run(self):
+        """Run the application."""
+        self.build_window()
         
         # Start the application
         self.root.mainloop()
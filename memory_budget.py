@@ -0,0 +1,234 @@
+# --------------------------------------------------
+# MEMORY ACCOUNTING AND BUDGET
+# --------------------------------------------------
+import os
+import sys
+import atexit
+import shutil
+import tempfile
+import weakref
+import itertools
+import numpy as np
+import pandas as pd
+import globals
+
+# Used when neither a budget is configured nor the physical memory is known
+DEFAULT_BUDGET_MB = 4096
+
+# Large result lists are sized from a sample of their rows
+SAMPLE_ITEMS = 1000
+
+USAGE_COLUMNS = ("Component", "Items", "In Memory (MB)", "Mapped (MB)")
+
+_access_counter = itertools.count(1)
+_file_counter = itertools.count(1)
+_spill_dir = None
+
+def physical_memory_bytes():
+    """Installed RAM in bytes, or None where sysconf is unavailable (Windows)."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def budget_bytes():
+    """Configured budget, else half of physical memory, else DEFAULT_BUDGET_MB."""
+    if globals.memory_budget_mb:
+        return int(globals.memory_budget_mb * 1024**2)
+    physical = physical_memory_bytes()
+    return physical // 2 if physical else DEFAULT_BUDGET_MB * 1024**2
+
+def touch(pdata_dir):
+    """Mark a spectrum as recently used so it is evicted last."""
+    globals.spectrum_access[pdata_dir] = next(_access_counter)
+
+def array_usage(array):
+    """(resident bytes, memory-mapped bytes) of an array."""
+    if isinstance(array, np.memmap):
+        return 0, array.nbytes
+    return array.nbytes, 0
+
+def estimate_bytes(obj, depth=0):
+    """
+    Approximate resident size of a result object.
+
+    Arrays and DataFrames are measured exactly; lists and dicts longer than
+    SAMPLE_ITEMS are extrapolated from their first SAMPLE_ITEMS items.
+    """
+    if isinstance(obj, np.ndarray):
+        return array_usage(obj)[0]
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, (dict, list, tuple)) and depth < 4:
+        items = list(obj.values()) if isinstance(obj, dict) else obj
+        sample = items[:SAMPLE_ITEMS]
+        sampled = sum(estimate_bytes(item, depth + 1) for item in sample)
+        scale = len(items) / len(sample) if sample else 0
+        return sys.getsizeof(obj) + int(sampled * scale)
+    return sys.getsizeof(obj)
+
+def dataset_name(pdata_dir):
+    """Name of the selected dataset folder a spectrum was loaded from."""
+    path = os.path.abspath(pdata_dir)
+    for root_dir in globals.selected_pdata_dirs:
+        if path.startswith(os.path.join(os.path.abspath(root_dir), "")):
+            return os.path.basename(os.path.normpath(root_dir))
+    return os.path.basename(os.path.dirname(os.path.dirname(os.path.dirname(pdata_dir))))
+
+def component_usage():
+    """
+    Memory used per component as rows of USAGE_COLUMNS.
+
+    Spectra are reported per dataset; "Mapped" counts arrays that have been
+    evicted to memory-mapped files (paged in by the OS on access).
+    """
+    rows = []
+    datasets = {}
+    for ppm_scale, data, sample_name, pdata_dir in globals.spectra:
+        row = datasets.setdefault(dataset_name(pdata_dir), [0, 0, 0])
+        row[0] += 1
+        for array in (ppm_scale, data):
+            resident, mapped = array_usage(array)
+            row[1] += resident
+            row[2] += mapped
+    for name, (count, resident, mapped) in datasets.items():
+        rows.append({"Component": f"Spectra: {name}", "Items": count,
+                     "In Memory (MB)": resident, "Mapped (MB)": mapped})
+
+    corrected = [array_usage(a) for a in globals.baseline_corrected.values()]
+    rows.append({"Component": "Baseline-corrected copies", "Items": len(corrected),
+                 "In Memory (MB)": sum(r for r, _ in corrected), "Mapped (MB)": sum(m for _, m in corrected)})
+
+    rows.append({"Component": "Deconvolution cache", "Items": len(globals.deconvolution_cache),
+                 "In Memory (MB)": globals.deconvolution_cache_bytes, "Mapped (MB)": 0})
+
+    for component, obj in (("Spectrum index", globals.spectrum_index),
+                           ("Alignment offsets", globals.alignment_offsets),
+                           ("Reference library", None if globals.reference_library is None
+                                                 else globals.reference_library["spectra"]),
+                           ("Integration results", globals.integration_results),
+                           ("Concentration results", globals.concentration_results),
+                           ("Binning results", globals.binning_results),
+                           ("Peak picking results", globals.all_peak_picking_results),
+                           ("Deconvolution results", globals.deconvolution_results),
+                           ("Performance records", globals.performance_records)):
+        rows.append({"Component": component, "Items": 0 if obj is None else len(obj),
+                     "In Memory (MB)": 0 if obj is None else estimate_bytes(obj), "Mapped (MB)": 0})
+
+    for row in rows:
+        row["In Memory (MB)"] /= 1024**2
+        row["Mapped (MB)"] /= 1024**2
+    return rows
+
+def resident_bytes():
+    """Total resident bytes over all components."""
+    return int(sum(row["In Memory (MB)"] for row in component_usage()) * 1024**2)
+
+def usage_table():
+    """Component usage with a total row and the budget, for display and export."""
+    rows = component_usage()
+    rows.append({"Component": "Total", "Items": None,
+                 "In Memory (MB)": sum(r["In Memory (MB)"] for r in rows),
+                 "Mapped (MB)": sum(r["Mapped (MB)"] for r in rows)})
+    rows.append({"Component": "Budget", "Items": None,
+                 "In Memory (MB)": budget_bytes() / 1024**2, "Mapped (MB)": None})
+    return rows
+
+def spill_directory():
+    """Folder for memory-mapped spectra: globals.spill_directory or a temporary folder removed at exit."""
+    global _spill_dir
+    if globals.spill_directory:
+        os.makedirs(globals.spill_directory, exist_ok=True)
+        return globals.spill_directory
+    if _spill_dir is None:
+        _spill_dir = tempfile.mkdtemp(prefix="peaknmr_spill_")
+        atexit.register(shutil.rmtree, _spill_dir, ignore_errors=True)
+    return _spill_dir
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass  # still mapped by a view (Windows); removed with the folder at exit
+
+def spill_array(array):
+    """
+    Write array to a .npy file and return a read-only memory map of it.
+
+    Returns (array, freed bytes); memory maps are returned unchanged. The
+    file is deleted once the memory map is garbage collected.
+    """
+    if isinstance(array, np.memmap):
+        return array, 0
+    path = os.path.join(spill_directory(), f"{next(_file_counter):08d}.npy")
+    np.save(path, array)
+    mapped = np.load(path, mmap_mode='r')
+    weakref.finalize(mapped, _remove_file, path)
+    return mapped, array.nbytes
+
+def outgoing_dataset_bytes():
+    """Resident bytes of the spectra and baseline-corrected copies a new dataset replaces."""
+    arrays = [a for ppm_scale, data, _, _ in globals.spectra for a in (ppm_scale, data)]
+    arrays.extend(globals.baseline_corrected.values())
+    return sum(array_usage(a)[0] for a in arrays)
+
+def headroom_bytes(replacing=False):
+    """
+    Bytes left in the budget before eviction starts. When the load replaces
+    the dataset, the outgoing spectra are about to be released and do not count.
+    """
+    used = resident_bytes()
+    if replacing:
+        used -= outgoing_dataset_bytes()
+    return budget_bytes() - used
+
+def admit(arrays, headroom):
+    """
+    Keep freshly loaded arrays in memory while they fit in headroom, else
+    memory-map them straight away so a large load never exceeds the budget.
+
+    Returns the (possibly mapped) arrays and the remaining headroom.
+    """
+    size = sum(array_usage(a)[0] for a in arrays)
+    if size <= headroom:
+        return arrays, headroom - size
+    return [spill_array(a)[0] for a in arrays], headroom
+
+def evict_spectrum(index):
+    """Move one spectrum (and its baseline-corrected copy) to memory-mapped files; return bytes freed."""
+    ppm_scale, data, sample_name, pdata_dir = globals.spectra[index]
+    ppm_scale, freed_ppm = spill_array(ppm_scale)
+    data, freed_data = spill_array(data)
+    globals.spectra[index] = (ppm_scale, data, sample_name, pdata_dir)
+    freed = freed_ppm + freed_data
+
+    if pdata_dir in globals.baseline_corrected:
+        corrected, freed_corrected = spill_array(globals.baseline_corrected[pdata_dir])
+        globals.baseline_corrected[pdata_dir] = corrected
+        freed += freed_corrected
+    return freed
+
+def enforce_budget():
+    """
+    Evict the least recently used spectra to memory-mapped files until the
+    resident total fits the budget. Returns the number of spectra evicted.
+    """
+    excess = resident_bytes() - budget_bytes()
+    if excess <= 0:
+        return 0
+
+    # Never-touched spectra first, in load order, then least recently viewed
+    order = sorted(range(len(globals.spectra)),
+                   key=lambda i: (globals.spectrum_access.get(globals.spectra[i][3], 0), i))
+    evicted = 0
+    for index in order:
+        freed = evict_spectrum(index)
+        if freed:
+            evicted += 1
+            excess -= freed
+        if excess <= 0:
+            break
+
+    print(f"Memory budget: moved {evicted} spectra to memory-mapped storage")
+    globals.trigger_event('memory_updated')
+    return evicted
@@ -0,0 +1,206 @@
+# --------------------------------------------------
+# ON-DEMAND PROFILING OF THE NEXT GUI ACTION
+# --------------------------------------------------
+import os
+import io
+import sys
+import time
+import datetime
+import threading
+import cProfile
+import pstats
+from collections import Counter
+import tkinter as tk
+from tkinter import ttk
+import globals
+
+# Every Tk callback (button commands, event bindings, after() timers) goes
+# through tkinter.CallWrapper. Arming replaces its __call__ for exactly one
+# user action and restores it straight after, so nothing is wrapped while
+# profiling is off.
+
+# Widgets whose command is a user action; other commands (scrollbar and
+# yscrollcommand callbacks) only follow the mouse
+ACTION_WIDGETS = (tk.Button, ttk.Button, tk.Checkbutton, ttk.Checkbutton,
+                  tk.Radiobutton, ttk.Radiobutton, tk.Menu)
+_original_call = None
+_on_finished = None
+
+SAMPLE_INTERVAL_S = 0.001
+TOP_HOTSPOTS = 20
+
+def is_armed():
+    """Whether the next GUI action will be profiled."""
+    return _original_call is not None
+
+def arm(on_finished=None):
+    """Profile the next user action. on_finished is called once it has been profiled."""
+    global _original_call, _on_finished
+    _on_finished = on_finished
+    if _original_call is None:
+        _original_call = tk.CallWrapper.__call__
+        tk.CallWrapper.__call__ = _profiled_call
+
+def disarm():
+    """Stop waiting for an action to profile."""
+    global _original_call
+    if _original_call is not None:
+        tk.CallWrapper.__call__ = _original_call
+        _original_call = None
+
+def profiler_control(func):
+    """Mark a callback as part of the profiler UI so arming/disarming is not profiled."""
+    func._profiler_control = True
+    return func
+
+def _is_user_action(wrapper, args):
+    """
+    Button commands and virtual-event handlers (<<ListboxSelect>>,
+    <<ComboboxSelected>>) are actions; timers, scrolling, mouse and canvas
+    events, tab switches and the profiler's own controls are not.
+    """
+    func = wrapper.func
+    if getattr(func, '__name__', '') == 'callit':  # after()/after_idle() timers
+        return False
+    if isinstance(wrapper.widget, ttk.Notebook):  # navigation, not an action
+        return False
+    if getattr(func, '_profiler_control', False):
+        return False
+    if wrapper.subst is None:
+        return isinstance(wrapper.widget, ACTION_WIDGETS)
+    try:
+        event = wrapper.subst(*args)[0]
+    except Exception:
+        return False
+    return event.type == tk.EventType.VirtualEvent
+
+def _profiled_call(wrapper, *args):
+    original = _original_call
+    if not _is_user_action(wrapper, args):
+        return original(wrapper, *args)
+
+    disarm()
+    name = callback_name(wrapper.func)
+    profile = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident())
+
+    sampler.start()
+    start = time.perf_counter()
+    profile.enable()
+    try:
+        return original(wrapper, *args)
+    finally:
+        profile.disable()
+        elapsed = time.perf_counter() - start
+        sampler.stop()
+        _finish(profile, sampler, name, elapsed, wrapper.widget)
+
+def callback_name(func):
+    """Readable name of a callback; lambdas are named by file and line."""
+    name = getattr(func, '__qualname__', None) or repr(func)
+    code = getattr(func, '__code__', None)
+    if code is not None and '<lambda>' in name:
+        return f"{os.path.basename(code.co_filename)}:{code.co_firstlineno} <lambda>"
+    return f"{getattr(func, '__module__', '')}.{name}"
+
+class StackSampler:
+    """Background thread sampling the stack of one thread into collapsed-stack counts."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL_S):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if code is _profiled_call.__code__:  # stacks start at the callback
+                    break
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+def output_directory():
+    """Folder for profile files: the loaded dataset if writable, else ~/.peaknmr/profiles."""
+    for folder in globals.selected_pdata_dirs[:1]:
+        if os.path.isdir(folder) and os.access(folder, os.W_OK):
+            return folder
+    folder = os.path.join(os.path.expanduser("~"), ".peaknmr", "profiles")
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+def hotspots(profile, limit=TOP_HOTSPOTS):
+    """Top functions by own time as rows of (calls, own s, cumulative s, function)."""
+    stats = pstats.Stats(profile)
+    rows = []
+    for (filename, line, func), (cc, nc, tt, ct, callers) in stats.stats.items():
+        label = func if filename == '~' else f"{func} ({os.path.basename(filename)}:{line})"
+        rows.append((nc, tt, ct, label))
+    rows.sort(key=lambda r: r[1], reverse=True)
+    return rows[:limit]
+
+def save_profile(profile, sampler, name):
+    """Write the .prof file and the collapsed-stack file; return their paths."""
+    stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    safe_name = "".join(c if c.isalnum() else "_" for c in name)[-60:]
+    base = os.path.join(output_directory(), f"peaknmr_profile_{stamp}_{safe_name}")
+
+    prof_path = base + ".prof"
+    profile.dump_stats(prof_path)
+
+    collapsed_path = base + ".collapsed.txt"
+    with open(collapsed_path, "w") as f:
+        for stack, count in sampler.counts.most_common():
+            f.write(f"{stack} {count}\n")
+
+    return prof_path, collapsed_path
+
+def _finish(profile, sampler, name, elapsed, widget):
+    """Save the capture, show the hotspots and notify the UI."""
+    global _on_finished
+    try:
+        prof_path, collapsed_path = save_profile(profile, sampler, name)
+    except OSError as e:
+        print(f"Could not save profile: {e}")
+        prof_path = collapsed_path = None
+
+    print(f"Profiled {name}: {elapsed:.3f} s, {sum(sampler.counts.values())} stack samples")
+    show_hotspots(widget, name, elapsed, hotspots(profile), prof_path, collapsed_path)
+
+    callback, _on_finished = _on_finished, None
+    if callback:
+        callback()
+
+def show_hotspots(parent, name, elapsed, rows, prof_path, collapsed_path):
+    """Dialog listing the top hotspots and where the profile files were saved."""
+    dialog = tk.Toplevel(parent)
+    dialog.title("Profile: top hotspots")
+    dialog.geometry("1000x520")
+
+    text = io.StringIO()
+    text.write(f"Action: {name}\nDuration: {elapsed:.3f} s\n\n")
+    text.write(f"{'Calls':>10} {'Own (s)':>10} {'Cum. (s)':>10}  Function\n")
+    for calls, own, cumulative, func in rows:
+        text.write(f"{calls:>10} {own:>10.4f} {cumulative:>10.4f}  {func}\n")
+    if prof_path:
+        text.write(f"\nProfile (pstats/snakeviz): {prof_path}\n")
+        text.write(f"Collapsed stacks (flamegraph.pl/speedscope): {collapsed_path}\n")
+
+    widget = tk.Text(dialog, wrap='none', font=('Consolas', 9))
+    widget.insert('1.0', text.getvalue())
+    widget.configure(state='disabled')
+    widget.pack(fill='both', expand=True, padx=10, pady=10)
+    ttk.Button(dialog, text="Close", command=dialog.destroy).pack(pady=(0, 10))
@@ -5,10 +5,11 @@ import analysis.binning as binning_analysis
 import globals
 import gui
 
-def create_binning_tab(tab_control):
-    """Create the binning analysis tab."""
-    tab = gui.create_themed_frame(tab_control)
-    tab_control.add(tab, text="📈 Binning")
+def create_binning_tab(tab_control, tab=None):
+    """Create the binning analysis tab, or fill in tab if it was already added."""
+    if tab is None:
+        tab = gui.create_themed_frame(tab_control)
+        tab_control.add(tab, text="📈 Binning")
     
     bin_frame = gui.create_themed_frame(tab)
     bin_frame.pack(fill='both', expand=True, padx=20, pady=20)
@@ -23,12 +24,34 @@ def create_binning_tab(tab_control):
     binning_entry.insert(0, "0.05")
     gui.create_themed_label(bin_input_frame, text="ppm").grid(row=0, column=2, sticky='w', pady=5, padx=(5, 0))
 
+    gui.create_themed_label(bin_input_frame, text="Binning mode:").grid(row=1, column=0, sticky='w', pady=5)
+    mode_combo = ttk.Combobox(bin_input_frame, values=list(binning_analysis.BINNING_MODES),
+                              state='readonly', width=12)
+    mode_combo.grid(row=1, column=1, sticky='w', pady=5, padx=(10, 0))
+    mode_combo.current(0)
+
+    gui.create_themed_label(bin_input_frame, text="Edges from:").grid(row=2, column=0, sticky='w', pady=5)
+    profile_combo = ttk.Combobox(bin_input_frame, values=list(binning_analysis.PROFILES),
+                                 state='readonly', width=12)
+    profile_combo.grid(row=2, column=1, sticky='w', pady=5, padx=(10, 0))
+    profile_combo.current(0)
+    gui.create_themed_label(bin_input_frame, text="spectrum (adaptive mode)").grid(
+        row=2, column=2, sticky='w', pady=5, padx=(5, 0))
+
+    gui.create_themed_label(bin_input_frame, text="Noise threshold:").grid(row=3, column=0, sticky='w', pady=5)
+    noise_entry = ttk.Entry(bin_input_frame, width=15)
+    noise_entry.grid(row=3, column=1, sticky='w', pady=5, padx=(10, 0))
+    noise_entry.insert(0, f"{binning_analysis.NOISE_FACTOR:g}")
+    gui.create_themed_label(bin_input_frame, text="x noise (adaptive mode)").grid(
+        row=3, column=2, sticky='w', pady=5, padx=(5, 0))
+
     # Control buttons
     bin_control_frame = gui.create_themed_frame(bin_frame)
     bin_control_frame.pack(fill='x', pady=10)
 
     process_bin_btn = gui.create_themed_button(bin_control_frame, text="🚀 Perform Binning", 
-                                command=lambda: process_binning(binning_entry, binning_table))
+                                command=lambda: process_binning(binning_entry, mode_combo, profile_combo,
+                                                                noise_entry, binning_table))
     process_bin_btn.pack(side='left', padx=(0, 10))
 
     export_bin_btn = gui.create_themed_button(bin_control_frame, text="💾 Export to Excel", 
@@ -52,14 +75,16 @@ def create_binning_tab(tab_control):
     bin_desc_frame = gui.create_themed_labelframe(bin_frame, text="About", padding=15)
     bin_desc_frame.pack(fill='x', pady=(15, 0))
 
-    description_text = """This module performs uniform binning across the entire spectrum.
-The spectrum is divided into bins of specified size and area is calculated for each bin."""
+    description_text = """This module bins every spectrum and calculates the area of each bin.
+Uniform mode divides the spectrum into bins of the specified size.
+Adaptive mode places bin edges in the valleys of the dataset's mean or max spectrum, so peaks are not
+split; baseline stretches between signals become one bin each and the water, TSP and urea regions are skipped."""
     
     gui.create_themed_label(bin_desc_frame, text=description_text, justify='left').pack(anchor='w')
     
     return tab
 
-def process_binning(binning_entry, binning_table):
+def process_binning(binning_entry, mode_combo, profile_combo, noise_entry, binning_table):
     """Process binning analysis."""
     try:
         bin_size = float(binning_entry.get())
@@ -67,7 +92,18 @@ def process_binning(binning_entry, binning_table):
         messagebox.showerror("Error", "Invalid step size.")
         return
 
-    globals.binning_results = binning_analysis.perform_binning(bin_size)
+    try:
+        noise_factor = float(noise_entry.get())
+    except ValueError:
+        messagebox.showerror("Error", "Invalid noise threshold.")
+        return
+
+    try:
+        globals.binning_results = binning_analysis.perform_binning(
+            bin_size, mode_combo.get(), profile_combo.get(), noise_factor)
+    except ValueError as e:
+        messagebox.showerror("Error", f"Binning failed: {e}")
+        return
     if globals.binning_results is not None:
         display_binning_results(binning_table)
 
@@ -124,4 +160,6 @@ def export_binning():
     if filename:
         with pd.ExcelWriter(filename) as writer:
             globals.binning_results.to_excel(writer)
+            binning_analysis.bin_annotations(globals.binning_results).to_excel(
+                writer, sheet_name="Bin Annotations", index=False)
         messagebox.showinfo("Success", f"Binning results saved to {filename}")
\ No newline at end of file
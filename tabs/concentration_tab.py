@@ -2,13 +2,15 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import pandas as pd
 import analysis.concentration as concentration_analysis
+import analysis.quantification as quantification_analysis
 import globals
 import gui
 
-def create_concentration_tab(tab_control):
-    """Create the concentration analysis tab."""
-    tab = gui.create_themed_frame(tab_control)
-    tab_control.add(tab, text="🧪 Concentrations")
+def create_concentration_tab(tab_control, tab=None):
+    """Create the concentration analysis tab, or fill in tab if it was already added."""
+    if tab is None:
+        tab = gui.create_themed_frame(tab_control)
+        tab_control.add(tab, text="🧪 Concentrations")
     
     conc_frame = gui.create_themed_frame(tab)
     conc_frame.pack(fill='both', expand=True, padx=20, pady=20)
@@ -23,6 +25,13 @@ def create_concentration_tab(tab_control):
     concentration_entry.insert(0, "0")
     gui.create_themed_label(input_frame, text="μM").grid(row=0, column=2, sticky='w', pady=5, padx=(5, 0))
 
+    gui.create_themed_label(input_frame, text="Reference library:").grid(row=1, column=0, sticky='w', pady=5)
+    library_label = gui.create_themed_label(input_frame, text=library_description())
+    library_label.grid(row=1, column=1, columnspan=2, sticky='w', pady=5, padx=(10, 0))
+    load_library_btn = gui.create_themed_button(input_frame, text="📚 Load Library",
+                                 command=lambda: load_library(library_label))
+    load_library_btn.grid(row=1, column=3, sticky='w', pady=5, padx=(10, 0))
+
     # Control buttons
     control_frame = gui.create_themed_frame(conc_frame)
     control_frame.pack(fill='x', pady=10)
@@ -31,6 +40,10 @@ def create_concentration_tab(tab_control):
                                  command=lambda: process_concentrations(concentration_entry, concentration_table))
     process_conc_btn.pack(side='left', padx=(0, 10))
 
+    library_conc_btn = gui.create_themed_button(control_frame, text="🧮 Quantify with Library",
+                                 command=lambda: process_library_concentrations(concentration_entry, concentration_table))
+    library_conc_btn.pack(side='left', padx=(0, 10))
+
     export_conc_btn = gui.create_themed_button(control_frame, text="💾 Export to Excel", 
                                 command=export_concentrations)
     export_conc_btn.pack(side='left')
@@ -53,10 +66,21 @@ def create_concentration_tab(tab_control):
     desc_frame.pack(fill='x', pady=(15, 0))
 
     description_text = """This module calculates absolute concentrations using the internal reference standard.
-Areas are calculated by simple summation of intensity values within defined peak regions."""
+Areas are calculated by simple summation of intensity values within defined peak regions.
+"Quantify with Library" instead fits every spectrum as a non-negative sum of pure-compound reference
+spectra, so overlapping metabolites are separated; peak regions are matched to compounds by name."""
     
     gui.create_themed_label(desc_frame, text=description_text, justify='left').pack(anchor='w')
     
+    # Refresh when watch mode appends results for new samples
+    globals.add_event_listener('concentration_results_added',
+                              lambda new_results: display_concentration_results(concentration_table),
+                              key='display_concentration_results')
+    
+    # A tab built after results exist (e.g. from watch mode) shows them
+    if globals.concentration_results:
+        display_concentration_results(concentration_table)
+    
     return tab
 
 def process_concentrations(concentration_entry, concentration_table):
@@ -67,11 +91,42 @@ def process_concentrations(concentration_entry, concentration_table):
         messagebox.showerror("Error", "Invalid concentration value.")
         return
 
+    globals.tsp_concentration = tsp_concentration
     results = concentration_analysis.calculate_concentrations(tsp_concentration)
     if results:
         globals.concentration_results, results_area = results
         display_concentration_results(concentration_table)
 
+def library_description():
+    """Short description of the loaded reference library."""
+    if globals.reference_library is None:
+        return "none loaded"
+    return f"{len(globals.reference_library['names'])} compounds"
+
+def load_library(library_label):
+    """Load a folder of pure-compound reference spectra."""
+    library_dir = filedialog.askdirectory(title="Select reference library folder")
+    if not library_dir:
+        return
+    library = quantification_analysis.load_reference_library(library_dir)
+    if library:
+        library_label.config(text=library_description())
+        print(f"Loaded reference library: {', '.join(library['names'])}")
+
+def process_library_concentrations(concentration_entry, concentration_table):
+    """Quantify all spectra against the reference library."""
+    try:
+        tsp_concentration = float(concentration_entry.get())
+    except ValueError:
+        messagebox.showerror("Error", "Invalid concentration value.")
+        return
+
+    globals.tsp_concentration = tsp_concentration
+    results = quantification_analysis.calculate_library_concentrations(tsp_concentration)
+    if results:
+        globals.concentration_results, results_area = results
+        display_concentration_results(concentration_table)
+
 def display_concentration_results(concentration_table):
     """Display concentration results in the table."""
     # Clear the table
@@ -3,11 +3,17 @@ from tkinter import ttk, filedialog, messagebox
 import os
 import file_io
 import globals
+import analysis.integration as integration_analysis
+import analysis.concentration as concentration_analysis
+import analysis.alignment as alignment_analysis
+import analysis.baseline as baseline_analysis
+import analysis.normalization as normalization_analysis
 
-def create_dataset_tab(tab_control, status_label):
-    """Create the dataset setup tab."""
-    tab = ttk.Frame(tab_control)
-    tab_control.add(tab, text="📁 Dataset Setup")
+def create_dataset_tab(tab_control, status_label, tab=None):
+    """Create the dataset setup tab, or fill in tab if it was already added."""
+    if tab is None:
+        tab = ttk.Frame(tab_control)
+        tab_control.add(tab, text="📁 Dataset Setup")
     
     setup_frame = ttk.Frame(tab)
     setup_frame.pack(fill='both', expand=True, padx=20, pady=20)
@@ -36,6 +42,128 @@ def create_dataset_tab(tab_control, status_label):
     selected_dirs_label = ttk.Label(dataset_frame, text="No dataset selected", foreground="#CCCCCC")
     selected_dirs_label.grid(row=1, column=0, columnspan=2, sticky='w', pady=(5, 0))
 
+    float32_var = tk.BooleanVar(value=globals.float32_storage)
+    float32_check = ttk.Checkbutton(dataset_frame, text="Store intensities as float32 (halves memory)",
+                                    variable=float32_var,
+                                    command=lambda: setattr(globals, 'float32_storage', float32_var.get()))
+    float32_check.grid(row=2, column=0, sticky='w', pady=(5, 0))
+
+    float32_check_button = ttk.Button(dataset_frame, text="🎯 Check float32 accuracy",
+                                      command=show_float32_accuracy)
+    float32_check_button.grid(row=2, column=1, sticky='w', pady=(5, 0), padx=(10, 0))
+
+    region_only_var = tk.BooleanVar(value=globals.region_only_loading)
+    region_only_check = ttk.Checkbutton(dataset_frame,
+                                        text="Region-only loading (integrations and concentrations read just the peak windows)",
+                                        variable=region_only_var,
+                                        command=lambda: setattr(globals, 'region_only_loading', region_only_var.get()))
+    region_only_check.grid(row=3, column=0, sticky='w', pady=(5, 0))
+
+    region_check_button = ttk.Button(dataset_frame, text="🎯 Check region reads",
+                                     command=show_region_read_accuracy)
+    region_check_button.grid(row=3, column=1, sticky='w', pady=(5, 0), padx=(10, 0))
+
+    # Watch mode section
+    watch_frame = ttk.LabelFrame(setup_frame, text="3. Watch Mode (sample changer runs)", padding=15)
+    watch_frame.pack(fill='x', pady=(0, 15))
+
+    ttk.Label(watch_frame, text="Poll interval (s):").grid(row=0, column=0, sticky='w', pady=5)
+    watch_interval_entry = ttk.Entry(watch_frame, width=8)
+    watch_interval_entry.grid(row=0, column=1, sticky='w', pady=5, padx=(10, 0))
+    watch_interval_entry.insert(0, str(globals.watch_interval_ms // 1000))
+
+    watch_button = ttk.Button(watch_frame, text="👀 Start watching folder",
+                              command=lambda: toggle_watch(tab, watch_button, watch_interval_entry,
+                                                           watch_status_label, status_label))
+    watch_button.grid(row=0, column=2, sticky='w', pady=5, padx=(10, 0))
+
+    watch_status_label = ttk.Label(watch_frame, text="Not watching", foreground="#CCCCCC")
+    watch_status_label.grid(row=1, column=0, columnspan=3, sticky='w', pady=(5, 0))
+
+    # Preprocessing section
+    preprocess_frame = ttk.LabelFrame(setup_frame, text="4. Preprocessing", padding=15)
+    preprocess_frame.pack(fill='x', pady=(0, 15))
+
+    ttk.Label(preprocess_frame, text="Max alignment shift (ppm):").grid(row=0, column=0, sticky='w', pady=5)
+    max_shift_entry = ttk.Entry(preprocess_frame, width=8)
+    max_shift_entry.grid(row=0, column=1, sticky='w', pady=5, padx=(10, 0))
+    max_shift_entry.insert(0, "0.02")
+
+    align_button = ttk.Button(preprocess_frame, text="↔️ Align spectra",
+                              command=lambda: run_alignment(max_shift_entry, alignment_label))
+    align_button.grid(row=0, column=2, sticky='w', pady=5, padx=(10, 0))
+
+    reset_align_button = ttk.Button(preprocess_frame, text="🔄 Reset alignment",
+                                    command=lambda: reset_alignment(alignment_label))
+    reset_align_button.grid(row=0, column=3, sticky='w', pady=5, padx=(10, 0))
+
+    alignment_label = ttk.Label(preprocess_frame, text="Spectra not aligned", foreground="#CCCCCC")
+    alignment_label.grid(row=1, column=0, columnspan=4, sticky='w', pady=(5, 0))
+
+    ttk.Label(preprocess_frame, text="Baseline method:").grid(row=2, column=0, sticky='w', pady=5)
+    baseline_method_combo = ttk.Combobox(preprocess_frame, values=list(baseline_analysis.BASELINE_METHODS),
+                                         width=8, state='readonly')
+    baseline_method_combo.grid(row=2, column=1, sticky='w', pady=5, padx=(10, 0))
+    baseline_method_combo.current(0)
+
+    ttk.Label(preprocess_frame, text="Smoothness (λ):").grid(row=3, column=0, sticky='w', pady=5)
+    baseline_lambda_entry = ttk.Entry(preprocess_frame, width=8)
+    baseline_lambda_entry.grid(row=3, column=1, sticky='w', pady=5, padx=(10, 0))
+    baseline_lambda_entry.insert(0, "1e7")
+
+    baseline_button = ttk.Button(preprocess_frame, text="📏 Correct baselines",
+                                 command=lambda: run_baseline_correction(
+                                     baseline_method_combo, baseline_lambda_entry, baseline_label, status_label))
+    baseline_button.grid(row=2, column=2, sticky='w', pady=5, padx=(10, 0))
+
+    reset_baseline_button = ttk.Button(preprocess_frame, text="🔄 Reset baselines",
+                                       command=lambda: reset_baseline_correction(baseline_label))
+    reset_baseline_button.grid(row=2, column=3, sticky='w', pady=5, padx=(10, 0))
+
+    baseline_label = ttk.Label(preprocess_frame, text="Baselines not corrected", foreground="#CCCCCC")
+    baseline_label.grid(row=4, column=0, columnspan=4, sticky='w', pady=(5, 0))
+
+    ttk.Label(preprocess_frame, text="Normalization:").grid(row=5, column=0, sticky='w', pady=5)
+    normalization_combo = ttk.Combobox(preprocess_frame, values=list(normalization_analysis.METHODS[1:]),
+                                       state='readonly', width=16)
+    normalization_combo.grid(row=5, column=1, sticky='w', pady=5, padx=(10, 0))
+    normalization_combo.current(1)
+
+    ttk.Label(preprocess_frame, text="Reference region (ppm):").grid(row=6, column=0, sticky='w', pady=5)
+    region_frame = ttk.Frame(preprocess_frame)
+    region_frame.grid(row=6, column=1, sticky='w', pady=5, padx=(10, 0))
+    region_start_entry = ttk.Entry(region_frame, width=6)
+    region_start_entry.pack(side='left')
+    region_start_entry.insert(0, "3.00")
+    ttk.Label(region_frame, text="–").pack(side='left', padx=3)
+    region_end_entry = ttk.Entry(region_frame, width=6)
+    region_end_entry.pack(side='left')
+    region_end_entry.insert(0, "3.10")
+
+    normalize_button = ttk.Button(preprocess_frame, text="⚖️ Normalize",
+                                  command=lambda: run_normalization(
+                                      normalization_combo, region_start_entry, region_end_entry,
+                                      normalization_label, status_label))
+    normalize_button.grid(row=5, column=2, sticky='w', pady=5, padx=(10, 0))
+
+    reset_normalization_button = ttk.Button(preprocess_frame, text="🔄 Reset normalization",
+                                            command=lambda: reset_normalization(normalization_label))
+    reset_normalization_button.grid(row=5, column=3, sticky='w', pady=5, padx=(10, 0))
+
+    normalization_label = ttk.Label(preprocess_frame, text="Spectra not normalized", foreground="#CCCCCC")
+    normalization_label.grid(row=7, column=0, columnspan=4, sticky='w', pady=(5, 0))
+
+    # Factors are recomputed after baseline correction or alignment and dropped with a new dataset
+    globals.add_event_listener('normalization_updated', lambda: update_normalization_label(normalization_label),
+                               key='dataset_tab.update_normalization_label')
+    globals.add_event_listener('spectra_updated', lambda spectra: update_normalization_label(normalization_label),
+                               key='dataset_tab.update_normalization_label')
+
+    # A new dataset is loaded unaligned and uncorrected
+    globals.add_event_listener('spectra_updated', lambda spectra: reset_preprocessing_labels(
+                                   alignment_label, baseline_label),
+                               key='dataset_tab.reset_preprocessing_labels')
+
     # Instructions
     info_frame = ttk.LabelFrame(setup_frame, text="ℹ️ Instructions", padding=15)
     info_frame.pack(fill='x', pady=(0, 15))
@@ -47,6 +175,9 @@ def create_dataset_tab(tab_control, status_label):
     4. Use other tabs for specific analyses (Concentrations, Binning, Integrations, Peak Picking)
     5. Use Spectral Deconvolution for overlapping peak analysis
     6. Generate comprehensive reports in Automated Reporting tab
+    7. Use Watch Mode to pick up new experiments while a sample changer is running
+    8. Align spectra before integration, binning and peak picking to correct pH/temperature shifts
+    9. Normalize spectra to remove dilution differences before integration and binning
     """
     ttk.Label(info_frame, text=instructions, justify='left', font=('Segoe UI', 9)).pack(anchor='w')
     
@@ -121,4 +252,233 @@ def browse_directory(selected_dirs_label, status_label):
         
     except Exception as e:
         messagebox.showerror("Error", f"Failed to load spectra: {str(e)}")
-        status_label.config(text="Error loading spectra")
\ No newline at end of file
+        status_label.config(text="Error loading spectra")
+
+def toggle_watch(tab, watch_button, watch_interval_entry, watch_status_label, status_label):
+    """Start or stop watching a root directory for newly completed experiments."""
+    if globals.watch_directory is not None:
+        globals.watch_directory = None
+        globals.watch_session += 1
+        watch_button.config(text="👀 Start watching folder")
+        watch_status_label.config(text="Not watching", foreground="#CCCCCC")
+        return
+
+    if globals.peak_limits_path is None:
+        messagebox.showerror("Error", "Please upload a peak_limits.xlsx file first.")
+        return
+
+    try:
+        interval_s = float(watch_interval_entry.get())
+    except ValueError:
+        messagebox.showerror("Error", "Invalid poll interval.")
+        return
+    globals.watch_interval_ms = max(500, int(interval_s * 1000))
+
+    root_dir = filedialog.askdirectory(title="Select folder to watch for new Bruker experiments")
+    if not root_dir:
+        return
+
+    # Spectra already loaded from this folder are not reloaded
+    if root_dir not in globals.selected_pdata_dirs:
+        globals.selected_pdata_dirs.append(root_dir)
+
+    globals.watch_directory = root_dir
+    globals.watch_session += 1
+    watch_button.config(text="⏹️ Stop watching")
+    watch_status_label.config(text=f"Watching: {os.path.basename(root_dir)}", foreground="#2E8B57")
+
+    known_dirs = set(s[3] for s in globals.spectra)
+    pending_sizes = {}
+    poll_watch_directory(tab, globals.watch_session, root_dir, known_dirs, pending_sizes,
+                         watch_status_label, status_label)
+
+def poll_watch_directory(tab, session, root_dir, known_dirs, pending_sizes, watch_status_label, status_label):
+    """Load experiments that finished since the last poll, then reschedule."""
+    # A chain from an earlier start (even of the same folder) ends here
+    if session != globals.watch_session:
+        return
+
+    try:
+        new_dirs = file_io.find_new_pdata_directories(root_dir, known_dirs, pending_sizes)
+        if new_dirs:
+            new_spectra = file_io.load_spectra_from_pdata_dirs(new_dirs)
+            known_dirs.update(new_dirs)
+            if new_spectra:
+                globals.add_spectra(new_spectra)
+                process_new_spectra(new_spectra)
+                status_label.config(text=f"Loaded {len(globals.spectra)} spectra "
+                                         f"(+{len(new_spectra)} new)")
+        watch_status_label.config(
+            text=f"Watching: {os.path.basename(root_dir)} — {len(known_dirs)} experiments, "
+                 f"{len(pending_sizes)} in progress")
+    except Exception as e:
+        print(f"Error while watching {root_dir}: {e}")
+
+    tab.after(globals.watch_interval_ms, poll_watch_directory, tab, session, root_dir, known_dirs,
+              pending_sizes, watch_status_label, status_label)
+
+def process_new_spectra(new_spectra):
+    """Run integration and concentration for newly arrived spectra and append the rows."""
+    if globals.peak_limits.empty:
+        return
+
+    new_integrals = integration_analysis.integrate_spectra(new_spectra)
+    if new_integrals:
+        globals.integration_results.extend(new_integrals)
+        globals.trigger_event('integration_results_added', new_integrals)
+
+    if globals.tsp_concentration != 0:
+        new_concentrations, _ = concentration_analysis.calculate_concentrations_for_spectra(
+            new_spectra, globals.tsp_concentration)
+        if new_concentrations:
+            globals.concentration_results.extend(new_concentrations)
+            globals.trigger_event('concentration_results_added', new_concentrations)
+
+def run_alignment(max_shift_entry, alignment_label):
+    """Align all loaded spectra to their mean (TSP window globally, peak regions locally)."""
+    if not globals.spectra:
+        messagebox.showerror("Error", "No spectra loaded.")
+        return
+
+    try:
+        max_shift = float(max_shift_entry.get())
+    except ValueError:
+        messagebox.showerror("Error", "Invalid maximum shift.")
+        return
+
+    reference_region = None
+    segments = None
+    if not globals.peak_limits.empty:
+        reference_region = (globals.peak_limits.at[0, "ppm start"], globals.peak_limits.at[0, "ppm end"])
+        segments = list(zip(globals.peak_limits["ppm start"].iloc[1:], globals.peak_limits["ppm end"].iloc[1:]))
+
+    try:
+        segment_bounds, offsets, state = alignment_analysis.align_spectra(
+            globals.spectra, max_shift, reference_region, segments)
+    except Exception as e:
+        messagebox.showerror("Error", f"Alignment failed: {str(e)}")
+        return
+
+    alignment_analysis.set_alignment(segment_bounds, offsets, state)
+    global_shifts = [abs(g) for g, _ in offsets.values()]
+    alignment_label.config(
+        text=f"Aligned {len(offsets)} spectra over {len(segment_bounds)} segments "
+             f"(max global shift {max(global_shifts):.4f} ppm)",
+        foreground="#2E8B57")
+
+def reset_alignment(alignment_label):
+    """Discard alignment shifts."""
+    alignment_analysis.clear_alignment()
+    alignment_label.config(text="Spectra not aligned", foreground="#CCCCCC")
+
+def run_baseline_correction(baseline_method_combo, baseline_lambda_entry, baseline_label, status_label):
+    """Baseline-correct every loaded spectrum and cache the result."""
+    if not globals.spectra:
+        messagebox.showerror("Error", "No spectra loaded.")
+        return
+
+    try:
+        lam = float(baseline_lambda_entry.get())
+    except ValueError:
+        messagebox.showerror("Error", "Invalid smoothness value.")
+        return
+    method = baseline_method_combo.get()
+
+    status_label.config(text="Correcting baselines...")
+    status_label.update()
+
+    try:
+        corrected = baseline_analysis.correct_spectra(globals.spectra, method, lam)
+    except Exception as e:
+        messagebox.showerror("Error", f"Baseline correction failed: {str(e)}")
+        status_label.config(text="Baseline correction failed")
+        return
+
+    baseline_analysis.set_corrected(corrected, method, lam)
+    baseline_label.config(text=f"{method} baseline removed from {len(corrected)} spectra (λ={lam:g})",
+                          foreground="#2E8B57")
+    status_label.config(text=f"Loaded {len(globals.spectra)} spectra")
+
+def reset_baseline_correction(baseline_label):
+    """Discard cached baseline-corrected spectra."""
+    baseline_analysis.clear_corrected()
+    baseline_label.config(text="Baselines not corrected", foreground="#CCCCCC")
+
+def reset_preprocessing_labels(alignment_label, baseline_label):
+    """Show the alignment and baseline labels as not applied."""
+    alignment_label.config(text="Spectra not aligned", foreground="#CCCCCC")
+    baseline_label.config(text="Baselines not corrected", foreground="#CCCCCC")
+
+def show_float32_accuracy():
+    """Report how far float32 integrals deviate from the float64 path."""
+    if not globals.spectra or globals.peak_limits.empty:
+        messagebox.showerror("Error", "Load peak limits and a dataset first.")
+        return
+
+    result = integration_analysis.check_float32_accuracy(globals.spectra)
+    messagebox.showinfo("Float32 accuracy",
+                        f"Integrals compared: {result['Integrals Compared']}\n"
+                        f"Max relative error: {result['Max Relative Error']:.2e}\n"
+                        f"Median relative error: {result['Median Relative Error']:.2e}\n\n"
+                        "Errors are relative to the summed absolute intensity of each window.")
+
+def show_region_read_accuracy():
+    """Report how far region-only integrals deviate from the full nmrglue read."""
+    if not globals.spectra or globals.peak_limits.empty:
+        messagebox.showerror("Error", "Load peak limits and a dataset first.")
+        return
+
+    try:
+        result = integration_analysis.check_region_reads([s[3] for s in globals.spectra])
+    except Exception as e:
+        messagebox.showerror("Error", f"Region read check failed: {str(e)}")
+        return
+    messagebox.showinfo("Region-only loading",
+                        f"Integrals compared: {result['Integrals Compared']}\n"
+                        f"Max relative error: {result['Max Relative Error']:.2e}\n"
+                        f"Median relative error: {result['Median Relative Error']:.2e}\n\n"
+                        "Errors are relative to the summed absolute intensity of each window.")
+
+def run_normalization(normalization_combo, region_start_entry, region_end_entry, normalization_label, status_label):
+    """Compute and cache normalization factors for all loaded spectra."""
+    if not globals.spectra:
+        messagebox.showerror("Error", "No spectra loaded.")
+        return
+
+    method = normalization_combo.get()
+    region = None
+    if method == "Reference Region":
+        try:
+            region = (float(region_start_entry.get()), float(region_end_entry.get()))
+        except ValueError:
+            messagebox.showerror("Error", "Invalid reference region.")
+            return
+
+    status_label.config(text="Normalizing spectra...")
+    status_label.update()
+    try:
+        normalization_analysis.normalize_spectra(globals.spectra, method, region)
+    except Exception as e:
+        messagebox.showerror("Error", f"Normalization failed: {str(e)}")
+        status_label.config(text="Normalization failed")
+        return
+
+    update_normalization_label(normalization_label)
+    status_label.config(text=f"Loaded {len(globals.spectra)} spectra")
+
+def reset_normalization(normalization_label):
+    """Discard normalization factors."""
+    normalization_analysis.clear_normalization()
+    update_normalization_label(normalization_label)
+
+def update_normalization_label(normalization_label):
+    """Show the current normalization method and factor range."""
+    settings = globals.normalization_settings
+    if settings is None or not globals.normalization_factors:
+        normalization_label.config(text="Spectra not normalized", foreground="#CCCCCC")
+        return
+    factors = list(globals.normalization_factors.values())
+    normalization_label.config(
+        text=f"{settings['method']} normalization of {len(factors)} spectra "
+             f"(factors {min(factors):.3g}–{max(factors):.3g})",
+        foreground="#2E8B57")
@@ -1,3 +1,4 @@
+import os
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import matplotlib.pyplot as plt
@@ -5,13 +6,21 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolb
 import numpy as np
 import pandas as pd
 import analysis.deconvolution as deconvolution_analysis
+import analysis.deconvolution_cache as deconvolution_cache
+import analysis.alignment as alignment_analysis
+import analysis.baseline as baseline_analysis
 import globals
+import memory_budget
 import gui
 
-def create_deconvolution_tab(tab_control):
-    """Create the spectral deconvolution tab."""
-    tab = gui.create_themed_frame(tab_control)
-    tab_control.add(tab, text="📊 Spectral Deconvolution")
+# On-disk tier of the fit cache when "Keep fits across restarts" is ticked
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".peaknmr", "deconvolution_cache")
+
+def create_deconvolution_tab(tab_control, tab=None):
+    """Create the spectral deconvolution tab, or fill in tab if it was already added."""
+    if tab is None:
+        tab = gui.create_themed_frame(tab_control)
+        tab_control.add(tab, text="📊 Spectral Deconvolution")
     
     deconv_frame = gui.create_themed_frame(tab)
     deconv_frame.pack(fill='both', expand=True, padx=20, pady=20)
@@ -53,25 +62,55 @@ def create_deconvolution_tab(tab_control):
     deconv_peaks_entry.grid(row=2, column=1, sticky='w', pady=2, padx=(5, 0))
     deconv_peaks_entry.insert(0, "3")
 
+    # Lineshape model: free Lorentzians or multiplets with shared width and J coupling
+    gui.create_themed_label(deconv_params_frame, text="Lineshape model:").grid(row=3, column=0, sticky='w', pady=2)
+    model_var = tk.StringVar(value=deconvolution_analysis.FREE_MODEL)
+    model_combo = ttk.Combobox(deconv_params_frame, textvariable=model_var, state='readonly', width=18,
+                               values=deconvolution_analysis.LINESHAPE_MODELS)
+    model_combo.grid(row=3, column=1, sticky='w', pady=2, padx=(5, 0))
+
     # Max iterations
-    gui.create_themed_label(deconv_params_frame, text="Max iterations:").grid(row=3, column=0, sticky='w', pady=2)
+    gui.create_themed_label(deconv_params_frame, text="Max iterations:").grid(row=4, column=0, sticky='w', pady=2)
     deconv_iterations_entry = ttk.Entry(deconv_params_frame, width=10)
-    deconv_iterations_entry.grid(row=3, column=1, sticky='w', pady=2, padx=(5, 0))
+    deconv_iterations_entry.grid(row=4, column=1, sticky='w', pady=2, padx=(5, 0))
     deconv_iterations_entry.insert(0, "2000")
 
     # Baseline window size
-    gui.create_themed_label(deconv_params_frame, text="Baseline window:").grid(row=4, column=0, sticky='w', pady=2)
+    gui.create_themed_label(deconv_params_frame, text="Baseline window:").grid(row=5, column=0, sticky='w', pady=2)
     baseline_window_entry = ttk.Entry(deconv_params_frame, width=10)
-    baseline_window_entry.grid(row=4, column=1, sticky='w', pady=2, padx=(5, 0))
+    baseline_window_entry.grid(row=5, column=1, sticky='w', pady=2, padx=(5, 0))
     baseline_window_entry.insert(0, "51")
-    #gui.create_themed_label(deconv_params_frame, text="(odd number)").grid(row=4, column=2, sticky='w', pady=2, padx=(5, 0))
+    #gui.create_themed_label(deconv_params_frame, text="(odd number)").grid(row=5, column=2, sticky='w', pady=2, padx=(5, 0))
 
-    # Auto-detect button
+    # Auto-detect button: peak prominence, or fits of 1..K peaks ranked by AIC/BIC
+    detect_method_var = tk.StringVar(value="Prominence")
     auto_detect_btn = gui.create_themed_button(deconv_params_frame, text="🔍 Auto-detect Peaks", 
                                 command=lambda: auto_detect_peak_count(deconvolution_spectra_listbox, 
                                                                       deconv_start_entry, deconv_end_entry, 
-                                                                      deconv_peaks_entry))
-    auto_detect_btn.grid(row=5, column=0, columnspan=2, sticky='w', pady=(10, 5))
+                                                                      deconv_peaks_entry, detect_method_var,
+                                                                      deconv_iterations_entry,
+                                                                      baseline_window_entry, model_var))
+    auto_detect_btn.grid(row=6, column=0, sticky='w', pady=(10, 5))
+    detect_method_combo = ttk.Combobox(deconv_params_frame, textvariable=detect_method_var, state='readonly',
+                                       width=12, values=("Prominence",) + deconvolution_analysis.ORDER_CRITERIA)
+    detect_method_combo.grid(row=6, column=1, sticky='w', pady=(10, 5), padx=(5, 0))
+
+    # Fit cache: repeated fits of the same region are returned from memory
+    persist_cache_var = tk.BooleanVar(value=bool(globals.deconvolution_cache_dir))
+    persist_cache_check = ttk.Checkbutton(deconv_params_frame, text="Keep fits across restarts",
+                                          variable=persist_cache_var,
+                                          command=lambda: toggle_persistent_cache(persist_cache_var))
+    persist_cache_check.grid(row=7, column=0, columnspan=2, sticky='w', pady=(5, 0))
+
+    clear_cache_btn = gui.create_themed_button(deconv_params_frame, text="🗑️ Clear Fit Cache",
+                                               command=clear_fit_cache)
+    clear_cache_btn.grid(row=8, column=0, columnspan=2, sticky='w', pady=(5, 0))
+
+    # Whole-spectrum mode: signals above this many noise levels are segmented into clusters
+    gui.create_themed_label(deconv_params_frame, text="Segment threshold (σ):").grid(row=9, column=0, sticky='w', pady=(10, 2))
+    segment_threshold_entry = ttk.Entry(deconv_params_frame, width=10)
+    segment_threshold_entry.grid(row=9, column=1, sticky='w', pady=(10, 2), padx=(5, 0))
+    segment_threshold_entry.insert(0, str(deconvolution_analysis.SEGMENT_THRESHOLD_SIGMA))
 
     # Control buttons
     deconv_control_frame = gui.create_themed_frame(deconv_left_panel)
@@ -81,9 +120,15 @@ def create_deconvolution_tab(tab_control):
                            command=lambda: perform_spectral_deconvolution(
                                deconvolution_spectra_listbox, deconv_start_entry, deconv_end_entry,
                                deconv_peaks_entry, deconv_iterations_entry, baseline_window_entry,
-                               deconvolution_table, deconv_fig, deconv_canvas))
+                               model_var, deconvolution_table, deconv_fig, deconv_canvas))
     deconv_btn.pack(side='left', padx=(0, 10))
 
+    full_deconv_btn = gui.create_themed_button(deconv_control_frame, text="🧩 Whole Spectrum",
+                           command=lambda: perform_whole_spectrum_deconvolution(
+                               deconvolution_spectra_listbox, deconv_iterations_entry, baseline_window_entry,
+                               segment_threshold_entry, deconvolution_table, deconv_fig, deconv_canvas))
+    full_deconv_btn.pack(side='left', padx=(0, 10))
+
     export_deconv_btn = gui.create_themed_button(deconv_control_frame, text="💾 Export Results", 
                                   command=export_deconvolution_results)
     export_deconv_btn.pack(side='left')
@@ -94,16 +139,18 @@ def create_deconvolution_tab(tab_control):
 
     # Create results table with additional columns
     deconvolution_table = ttk.Treeview(deconv_results_frame, 
-                                      columns=("Peak", "Center_PPM", "Amplitude", "Width", "Integral", "Integration_Range"), 
+                                      columns=("Peak", "Center_PPM", "Metabolite", "Amplitude", "Width", "Integral", "Integration_Range"), 
                                       show="headings", height=10)
     deconvolution_table.heading("Peak", text="Peak")
     deconvolution_table.heading("Center_PPM", text="Center (ppm)")
+    deconvolution_table.heading("Metabolite", text="Metabolite")
     deconvolution_table.heading("Amplitude", text="Amplitude")
     #deconvolution_table.heading("Width", text="FWHM") #  Cool but not typically useful for a user
     deconvolution_table.heading("Integral", text="Integral")
     deconvolution_table.heading("Integration_Range", text="Integration Range")
     deconvolution_table.column("Peak", width=80)
     deconvolution_table.column("Center_PPM", width=100)
+    deconvolution_table.column("Metabolite", width=100)
     #deconvolution_table.column("Amplitude", width=100) # Same thing here, not very useful for the user
     deconvolution_table.column("Width", width=80)
     deconvolution_table.column("Integral", width=120)
@@ -148,6 +195,8 @@ Instructions:
 
 Tips for better results:
 • Use 'Auto-detect Peaks' for initial guess
+• 'Whole Spectrum' splits the spectrum at baseline gaps and fits every cluster
+• Pick a multiplet lineshape (d, t, dd, q) to fit coupled lines with one width and J
 • Ensure region boundaries properly contain peaks
 • Shaded areas show what is being integrated
 • Green numbers show calculated integrals"""
@@ -156,7 +205,11 @@ Tips for better results:
     
     # Register for spectra updates
     globals.add_event_listener('spectra_updated', 
-                              lambda spectra: update_deconvolution_spectra_list(deconvolution_spectra_listbox))
+                              lambda spectra: update_deconvolution_spectra_list(deconvolution_spectra_listbox),
+                              key='update_deconvolution_spectra_list')
+    
+    # A tab built after loading starts with the current spectra
+    update_deconvolution_spectra_list(deconvolution_spectra_listbox)
     
     return tab, deconvolution_spectra_listbox
 
@@ -177,6 +230,8 @@ def on_deconvolution_spectrum_select(event, deconv_fig, deconv_canvas):
         index = selection[0]
         if index < len(globals.spectra):
             ppm_scale, data, sample_name, pdata_dir = globals.spectra[index]
+            data = baseline_analysis.corrected_data(pdata_dir, data)
+            data = alignment_analysis.aligned_data(ppm_scale, data, pdata_dir)
             plot_deconvolution_spectrum(ppm_scale, data, sample_name, deconv_fig, deconv_canvas)
 
 def plot_deconvolution_spectrum(ppm_scale, data, sample_name, deconv_fig, deconv_canvas):
@@ -196,8 +251,14 @@ def plot_deconvolution_spectrum(ppm_scale, data, sample_name, deconv_fig, deconv
     ax.legend()
     deconv_canvas.draw()
 
-def auto_detect_peak_count(deconvolution_spectra_listbox, deconv_start_entry, deconv_end_entry, deconv_peaks_entry):
-    """Auto-detect optimal number of peaks in selected region."""
+def auto_detect_peak_count(deconvolution_spectra_listbox, deconv_start_entry, deconv_end_entry, deconv_peaks_entry,
+                           detect_method_var, deconv_iterations_entry, baseline_window_entry, model_var):
+    """
+    Auto-detect optimal number of peaks in selected region.
+
+    "Prominence" counts prominent maxima; "AIC"/"BIC" fit 1..K peaks in
+    parallel and keep the count with the lowest information criterion.
+    """
     selection = deconvolution_spectra_listbox.curselection()
     if not selection:
         messagebox.showinfo("Info", "Please select a spectrum first.")
@@ -216,6 +277,9 @@ def auto_detect_peak_count(deconvolution_spectra_listbox, deconv_start_entry, de
         return
         
     ppm_scale, data, sample_name, pdata_dir = globals.spectra[index]
+    memory_budget.touch(pdata_dir)
+    data = baseline_analysis.corrected_data(pdata_dir, data)
+    data = alignment_analysis.aligned_data(ppm_scale, data, pdata_dir)
     
     # Extract region
     start_idx = np.abs(ppm_scale - start_ppm).argmin()
@@ -226,6 +290,35 @@ def auto_detect_peak_count(deconvolution_spectra_listbox, deconv_start_entry, de
     x_data = ppm_scale[start_idx:end_idx+1]
     y_data = data[start_idx:end_idx+1]
     
+    method = detect_method_var.get()
+    if method in deconvolution_analysis.ORDER_CRITERIA:
+        try:
+            max_iterations = int(deconv_iterations_entry.get())
+            baseline_window = int(baseline_window_entry.get())
+        except ValueError:
+            messagebox.showerror("Error", "Please enter valid numeric parameters.")
+            return
+        try:
+            region_start, region_end, x_data, y_data = deconvolution_analysis.extract_region(
+                ppm_scale, data, start_ppm, end_ppm, 1)
+        except ValueError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        
+        optimal_peaks, rows = deconvolution_analysis.select_peak_count(
+            x_data, y_data, region_start, region_end, max_iterations,
+            baseline_analysis.is_corrected(pdata_dir), baseline_window, model_var.get(), method)
+        if optimal_peaks is None:
+            messagebox.showerror("Error", "None of the candidate peak counts could be fitted.")
+            return
+        
+        scores = "\n".join(f"{row['Peaks']:>3} peaks: {method} {row[method]:.1f}" if row[method] is not None
+                           else f"{row['Peaks']:>3} peaks: fit failed" for row in rows)
+        deconv_peaks_entry.delete(0, tk.END)
+        deconv_peaks_entry.insert(0, str(optimal_peaks))
+        messagebox.showinfo("Auto-detection", f"Suggested number of peaks ({method}): {optimal_peaks}\n\n{scores}")
+        return
+    
     optimal_peaks = deconvolution_analysis.find_optimal_peak_count(x_data, y_data)
     
     # Update the peaks entry
@@ -236,8 +329,12 @@ def auto_detect_peak_count(deconvolution_spectra_listbox, deconv_start_entry, de
 
 def perform_spectral_deconvolution(deconvolution_spectra_listbox, deconv_start_entry, deconv_end_entry,
                                   deconv_peaks_entry, deconv_iterations_entry, baseline_window_entry,
-                                  deconvolution_table, deconv_fig, deconv_canvas):
-    """Perform spectral deconvolution on selected region."""
+                                  model_var, deconvolution_table, deconv_fig, deconv_canvas):
+    """
+    Perform spectral deconvolution on selected region.
+
+    With a multiplet lineshape model the number of peaks is the number of multiplets.
+    """
     selection = deconvolution_spectra_listbox.curselection()
     if not selection:
         messagebox.showinfo("Info", "Please select a spectrum first.")
@@ -260,17 +357,71 @@ def perform_spectral_deconvolution(deconvolution_spectra_listbox, deconv_start_e
         return
         
     ppm_scale, data, sample_name, pdata_dir = globals.spectra[index]
+    memory_budget.touch(pdata_dir)
+    data = baseline_analysis.corrected_data(pdata_dir, data)
+    data = alignment_analysis.aligned_data(ppm_scale, data, pdata_dir)
     
     # Perform deconvolution
     success = deconvolution_analysis.perform_deconvolution(
         ppm_scale, data, sample_name, start_ppm, end_ppm, num_peaks, max_iterations,
-        deconv_fig, deconv_canvas)
+        deconv_fig, deconv_canvas, baseline_analysis.is_corrected(pdata_dir), baseline_window,
+        model_var.get())
     
     if success:
         display_deconvolution_results(deconvolution_table)
         valid_peaks = len(globals.deconvolution_results)
         messagebox.showinfo("Success", f"Deconvolution completed! Found {valid_peaks} valid peaks.\n\nIntegration areas are shown as shaded regions on the plot.")
 
+def perform_whole_spectrum_deconvolution(deconvolution_spectra_listbox, deconv_iterations_entry,
+                                         baseline_window_entry, segment_threshold_entry,
+                                         deconvolution_table, deconv_fig, deconv_canvas):
+    """Segment the selected spectrum into clusters and deconvolve all of them."""
+    selection = deconvolution_spectra_listbox.curselection()
+    if not selection:
+        messagebox.showinfo("Info", "Please select a spectrum first.")
+        return
+    
+    try:
+        max_iterations = int(deconv_iterations_entry.get())
+        baseline_window = int(baseline_window_entry.get())
+        threshold_sigma = float(segment_threshold_entry.get())
+    except ValueError:
+        messagebox.showerror("Error", "Please enter valid numeric parameters.")
+        return
+    
+    index = selection[0]
+    if index >= len(globals.spectra):
+        return
+        
+    ppm_scale, data, sample_name, pdata_dir = globals.spectra[index]
+    memory_budget.touch(pdata_dir)
+    data = baseline_analysis.corrected_data(pdata_dir, data)
+    data = alignment_analysis.aligned_data(ppm_scale, data, pdata_dir)
+    
+    summary = deconvolution_analysis.perform_full_deconvolution(
+        ppm_scale, data, sample_name, max_iterations, deconv_fig, deconv_canvas,
+        baseline_analysis.is_corrected(pdata_dir), baseline_window, threshold_sigma)
+    
+    if summary:
+        display_deconvolution_results(deconvolution_table)
+        failed = f"\n{summary['failed']} clusters could not be fitted (see console)." if summary['failed'] else ""
+        messagebox.showinfo("Success", f"Whole-spectrum deconvolution completed! Found {summary['peaks']} peaks "
+                                       f"in {summary['clusters']} clusters.{failed}")
+
+def toggle_persistent_cache(persist_cache_var):
+    """Enable or disable the on-disk tier of the deconvolution fit cache."""
+    if persist_cache_var.get():
+        globals.deconvolution_cache_dir = DEFAULT_CACHE_DIR
+    else:
+        globals.deconvolution_cache_dir = None
+
+def clear_fit_cache():
+    """Drop all memoized deconvolution fits, including those kept on disk."""
+    stats = deconvolution_cache.stats()
+    deconvolution_cache.clear(include_disk=True)
+    messagebox.showinfo("Fit Cache", f"Cleared {stats['entries']} cached fits "
+                                     f"({stats['bytes'] / 1024**2:.1f} MB in memory).")
+
 def display_deconvolution_results(deconvolution_table):
     """Display deconvolution results in the table."""
     # Clear the table
@@ -280,9 +431,11 @@ def display_deconvolution_results(deconvolution_table):
     # Populate with results
     for result in globals.deconvolution_results:
         integration_range = f"{result.get('Integration_Start_PPM', 0):.3f}-{result.get('Integration_End_PPM', 0):.3f}"
+        peak_label = f"{result['Peak']} ({result['Multiplicity']})" if "Multiplicity" in result else result["Peak"]
         deconvolution_table.insert("", "end", values=(
-            result["Peak"],
+            peak_label,
             f"{result['Center_PPM']:.4f}",
+            result.get("Metabolite", ""),
             f"{result['Amplitude']:.2e}",
             f"{result['Width']:.4f}",
             f"{result['Integral']:.2e}",
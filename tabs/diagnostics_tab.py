@@ -0,0 +1,166 @@
+import tkinter as tk
+from tkinter import ttk, messagebox, filedialog
+import pandas as pd
+import diagnostics
+import profiler
+import memory_budget
+import globals
+import gui
+
+SUMMARY_COLUMNS = ("Stage", "Runs", "Total Wall (s)", "Mean Wall (s)", "Best Spectra/s", "Max Peak Memory (MB)")
+RUN_COLUMNS = ("Started", "Stage", "Spectra", "Wall (s)", "CPU (s)", "Spectra/s", "Peak Memory (MB)")
+LISTENER_COLUMNS = ("Event", "Listener", "Calls", "Total (s)", "Max (s)")
+
+# Most recent runs shown in the table (all runs are kept for export and the report)
+MAX_RUNS_SHOWN = 200
+
+def create_diagnostics_tab(tab_control, tab=None):
+    """Create the diagnostics tab, or fill in tab if it was already added."""
+    if tab is None:
+        tab = gui.create_themed_frame(tab_control)
+        tab_control.add(tab, text="🩺 Diagnostics")
+
+    diag_frame = gui.create_themed_frame(tab)
+    diag_frame.pack(fill='both', expand=True, padx=20, pady=20)
+
+    # Control section
+    control_frame = gui.create_themed_labelframe(diag_frame, text="Diagnostics Controls", padding=15)
+    control_frame.pack(fill='x', pady=(0, 15))
+
+    refresh_btn = gui.create_themed_button(control_frame, text="🔄 Refresh",
+                                           command=lambda: refresh_diagnostics(tables))
+    refresh_btn.grid(row=0, column=0, sticky='w', padx=(0, 10))
+
+    clear_btn = gui.create_themed_button(control_frame, text="🗑️ Clear Records",
+                                         command=diagnostics.clear_records)
+    clear_btn.grid(row=0, column=1, sticky='w', padx=(0, 10))
+
+    export_btn = gui.create_themed_button(control_frame, text="💾 Export to Excel",
+                                          command=export_diagnostics)
+    export_btn.grid(row=0, column=2, sticky='w', padx=(0, 10))
+
+    trace_memory_var = tk.BooleanVar(value=globals.trace_memory)
+    trace_memory_check = ttk.Checkbutton(control_frame, text="Track peak memory (tracemalloc, slower)",
+                                         variable=trace_memory_var,
+                                         command=lambda: setattr(globals, 'trace_memory', trace_memory_var.get()))
+    trace_memory_check.grid(row=0, column=3, sticky='w')
+
+    # Profile the next button click or selection in any tab (cProfile + stack sampling)
+    profile_var = tk.BooleanVar(value=profiler.is_armed())
+    profile_check = ttk.Checkbutton(control_frame, text="⏺ Profile next action",
+                                    variable=profile_var,
+                                    command=profiler.profiler_control(lambda: toggle_profiling(profile_var)))
+    profile_check.grid(row=1, column=0, columnspan=4, sticky='w', pady=(10, 0))
+
+    # Memory budget (blank = half of physical memory)
+    budget_frame = gui.create_themed_frame(control_frame)
+    budget_frame.grid(row=2, column=0, columnspan=4, sticky='w', pady=(10, 0))
+    gui.create_themed_label(budget_frame, text="Memory budget (MB, blank = automatic):").pack(side='left', padx=(0, 5))
+    budget_entry = ttk.Entry(budget_frame, width=10)
+    if globals.memory_budget_mb:
+        budget_entry.insert(0, str(globals.memory_budget_mb))
+    budget_entry.pack(side='left', padx=(0, 10))
+    apply_btn = gui.create_themed_button(budget_frame, text="Apply Budget",
+                                         command=lambda: apply_memory_budget(budget_entry, tables))
+    apply_btn.pack(side='left')
+
+    # Tables
+    tables = {
+        "summary": create_table(diag_frame, "Stage Summary", SUMMARY_COLUMNS, height=8),
+        "runs": create_table(diag_frame, "Recent Runs", RUN_COLUMNS, height=10),
+        "listeners": create_table(diag_frame, "Event Listener Timings", LISTENER_COLUMNS, height=6),
+        "memory": create_table(diag_frame, "Memory Usage", memory_budget.USAGE_COLUMNS, height=8),
+    }
+
+    # Refresh whenever a stage finishes or spectra are evicted to memory maps
+    for event_name in ('performance_recorded', 'memory_updated', 'spectra_updated'):
+        globals.add_event_listener(event_name, lambda *args: refresh_diagnostics(tables),
+                                   key='refresh_diagnostics')
+
+    refresh_diagnostics(tables)
+
+    return tab
+
+def toggle_profiling(profile_var):
+    """Arm or disarm profiling of the next GUI action."""
+    if profile_var.get():
+        profiler.arm(on_finished=lambda: profile_var.set(False))
+    else:
+        profiler.disarm()
+
+def apply_memory_budget(budget_entry, tables):
+    """Set the memory budget from the entry and evict cold spectra if it is exceeded."""
+    value = budget_entry.get().strip()
+    try:
+        budget = float(value) if value else None
+    except ValueError:
+        messagebox.showerror("Error", "Memory budget must be a number of MB.")
+        return
+    if budget is not None and budget <= 0:
+        messagebox.showerror("Error", "Memory budget must be positive.")
+        return
+
+    globals.memory_budget_mb = budget
+    memory_budget.enforce_budget()
+    refresh_diagnostics(tables)
+
+def create_table(parent, title, columns, height):
+    """Create a labelled Treeview with a vertical scrollbar."""
+    table_frame = gui.create_themed_labelframe(parent, text=title, padding=15)
+    table_frame.pack(fill='both', expand=True, pady=(0, 15))
+    table_frame.grid_rowconfigure(0, weight=1)
+    table_frame.grid_columnconfigure(0, weight=1)
+
+    table = ttk.Treeview(table_frame, columns=columns, show="headings", height=height)
+    for column in columns:
+        table.heading(column, text=column)
+        table.column(column, width=120)
+
+    scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=table.yview)
+    table.configure(yscrollcommand=scrollbar.set)
+    table.grid(row=0, column=0, sticky="nsew")
+    scrollbar.grid(row=0, column=1, sticky="ns")
+    return table
+
+def format_value(value):
+    """Format a record value for display."""
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.3f}" if value < 1000 else f"{value:.0f}"
+    return value
+
+def fill_table(table, columns, rows):
+    """Replace the contents of a table with the given rows."""
+    for row in table.get_children():
+        table.delete(row)
+    for row in rows:
+        table.insert("", "end", values=[format_value(row.get(column)) for column in columns])
+
+def refresh_diagnostics(tables):
+    """Redraw the stage summary, recent runs, listener timings and memory usage."""
+    fill_table(tables["summary"], SUMMARY_COLUMNS, diagnostics.summarize_records())
+    recent = globals.performance_records[-MAX_RUNS_SHOWN:][::-1]
+    fill_table(tables["runs"], RUN_COLUMNS, recent)
+    fill_table(tables["listeners"], LISTENER_COLUMNS, globals.get_listener_timings())
+    fill_table(tables["memory"], memory_budget.USAGE_COLUMNS, memory_budget.usage_table())
+
+def export_diagnostics():
+    """Export performance records and listener timings to Excel."""
+    if not globals.performance_records:
+        messagebox.showerror("Error", "No performance records to export.")
+        return
+
+    filename = filedialog.asksaveasfilename(
+        defaultextension=".xlsx",
+        filetypes=[("Excel files", "*.xlsx")],
+        title="Save diagnostics as"
+    )
+
+    if filename:
+        with pd.ExcelWriter(filename) as writer:
+            pd.DataFrame(diagnostics.summarize_records()).to_excel(writer, sheet_name="Stage Summary", index=False)
+            pd.DataFrame(globals.performance_records).to_excel(writer, sheet_name="Runs", index=False)
+            pd.DataFrame(globals.get_listener_timings()).to_excel(writer, sheet_name="Event Listeners", index=False)
+            pd.DataFrame(memory_budget.usage_table()).to_excel(writer, sheet_name="Memory", index=False)
+        messagebox.showinfo("Success", f"Diagnostics saved to {filename}")
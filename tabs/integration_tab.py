@@ -5,10 +5,11 @@ import analysis.integration as integration_analysis
 import globals
 import gui
 
-def create_integration_tab(tab_control):
-    """Create the integration analysis tab."""
-    tab = gui.create_themed_frame(tab_control)
-    tab_control.add(tab, text="📉 Integrations")
+def create_integration_tab(tab_control, tab=None):
+    """Create the integration analysis tab, or fill in tab if it was already added."""
+    if tab is None:
+        tab = gui.create_themed_frame(tab_control)
+        tab_control.add(tab, text="📉 Integrations")
     
     int_frame = gui.create_themed_frame(tab)
     int_frame.pack(fill='both', expand=True, padx=20, pady=20)
@@ -70,6 +71,15 @@ Results can be exported to Excel for further analysis."""
     
     gui.create_themed_label(int_desc_frame, text=description_text, justify='left').pack(anchor='w')
     
+    # Append rows when watch mode integrates new samples
+    globals.add_event_listener('integration_results_added',
+                              lambda new_results: append_integration_results(integration_table, new_results),
+                              key='append_integration_results')
+    
+    # A tab built after results exist (e.g. from watch mode) shows them
+    if globals.integration_results:
+        display_integration_results(integration_table)
+    
     return tab
 
 def process_integrations(integration_table):
@@ -103,6 +113,17 @@ def display_integration_results(integration_table):
             f"{result['Integral']:.6f}"
         ))
 
+def append_integration_results(integration_table, new_results):
+    """Append newly calculated integration rows without rebuilding the table."""
+    for result in new_results:
+        integration_table.insert("", "end", values=(
+            result["Sample"],
+            result["Peak"],
+            f"{result['Start (ppm)']:.3f}",
+            f"{result['End (ppm)']:.3f}",
+            f"{result['Integral']:.6f}"
+        ))
+
 def export_integrations():
     """Export integration results to Excel."""
     if not globals.integration_results:
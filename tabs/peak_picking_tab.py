@@ -5,13 +5,25 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolb
 import numpy as np
 import pandas as pd
 import analysis.peak_picking as peak_picking_analysis
+import analysis.alignment as alignment_analysis
+import analysis.baseline as baseline_analysis
+import analysis.peak_matching as peak_matching
+import analysis.interval_index as interval_index
+import analysis.pattern_matching as pattern_matching
+import file_io
 import globals
+import diagnostics
+import memory_budget
 import gui
 
-def create_peak_picking_tab(tab_control):
-    """Create the peak picking analysis tab."""
-    tab = gui.create_themed_frame(tab_control)
-    tab_control.add(tab, text="🔍 Peak Picking")
+# Rows per Excel sheet, including the header row
+EXCEL_MAX_ROWS = 1048576
+
+def create_peak_picking_tab(tab_control, tab=None):
+    """Create the peak picking analysis tab, or fill in tab if it was already added."""
+    if tab is None:
+        tab = gui.create_themed_frame(tab_control)
+        tab_control.add(tab, text="🔍 Peak Picking")
     
     peak_picking_frame = gui.create_themed_frame(tab)
     peak_picking_frame.pack(fill='both', expand=True, padx=20, pady=20)
@@ -60,6 +72,37 @@ def create_peak_picking_tab(tab_control):
     peak_baseline_entry.insert(0, "0.01")
     gui.create_themed_label(params_frame, text="(fraction of peak height)").grid(row=3, column=2, sticky='w', pady=2, padx=(5, 0))
 
+    # Cross-spectrum matching tolerance for "Detect All Spectra"
+    gui.create_themed_label(params_frame, text="Match tolerance:").grid(row=4, column=0, sticky='w', pady=2)
+    match_tolerance_entry = ttk.Entry(params_frame, width=10)
+    match_tolerance_entry.grid(row=4, column=1, sticky='w', pady=2, padx=(5, 0))
+    match_tolerance_entry.insert(0, str(globals.peak_match_tolerance))
+    gui.create_themed_label(params_frame, text="ppm (peaks matched across spectra)").grid(row=4, column=2, sticky='w', pady=2, padx=(5, 0))
+
+    # Metabolite identification from a multiplet pattern library
+    pattern_frame = gui.create_themed_labelframe(peak_left_panel, text="Pattern Library", padding=15)
+    pattern_frame.pack(fill='x', pady=(15, 0))
+
+    gui.create_themed_label(pattern_frame, text="Spectrometer:").grid(row=0, column=0, sticky='w', pady=2)
+    spectrometer_entry = ttk.Entry(pattern_frame, width=10)
+    spectrometer_entry.grid(row=0, column=1, sticky='w', pady=2, padx=(5, 0))
+    spectrometer_entry.insert(0, str(globals.spectrometer_mhz))
+    gui.create_themed_label(pattern_frame, text="MHz").grid(row=0, column=2, sticky='w', pady=2, padx=(5, 0))
+
+    pattern_label = gui.create_themed_label(pattern_frame, text=pattern_library_description())
+    pattern_label.grid(row=1, column=0, columnspan=3, sticky='w', pady=2)
+
+    pattern_control_frame = gui.create_themed_frame(pattern_frame)
+    pattern_control_frame.grid(row=2, column=0, columnspan=3, sticky='w', pady=(10, 0))
+
+    load_patterns_btn = gui.create_themed_button(pattern_control_frame, text="📖 Load Patterns",
+                                  command=lambda: load_pattern_library(pattern_label))
+    load_patterns_btn.pack(side='left', padx=(0, 10))
+
+    identify_btn = gui.create_themed_button(pattern_control_frame, text="🧬 Identify Metabolites",
+                             command=lambda: identify_metabolites(spectrometer_entry))
+    identify_btn.pack(side='left')
+
     # Underground peak removal parameters
     underground_frame = gui.create_themed_labelframe(peak_left_panel, text="Underground Peak Removal", padding=15)
     underground_frame.pack(fill='x', pady=(15, 0))
@@ -118,7 +161,7 @@ def create_peak_picking_tab(tab_control):
     detect_peaks_btn.pack(side='left', padx=(0, 10))
 
     detect_all_peaks_btn = gui.create_themed_button(peak_control_frame, text="🔍 Detect All Spectra", 
-                                     command=detect_peaks_all_spectra)
+                                     command=lambda: detect_peaks_all_spectra(match_tolerance_entry))
     detect_all_peaks_btn.pack(side='left')
 
     # Export buttons
@@ -139,16 +182,18 @@ def create_peak_picking_tab(tab_control):
     peak_results_frame.pack(fill='both', expand=True, pady=(15, 0))
 
     # Create results table with Integral and Width columns
-    peak_picking_table = ttk.Treeview(peak_results_frame, columns=("Sample", "Peak", "PPM", "Intensity", "Integral", "Width_PPM"), 
+    peak_picking_table = ttk.Treeview(peak_results_frame, columns=("Sample", "Peak", "Metabolite", "PPM", "Intensity", "Integral", "Width_PPM"), 
                                      show="headings", height=10)
     peak_picking_table.heading("Sample", text="Sample")
     peak_picking_table.heading("Peak", text="Peak")
+    peak_picking_table.heading("Metabolite", text="Metabolite")
     peak_picking_table.heading("PPM", text="PPM")
     peak_picking_table.heading("Intensity", text="Intensity")
     peak_picking_table.heading("Integral", text="Integral")
     peak_picking_table.heading("Width_PPM", text="Width (ppm)")
     peak_picking_table.column("Sample", width=100)
     peak_picking_table.column("Peak", width=80)
+    peak_picking_table.column("Metabolite", width=100)
     peak_picking_table.column("PPM", width=80)
     peak_picking_table.column("Intensity", width=100)
     peak_picking_table.column("Integral", width=100)
@@ -194,7 +239,11 @@ def create_peak_picking_tab(tab_control):
     
     # Register for spectra updates
     globals.add_event_listener('spectra_updated', 
-                              lambda spectra: update_peak_picking_spectra_list(peak_picking_spectra_listbox))
+                              lambda spectra: update_peak_picking_spectra_list(peak_picking_spectra_listbox),
+                              key='update_peak_picking_spectra_list')
+    
+    # A tab built after loading starts with the current spectra
+    update_peak_picking_spectra_list(peak_picking_spectra_listbox)
     
     return tab, peak_picking_spectra_listbox
 
@@ -219,6 +268,8 @@ def on_peak_picking_spectrum_select(event, peak_fig, peak_canvas):
         index = selection[0]
         if index < len(globals.spectra):
             ppm_scale, data, sample_name, pdata_dir = globals.spectra[index]
+            data = baseline_analysis.corrected_data(pdata_dir, data)
+            data = alignment_analysis.aligned_data(ppm_scale, data, pdata_dir)
             plot_peak_picking_spectrum(ppm_scale, data, sample_name, [], peak_fig, peak_canvas)
 
 def auto_detect_peaks(peak_picking_spectra_listbox, peak_height_entry, peak_distance_entry,
@@ -246,10 +297,16 @@ def auto_detect_peaks(peak_picking_spectra_listbox, peak_height_entry, peak_dist
         return
         
     ppm_scale, data, sample_name, pdata_dir = globals.spectra[index]
+    memory_budget.touch(pdata_dir)
+    data = baseline_analysis.corrected_data(pdata_dir, data)
+    data = alignment_analysis.aligned_data(ppm_scale, data, pdata_dir)
     
     # Detect peaks
-    globals.peak_picking_results = peak_picking_analysis.detect_peaks(
-        ppm_scale, data, sample_name, height, distance, prominence, baseline_threshold)
+    with diagnostics.track_stage("Peak Picking", 1):
+        globals.peak_picking_results = peak_picking_analysis.detect_peaks(
+            ppm_scale, data, sample_name, height, distance, prominence, baseline_threshold,
+            baseline_analysis.is_corrected(pdata_dir))
+        interval_index.annotate(globals.peak_picking_results)
     
     # Display results
     display_peak_picking_results(peak_picking_table)
@@ -258,8 +315,8 @@ def auto_detect_peaks(peak_picking_spectra_listbox, peak_height_entry, peak_dist
     peaks = [result["Index"] for result in globals.peak_picking_results]
     plot_peak_picking_spectrum(ppm_scale, data, sample_name, peaks, peak_fig, peak_canvas)
 
-def detect_peaks_all_spectra():
-    """Detect peaks in all spectra."""
+def detect_peaks_all_spectra(match_tolerance_entry):
+    """Detect peaks in all spectra and match them across spectra into features."""
     if not globals.spectra:
         messagebox.showinfo("Info", "No spectra loaded.")
         return
@@ -270,21 +327,32 @@ def detect_peaks_all_spectra():
         distance = 10
         prominence = 50000
         baseline_threshold = 0.01
+        match_tolerance = float(match_tolerance_entry.get())
+        if match_tolerance <= 0:
+            raise ValueError
     except ValueError:
-        messagebox.showerror("Error", "Invalid peak detection parameters.")
+        messagebox.showerror("Error", "Match tolerance must be a positive number of ppm.")
         return
     
     all_peak_picking_results = []
     
     # Process all spectra
-    for ppm_scale, data, sample_name, pdata_dir in globals.spectra:
-        # Detect peaks
-        peaks = peak_picking_analysis.detect_peaks(
-            ppm_scale, data, sample_name, height, distance, prominence, baseline_threshold)
-        all_peak_picking_results.extend(peaks)
-    
+    with diagnostics.track_stage("Peak Picking", len(globals.spectra)):
+        for ppm_scale, data, sample_name, pdata_dir in globals.spectra:
+            data = baseline_analysis.corrected_data(pdata_dir, data)
+            data = alignment_analysis.aligned_data(ppm_scale, data, pdata_dir)
+            # Detect peaks
+            peaks = peak_picking_analysis.detect_peaks(
+                ppm_scale, data, sample_name, height, distance, prominence, baseline_threshold,
+                baseline_analysis.is_corrected(pdata_dir))
+            all_peak_picking_results.extend(peaks)
+        interval_index.annotate(all_peak_picking_results)
+    
+    globals.peak_match_tolerance = match_tolerance
+    features = peak_matching.assign_features(all_peak_picking_results, match_tolerance)
     globals.all_peak_picking_results = all_peak_picking_results
-    messagebox.showinfo("Success", f"Detected {len(all_peak_picking_results)} peaks across {len(globals.spectra)} spectra.")
+    messagebox.showinfo("Success", f"Detected {len(all_peak_picking_results)} peaks across {len(globals.spectra)} spectra, "
+                                   f"matched into {len(features)} features.")
 
 def display_peak_picking_results(peak_picking_table):
     """Display peak picking results in the table."""
@@ -297,6 +365,7 @@ def display_peak_picking_results(peak_picking_table):
         peak_picking_table.insert("", "end", values=(
             result["Sample"],
             result["Peak"],
+            result.get("Metabolite", ""),
             f"{result['PPM']:.3f}",
             f"{result['Intensity']:.6f}",
             f"{result['Integral']:.6f}",
@@ -397,6 +466,8 @@ def remove_underground_peaks(underground_intensity_entry, underground_integral_e
         index = selection[0]
         if index < len(globals.spectra):
             ppm_scale, data, sample_name, pdata_dir = globals.spectra[index]
+            data = baseline_analysis.corrected_data(pdata_dir, data)
+            data = alignment_analysis.aligned_data(ppm_scale, data, pdata_dir)
             peak_indices = [peak["Index"] for peak in globals.peak_picking_results]
             plot_peak_picking_spectrum(ppm_scale, data, sample_name, peak_indices, peak_fig, peak_canvas)
     
@@ -433,7 +504,8 @@ def remove_underground_peaks_all_spectra(underground_intensity_entry, undergroun
         else:
             filtered_peaks.append(peak)
     
-    # Update global results
+    # Update global results; features are re-matched without the removed peaks
+    peak_matching.assign_features(filtered_peaks)
     globals.all_peak_picking_results = filtered_peaks
     
     removed_count = original_count - len(globals.all_peak_picking_results)
@@ -451,6 +523,60 @@ def reset_underground_parameters(underground_intensity_entry, underground_integr
     underground_width_entry.delete(0, tk.END)
     underground_width_entry.insert(0, "0.001")
 
+def pattern_library_description():
+    """Short description of the loaded pattern library."""
+    if globals.pattern_library is None:
+        return "No pattern library loaded"
+    return (f"{globals.pattern_library['Metabolite'].nunique()} metabolites, "
+            f"{len(globals.pattern_library)} signals")
+
+def load_pattern_library(pattern_label):
+    """Load a multiplet pattern library (Metabolite, ppm, Multiplicity, J1/J2 (Hz), tolerances)."""
+    file = filedialog.askopenfilename(title="Select pattern library",
+                                      filetypes=[("Excel files", "*.xlsx"), ("CSV files", "*.csv")])
+    if not file:
+        return
+    library = file_io.load_pattern_library(file)
+    if library is None:
+        return
+    try:
+        pattern_matching.compile_library(library)
+    except ValueError as e:
+        messagebox.showerror("Error", str(e))
+        return
+    globals.pattern_library = library
+    pattern_label.config(text=pattern_library_description())
+
+def identify_metabolites(spectrometer_entry):
+    """Score the pattern library against the peaks of all spectra and summarise the matches."""
+    try:
+        spectrometer_mhz = float(spectrometer_entry.get())
+        if spectrometer_mhz <= 0:
+            raise ValueError
+    except ValueError:
+        messagebox.showerror("Error", "Spectrometer frequency must be a positive number of MHz.")
+        return
+
+    if globals.pattern_library is None:
+        messagebox.showerror("Error", "Load a pattern library first.")
+        return
+    if not globals.all_peak_picking_results:
+        messagebox.showerror("Error", "No peak picking results. Run 'Detect All Spectra' first.")
+        return
+
+    globals.spectrometer_mhz = spectrometer_mhz
+    with diagnostics.track_stage("Pattern Matching", len({p["Sample"] for p in globals.all_peak_picking_results})):
+        identifications = pattern_matching.identify_metabolites(globals.all_peak_picking_results)
+
+    # Metabolites with every signal found, by number of samples
+    complete = identifications[identifications["Signals Found"] == identifications["Signals"]]
+    counts = complete.groupby("Metabolite").size().sort_values(ascending=False)
+    lines = [f"{name}: {count} samples" for name, count in counts.head(15).items()]
+    messagebox.showinfo("Identification", f"Scored {identifications['Metabolite'].nunique()} metabolites in "
+                                          f"{identifications['Sample'].nunique()} samples.\n\n"
+                                          "Fully matched:\n" + ("\n".join(lines) or "none") +
+                                          "\n\nScores are included in 'Export All Results' and the report.")
+
 def export_peak_picking():
     """Export current peak picking results."""
     if not globals.peak_picking_results:
@@ -465,7 +591,7 @@ def export_peak_picking():
     
     if filename:
         df = pd.DataFrame(globals.peak_picking_results)
-        df = df[["Sample", "Peak", "PPM", "Intensity", "Integral", "Width_PPM", "Start_PPM", "End_PPM", "Baseline", "Index"]]
+        df = df[["Sample", "Peak", "Metabolite", "PPM", "Intensity", "Integral", "Width_PPM", "Start_PPM", "End_PPM", "Baseline", "Index"]]
         with pd.ExcelWriter(filename) as writer:
             df.to_excel(writer, sheet_name="Peak Picking", index=False)
         messagebox.showinfo("Success", f"Peak picking results saved to {filename}")
@@ -483,51 +609,42 @@ def export_all_peak_picking():
     )
     
     if filename:
+        # Summary sheets are pivoted on the matched feature, so a column holds
+        # the same signal in every sample
+        features = peak_matching.assign_features(globals.all_peak_picking_results)
+        df_features = pd.DataFrame(interval_index.annotate(features))
+        
         # Create detailed results sheet
+        interval_index.annotate(globals.all_peak_picking_results)
         df_detailed = pd.DataFrame(globals.all_peak_picking_results)
-        df_detailed = df_detailed[["Sample", "Peak", "PPM", "Intensity", "Integral", "Width_PPM", "Start_PPM", "End_PPM", "Baseline", "Index"]]
-        
-        # Create summary sheet (pivot table) for PPM values
-        df_summary_ppm = df_detailed.pivot_table(
-            index='Sample', 
-            columns='Peak', 
-            values='PPM',
-            aggfunc='first'
-        )
-        
-        # Create summary sheet for Integral values
-        df_summary_integral = df_detailed.pivot_table(
-            index='Sample', 
-            columns='Peak', 
-            values='Integral',
-            aggfunc='first'
-        )
+        df_detailed = df_detailed[["Sample", "Peak", "Feature", "Metabolite", "PPM", "Intensity", "Integral", "Width_PPM", "Start_PPM", "End_PPM", "Baseline", "Index"]]
         
         with pd.ExcelWriter(filename) as writer:
             df_detailed.to_excel(writer, sheet_name="Detailed Results", index=False)
-            df_summary_ppm.to_excel(writer, sheet_name="PPM by Sample")
-            df_summary_integral.to_excel(writer, sheet_name="Integrals by Sample")
-            
-            # Also create intensity summary
-            df_intensity_summary = df_detailed.pivot_table(
-                index='Sample', 
-                columns='Peak', 
-                values='Intensity',
-                aggfunc='first'
-            )
-            df_intensity_summary.to_excel(writer, sheet_name="Intensity by Sample")
-            
-            # Create width summary
-            df_width_summary = df_detailed.pivot_table(
-                index='Sample', 
-                columns='Peak', 
-                values='Width_PPM',
-                aggfunc='first'
-            )
-            df_width_summary.to_excel(writer, sheet_name="Width by Sample")
+            df_features.to_excel(writer, sheet_name="Features", index=False)
+            peak_matching.feature_matrix(df_detailed, "PPM", "mean").to_excel(writer, sheet_name="PPM by Sample")
+            peak_matching.feature_matrix(df_detailed, "Integral").to_excel(writer, sheet_name="Integrals by Sample")
+            peak_matching.feature_matrix(df_detailed, "Intensity", "max").to_excel(writer, sheet_name="Intensity by Sample")
+            peak_matching.feature_matrix(df_detailed, "Width_PPM", "max").to_excel(writer, sheet_name="Width by Sample")
+            dropped_details = 0
+            if globals.pattern_library is not None:
+                identifications = pattern_matching.identify_metabolites(globals.all_peak_picking_results)
+                pattern_matching.score_matrix(identifications).to_excel(writer, sheet_name="Identifications")
+                # Details of the metabolites with any matched signal; past Excel's
+                # row limit only the best-scoring rows are kept
+                details = identifications[identifications["Score"] > 0]
+                dropped_details = max(0, len(details) - (EXCEL_MAX_ROWS - 1))
+                if dropped_details:
+                    details = details.sort_values("Score", ascending=False, kind="stable").head(EXCEL_MAX_ROWS - 1)
+                details.to_excel(writer, sheet_name="Identification Details", index=False)
         
-        messagebox.showinfo("Success", f"All peak picking results saved to {filename}\n\n"
-                                      f"Found {len(globals.all_peak_picking_results)} peaks across {len(globals.spectra)} spectra.")
+        message = (f"All peak picking results saved to {filename}\n\n"
+                   f"Found {len(globals.all_peak_picking_results)} peaks across {len(globals.spectra)} spectra.")
+        if dropped_details:
+            messagebox.showwarning("Warning", f"{message}\n\n{dropped_details} lowest-scoring identification "
+                                              f"details exceed Excel's row limit and were left out.")
+        else:
+            messagebox.showinfo("Success", message)
 
 def setup_initial_peak_plot(peak_fig, peak_canvas):
     """Set up the initial empty plot for peak picking."""
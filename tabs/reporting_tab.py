@@ -5,10 +5,11 @@ import analysis.reporting as reporting_analysis
 import globals
 import gui
 
-def create_reporting_tab(tab_control):
-    """Create the automated reporting tab."""
-    tab = gui.create_themed_frame(tab_control)
-    tab_control.add(tab, text="📋 Automated Reporting")
+def create_reporting_tab(tab_control, tab=None):
+    """Create the automated reporting tab, or fill in tab if it was already added."""
+    if tab is None:
+        tab = gui.create_themed_frame(tab_control)
+        tab_control.add(tab, text="📋 Automated Reporting")
     
     report_frame = gui.create_themed_frame(tab)
     report_frame.pack(fill='both', expand=True, padx=20, pady=20)
@@ -41,7 +42,8 @@ def create_reporting_tab(tab_control):
 • Integration results
 • Binning results
 • Peak picking summary
-• Analysis status summary"""
+• Analysis status summary
+• Performance (time, throughput and memory per analysis stage)"""
     
     gui.create_themed_label(comp_report_frame, text=comp_description, justify='left', 
                            font=('Segoe UI', 10)).pack(anchor='w', pady=(0, 15))
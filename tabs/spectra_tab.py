@@ -1,15 +1,26 @@
 import tkinter as tk
-from tkinter import ttk
+from tkinter import ttk, messagebox
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 import numpy as np
 import globals
 import gui
+import analysis.alignment as alignment_analysis
+import analysis.normalization as normalization
+import analysis.spectrum_index as spectrum_index
+import analysis.stocsy as stocsy_analysis
+import memory_budget
 
-def create_spectra_tab(tab_control):
-    """Create the spectrum viewer tab."""
-    tab = gui.create_themed_frame(tab_control)
-    tab_control.add(tab, text="📊 Spectrum Viewer")
+# What the viewer shows ("single", "selected", "all" or None), so it can be
+# redrawn when the normalization changes
+current_view = None
+
+def create_spectra_tab(tab_control, tab=None):
+    """Create the spectrum viewer tab, or fill in tab if it was already added."""
+    if tab is None:
+        tab = gui.create_themed_frame(tab_control)
+        tab_control.add(tab, text="📊 Spectrum Viewer")
     
     spectra_frame = gui.create_themed_frame(tab)
     spectra_frame.pack(fill='both', expand=True, padx=20, pady=20)
@@ -61,9 +72,15 @@ def create_spectra_tab(tab_control):
     • Click 'Overlay Selected' to compare spectra
     • 'View All' shows all spectra together
     • Peak regions are highlighted
+    • With STOCSY on, click a peak to correlate it
+      with every point across all spectra
     """
     gui.create_themed_label(spectra_info, text=instructions_text, justify='left', font=('Segoe UI', 8)).pack(anchor='w', padx=5, pady=5)
 
+    stocsy_var = tk.BooleanVar(value=False)
+    stocsy_check = ttk.Checkbutton(spectra_info, text="🧷 STOCSY (click a driver peak)", variable=stocsy_var)
+    stocsy_check.pack(anchor='w', padx=5, pady=(0, 5))
+
     # Right panel - spectrum plot
     right_panel = gui.create_themed_frame(spectra_frame)
     right_panel.pack(side='right', fill='both', expand=True)
@@ -81,10 +98,23 @@ def create_spectra_tab(tab_control):
 
     # Initial plot
     setup_initial_plot(view_fig, view_canvas)
+
+    # Clicking the plot in STOCSY mode (and not zooming/panning) picks the driver
+    view_canvas.mpl_connect('button_press_event',
+                            lambda event: on_plot_click(event, stocsy_var, view_toolbar, view_fig, view_canvas))
     
     # Register for spectra updates
     globals.add_event_listener('spectra_updated', 
-                              lambda spectra: update_spectra_list(spectra_listbox))
+                              lambda spectra: update_spectra_list(spectra_listbox),
+                              key='update_spectra_list')
+    
+    # Normalized intensities change under an open plot
+    globals.add_event_listener('normalization_updated',
+                               lambda: redraw_current_view(spectra_listbox, view_fig, view_canvas),
+                               key='spectra_tab.redraw_current_view')
+    
+    # A tab built after loading starts with the current spectra
+    update_spectra_list(spectra_listbox)
     
     return tab, spectra_listbox
 
@@ -107,39 +137,57 @@ def on_spectrum_select(event, spectra_listbox, view_fig, view_canvas):
             index = sorted_indices[0]
             if index < len(globals.spectra):
                 ppm_scale, data, sample_name, pdata_dir = globals.spectra[index]
-                plot_single_spectrum(ppm_scale, data, sample_name, view_fig, view_canvas)
+                memory_budget.touch(pdata_dir)
+                plot_single_spectrum(ppm_scale, data, sample_name, view_fig, view_canvas, pdata_dir)
 
-def plot_single_spectrum(ppm_scale, data, sample_name, view_fig, view_canvas):
-    """Plot a single spectrum with peak regions."""
+def redraw_current_view(spectra_listbox, view_fig, view_canvas):
+    """Redraw the spectrum plot currently shown (STOCSY and the empty plot are left alone)."""
+    if not globals.spectra:
+        return
+    if current_view == "single":
+        on_spectrum_select(None, spectra_listbox, view_fig, view_canvas)
+    elif current_view == "selected":
+        plot_selected_spectra(spectra_listbox, view_fig, view_canvas)
+    elif current_view == "all":
+        plot_all_spectra(view_fig, view_canvas)
+
+def plot_single_spectrum(ppm_scale, data, sample_name, view_fig, view_canvas, pdata_dir=None):
+    """Plot a single spectrum with peak regions (ppm_scale is the raw, unaligned axis)."""
+    global current_view
+    current_view = "single"
     view_fig.clear()
     ax = view_fig.add_subplot(111)
     
     gui.setup_plot_style(ax)
     
-    # Plot spectrum
-    ax.plot(ppm_scale, data, color=gui.Theme.SPECTRUM_COLORS[0], linewidth=1, label=sample_name)
+    # Plot spectrum (the raw data stays untouched for the statistics index)
+    factor = normalization.factor(pdata_dir)
+    shown = alignment_analysis.aligned_data(ppm_scale, data, pdata_dir)
+    ax.plot(ppm_scale, normalization.normalized(pdata_dir, shown), color=gui.Theme.SPECTRUM_COLORS[0],
+            linewidth=1, label=sample_name)
     
     # Plot peak regions if available
     if not globals.peak_limits.empty:
-        ymax = data.max()
-        ymin = data.min()
+        # Maxima come from the statistics index, which adds the alignment
+        # offsets itself and so takes the raw data; the aligned data sits in
+        # the unshifted windows
+        entry = spectrum_index.get_entry(ppm_scale, data, pdata_dir)
+        bounds = spectrum_index.region_bounds(ppm_scale, None, globals.peak_limits)
         
-        for _, row in globals.peak_limits.iterrows():
+        for k, (_, row) in enumerate(globals.peak_limits.iterrows()):
             name = row["Peak identity"]
             start = row["ppm start"]
             end = row["ppm end"]
             
-            s = np.abs(ppm_scale - start).argmin()
-            e = np.abs(ppm_scale - end).argmin()
-            if s > e: s, e = e, s
+            s, e = bounds[k]
             
             # Fill peak region
-            ax.fill_between(ppm_scale[s:e+1], data[s:e+1], 
+            ax.fill_between(ppm_scale[s:e+1], shown[s:e+1] / factor, 
                            alpha=gui.Theme.PEAK_REGION_ALPHA, 
                            color=gui.Theme.PEAK_REGION_FILL)
             
             # Find maximum y-value for label positioning
-            peak_max = data[s:e+1].max()
+            peak_max = entry["region_max"][k] / factor
             
             # Add peak label
             mid = (start + end) / 2
@@ -148,7 +196,7 @@ def plot_single_spectrum(ppm_scale, data, sample_name, view_fig, view_canvas):
                    bbox=dict(boxstyle="round,pad=0.1", facecolor='black', alpha=0.7))
     
     ax.set_xlabel("Chemical Shift (ppm)")
-    ax.set_ylabel("Intensity")
+    ax.set_ylabel("Normalized Intensity" if normalization.is_normalized() else "Intensity")
     ax.set_title(f"Spectrum: {sample_name}")
     ax.invert_xaxis()
     ax.legend()
@@ -156,9 +204,11 @@ def plot_single_spectrum(ppm_scale, data, sample_name, view_fig, view_canvas):
 
 def plot_all_spectra(view_fig, view_canvas):
     """Plot all spectra in overlay."""
+    global current_view
     if not globals.spectra:
         return
         
+    current_view = "all"
     view_fig.clear()
     ax = view_fig.add_subplot(111)
     
@@ -167,34 +217,30 @@ def plot_all_spectra(view_fig, view_canvas):
     # Plot all spectra
     for i, (ppm_scale, data, sample_name, pdata_dir) in enumerate(globals.spectra):
         color = gui.Theme.get_spectrum_color(i)
-        ax.plot(ppm_scale, data, color=color, linewidth=0.7, alpha=0.8, label=sample_name)
+        data = alignment_analysis.aligned_data(ppm_scale, data, pdata_dir)
+        ax.plot(ppm_scale, normalization.normalized(pdata_dir, data), color=color, linewidth=0.7,
+                alpha=0.8, label=sample_name)
     
     # Plot peak regions if available
     if not globals.peak_limits.empty:
-        ymax = max([data.max() for _, data, _, _ in globals.spectra])
+        # Maxima and region bounds are looked up in the statistics index
+        ymax = spectrum_index.max_intensity(globals.spectra)
+        region_max = spectrum_index.region_max_over(globals.spectra)
         
-        for _, row in globals.peak_limits.iterrows():
+        # Use first spectrum's axis for the (unshifted) peak region coordinates
+        ppm_first = globals.spectra[0][0]
+        first_bounds = spectrum_index.region_bounds(ppm_first, None, globals.peak_limits)
+        
+        for k, (_, row) in enumerate(globals.peak_limits.iterrows()):
             name = row["Peak identity"]
             start = row["ppm start"]
             end = row["ppm end"]
             
-            # Use first spectrum for peak region coordinates
-            ppm_scale_first = globals.spectra[0][0]
-            s = np.abs(ppm_scale_first - start).argmin()
-            e = np.abs(ppm_scale_first - end).argmin()
-            if s > e: s, e = e, s
-            
-            # Find maximum intensity in this peak region across all spectra
-            peak_max = 0
-            for ppm_scale, data, _, _ in globals.spectra:
-                s_idx = np.abs(ppm_scale - start).argmin()
-                e_idx = np.abs(ppm_scale - end).argmin()
-                if s_idx > e_idx: s_idx, e_idx = e_idx, s_idx
-                region_max = data[s_idx:e_idx+1].max()
-                peak_max = max(peak_max, region_max)
+            s, e = first_bounds[k]
+            peak_max = max(0, region_max[k])
             
             # Fill peak region
-            ax.fill_between(ppm_scale_first[s:e+1], 0, ymax * 1.1, 
+            ax.fill_between(ppm_first[s:e+1], 0, ymax * 1.1, 
                            alpha=0.2, color=gui.Theme.PEAK_REGION_FILL)
             
             # Add peak label
@@ -204,7 +250,7 @@ def plot_all_spectra(view_fig, view_canvas):
                    bbox=dict(boxstyle="round,pad=0.1", facecolor='black', alpha=0.7))
     
     ax.set_xlabel("Chemical Shift (ppm)")
-    ax.set_ylabel("Intensity")
+    ax.set_ylabel("Normalized Intensity" if normalization.is_normalized() else "Intensity")
     ax.set_title("All Spectra Overlay")
     ax.invert_xaxis()
     ax.legend(fontsize=6)
@@ -212,10 +258,12 @@ def plot_all_spectra(view_fig, view_canvas):
 
 def plot_selected_spectra(spectra_listbox, view_fig, view_canvas):
     """Plot selected spectra in overlay."""
+    global current_view
     selection = spectra_listbox.curselection()
     if not selection or not globals.spectra:
         return
     
+    current_view = "selected"
     view_fig.clear()
     ax = view_fig.add_subplot(111)
     
@@ -225,48 +273,41 @@ def plot_selected_spectra(spectra_listbox, view_fig, view_canvas):
     for i, idx in enumerate(selection):
         if idx < len(globals.spectra):
             ppm_scale, data, sample_name, pdata_dir = globals.spectra[idx]
+            data = alignment_analysis.aligned_data(ppm_scale, data, pdata_dir)
             color = gui.Theme.get_spectrum_color(i)
-            ax.plot(ppm_scale, data, color=color, linewidth=1, label=sample_name)
+            ax.plot(ppm_scale, normalization.normalized(pdata_dir, data), color=color, linewidth=1,
+                    label=sample_name)
     
     # Plot peak regions if available
-    if not globals.peak_limits.empty:
-        selected_data = [globals.spectra[idx][1] for idx in selection if idx < len(globals.spectra)]
-        ymax = max([data.max() for data in selected_data]) if selected_data else 0
+    selected_spectra = [globals.spectra[idx] for idx in selection if idx < len(globals.spectra)]
+    if not globals.peak_limits.empty and selected_spectra:
+        # Maxima and region bounds are looked up in the statistics index
+        ymax = spectrum_index.max_intensity(selected_spectra)
+        region_max = spectrum_index.region_max_over(selected_spectra)
+        
+        ppm_first = selected_spectra[0][0]
+        first_bounds = spectrum_index.region_bounds(ppm_first, None, globals.peak_limits)
         
-        for _, row in globals.peak_limits.iterrows():
+        for k, (_, row) in enumerate(globals.peak_limits.iterrows()):
             name = row["Peak identity"]
             start = row["ppm start"]
             end = row["ppm end"]
             
-            if selection and selection[0] < len(globals.spectra):
-                ppm_scale_first = globals.spectra[selection[0]][0]
-                s = np.abs(ppm_scale_first - start).argmin()
-                e = np.abs(ppm_scale_first - end).argmin()
-                if s > e: s, e = e, s
-                
-                # Find maximum intensity in this peak region across selected spectra
-                peak_max = 0
-                for idx in selection:
-                    if idx < len(globals.spectra):
-                        ppm_scale, data, _, _ = globals.spectra[idx]
-                        s_idx = np.abs(ppm_scale - start).argmin()
-                        e_idx = np.abs(ppm_scale - end).argmin()
-                        if s_idx > e_idx: s_idx, e_idx = e_idx, s_idx
-                        region_max = data[s_idx:e_idx+1].max()
-                        peak_max = max(peak_max, region_max)
-                
-                # Fill peak region
-                ax.fill_between(ppm_scale_first[s:e+1], 0, ymax * 1.1, 
-                               alpha=0.2, color=gui.Theme.PEAK_REGION_FILL)
-                
-                # Add peak label
-                mid = (start + end) / 2
-                ax.text(mid, peak_max * 1.05, name, rotation=90, ha="center", va="bottom", 
-                       color=gui.Theme.TEXT_PRIMARY, fontsize=8, 
-                       bbox=dict(boxstyle="round,pad=0.1", facecolor='black', alpha=0.7))
+            s, e = first_bounds[k]
+            peak_max = max(0, region_max[k])
+            
+            # Fill peak region
+            ax.fill_between(ppm_first[s:e+1], 0, ymax * 1.1, 
+                           alpha=0.2, color=gui.Theme.PEAK_REGION_FILL)
+            
+            # Add peak label
+            mid = (start + end) / 2
+            ax.text(mid, peak_max * 1.05, name, rotation=90, ha="center", va="bottom", 
+                   color=gui.Theme.TEXT_PRIMARY, fontsize=8, 
+                   bbox=dict(boxstyle="round,pad=0.1", facecolor='black', alpha=0.7))
     
     ax.set_xlabel("Chemical Shift (ppm)")
-    ax.set_ylabel("Intensity")
+    ax.set_ylabel("Normalized Intensity" if normalization.is_normalized() else "Intensity")
     ax.set_title(f"Overlay of {len(selection)} Selected Spectra")
     ax.invert_xaxis()
     ax.legend()
@@ -277,6 +318,55 @@ def clear_selection(spectra_listbox, view_fig, view_canvas):
     spectra_listbox.selection_clear(0, tk.END)
     plot_all_spectra(view_fig, view_canvas)
 
+def on_plot_click(event, stocsy_var, view_toolbar, view_fig, view_canvas):
+    """Run STOCSY from the clicked ppm when STOCSY mode is on."""
+    if not stocsy_var.get() or event.button != 1 or event.inaxes is None or event.xdata is None:
+        return
+    if view_toolbar.mode:  # zoom/pan clicks are not driver picks
+        return
+    if len(globals.spectra) < 3:
+        messagebox.showerror("Error", "STOCSY needs at least three loaded spectra.")
+        return
+
+    try:
+        result = stocsy_analysis.stocsy(globals.spectra, event.xdata)
+    except Exception as e:
+        messagebox.showerror("Error", f"STOCSY failed: {str(e)}")
+        return
+    plot_stocsy(result, view_fig, view_canvas)
+
+def plot_stocsy(result, view_fig, view_canvas):
+    """Covariance trace coloured by the correlation with the driver (classic STOCSY view)."""
+    global current_view
+    current_view = None
+    view_fig.clear()
+    ax = view_fig.add_subplot(111)
+    gui.setup_plot_style(ax)
+
+    ppm = result["ppm"]
+    covariance = result["covariance"][0]
+    correlation = result["correlation"][0]
+
+    points = np.column_stack((ppm, covariance)).reshape(-1, 1, 2)
+    segments = np.concatenate((points[:-1], points[1:]), axis=1)
+    lines = LineCollection(segments, cmap='jet', linewidth=1)
+    lines.set_array(np.abs(correlation[:-1]))
+    lines.set_clim(0, 1)
+    ax.add_collection(lines)
+    view_fig.colorbar(lines, ax=ax, label="|r| with driver")
+
+    driver_ppm = result["driver_ppm"][0]
+    ax.axvline(driver_ppm, color=gui.Theme.TEXT_PRIMARY, linestyle='--', linewidth=1, alpha=0.7)
+    ax.set_xlim(ppm.min(), ppm.max())
+    span = covariance.max() - covariance.min()
+    ax.set_ylim(covariance.min() - 0.05 * span, covariance.max() + 0.05 * span)
+
+    ax.set_xlabel("Chemical Shift (ppm)")
+    ax.set_ylabel("Covariance with driver")
+    ax.set_title(f"STOCSY: driver {driver_ppm:.4f} ppm ({len(globals.spectra)} spectra)")
+    ax.invert_xaxis()
+    view_canvas.draw()
+
 def setup_initial_plot(view_fig, view_canvas):
     """Set up the initial empty plot."""
     ax = view_fig.add_subplot(111)
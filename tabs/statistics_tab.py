@@ -0,0 +1,366 @@
+import tkinter as tk
+from tkinter import ttk, messagebox, filedialog
+import matplotlib.pyplot as plt
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+import numpy as np
+import pandas as pd
+import analysis.multivariate as multivariate_analysis
+import analysis.univariate as univariate_analysis
+import file_io
+import globals
+import gui
+
+MULTIVARIATE_METHODS = ("PCA", "PLS-DA")
+
+def create_statistics_tab(tab_control, tab=None):
+    """Create the statistics tab, or fill in tab if it was already added."""
+    if tab is None:
+        tab = gui.create_themed_frame(tab_control)
+        tab_control.add(tab, text="📐 Statistics")
+
+    stats_frame = gui.create_themed_frame(tab)
+    stats_frame.pack(fill='both', expand=True, padx=20, pady=20)
+
+    # Left panel - metadata and parameters
+    stats_left_panel = gui.create_themed_frame(stats_frame)
+    stats_left_panel.pack(side='left', fill='y', padx=(0, 10))
+
+    # Sample metadata
+    metadata_frame = gui.create_themed_labelframe(stats_left_panel, text="Sample Metadata", padding=15)
+    metadata_frame.pack(fill='x', pady=(0, 15))
+
+    metadata_label = gui.create_themed_label(metadata_frame, text=metadata_description())
+    metadata_label.pack(anchor='w', pady=(0, 5))
+
+    gui.create_themed_label(metadata_frame, text="Group column:").pack(anchor='w')
+    group_var = tk.StringVar()
+    group_combo = ttk.Combobox(metadata_frame, textvariable=group_var, state='readonly', width=20)
+    group_combo.pack(anchor='w', pady=(0, 5))
+    group_combo.bind('<<ComboboxSelected>>', lambda event: update_group_levels(group_var, level_combos))
+    update_group_columns(group_combo, group_var)
+
+    load_metadata_btn = gui.create_themed_button(metadata_frame, text="📂 Load Metadata",
+                                  command=lambda: load_metadata(metadata_label, group_combo, group_var,
+                                                                level_combos))
+    load_metadata_btn.pack(anchor='w', pady=(5, 0))
+
+    # Multivariate parameters
+    mv_frame = gui.create_themed_labelframe(stats_left_panel, text="Multivariate Analysis", padding=15)
+    mv_frame.pack(fill='x', pady=(0, 15))
+
+    gui.create_themed_label(mv_frame, text="Method:").grid(row=0, column=0, sticky='w', pady=2)
+    method_var = tk.StringVar(value=MULTIVARIATE_METHODS[0])
+    method_combo = ttk.Combobox(mv_frame, textvariable=method_var, state='readonly', width=10,
+                                values=MULTIVARIATE_METHODS)
+    method_combo.grid(row=0, column=1, sticky='w', pady=2, padx=(5, 0))
+
+    gui.create_themed_label(mv_frame, text="Scaling:").grid(row=1, column=0, sticky='w', pady=2)
+    scaling_var = tk.StringVar(value="Pareto")
+    scaling_combo = ttk.Combobox(mv_frame, textvariable=scaling_var, state='readonly', width=10,
+                                 values=multivariate_analysis.SCALING_METHODS)
+    scaling_combo.grid(row=1, column=1, sticky='w', pady=2, padx=(5, 0))
+
+    gui.create_themed_label(mv_frame, text="Components:").grid(row=2, column=0, sticky='w', pady=2)
+    components_entry = ttk.Entry(mv_frame, width=10)
+    components_entry.grid(row=2, column=1, sticky='w', pady=2, padx=(5, 0))
+    components_entry.insert(0, "2")
+
+    mv_control_frame = gui.create_themed_frame(mv_frame)
+    mv_control_frame.grid(row=3, column=0, columnspan=2, sticky='w', pady=(10, 0))
+
+    run_mv_btn = gui.create_themed_button(mv_control_frame, text="🚀 Run",
+                           command=lambda: run_multivariate(method_var, scaling_var, components_entry, group_var,
+                                                            result_label, stats_fig, stats_canvas))
+    run_mv_btn.pack(side='left', padx=(0, 10))
+
+    export_mv_btn = gui.create_themed_button(mv_control_frame, text="💾 Export to Excel",
+                              command=export_multivariate)
+    export_mv_btn.pack(side='left')
+
+    # Univariate group comparison over all bins
+    uv_frame = gui.create_themed_labelframe(stats_left_panel, text="Group Comparison", padding=15)
+    uv_frame.pack(fill='x', pady=(0, 15))
+
+    gui.create_themed_label(uv_frame, text="Test:").grid(row=0, column=0, sticky='w', pady=2)
+    test_var = tk.StringVar(value=univariate_analysis.TESTS[0])
+    test_combo = ttk.Combobox(uv_frame, textvariable=test_var, state='readonly', width=16,
+                              values=univariate_analysis.TESTS)
+    test_combo.grid(row=0, column=1, sticky='w', pady=2, padx=(5, 0))
+
+    level_combos = []
+    for row, text in ((1, "Group A:"), (2, "Group B:")):
+        gui.create_themed_label(uv_frame, text=text).grid(row=row, column=0, sticky='w', pady=2)
+        level_combo = ttk.Combobox(uv_frame, state='readonly', width=16)
+        level_combo.grid(row=row, column=1, sticky='w', pady=2, padx=(5, 0))
+        level_combos.append(level_combo)
+    update_group_levels(group_var, level_combos)
+
+    uv_control_frame = gui.create_themed_frame(uv_frame)
+    uv_control_frame.grid(row=3, column=0, columnspan=2, sticky='w', pady=(10, 0))
+
+    run_uv_btn = gui.create_themed_button(uv_control_frame, text="🌋 Compare Groups",
+                           command=lambda: run_univariate(test_var, group_var, level_combos,
+                                                          result_label, stats_fig, stats_canvas))
+    run_uv_btn.pack(side='left', padx=(0, 10))
+
+    export_uv_btn = gui.create_themed_button(uv_control_frame, text="💾 Export to Excel",
+                              command=export_univariate)
+    export_uv_btn.pack(side='left')
+
+    result_label = gui.create_themed_label(stats_left_panel, text="", justify='left')
+    result_label.pack(anchor='w', pady=(0, 15))
+
+    # Right panel - score and loading plots
+    stats_right_panel = gui.create_themed_frame(stats_frame)
+    stats_right_panel.pack(side='right', fill='both', expand=True)
+
+    stats_fig = plt.Figure(figsize=(10, 8), dpi=100)
+    stats_canvas = FigureCanvasTkAgg(stats_fig, master=stats_right_panel)
+    stats_canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+
+    stats_toolbar_frame = gui.create_themed_frame(stats_right_panel)
+    stats_toolbar_frame.pack(side=tk.TOP, fill=tk.X)
+    stats_toolbar = NavigationToolbar2Tk(stats_canvas, stats_toolbar_frame)
+    stats_toolbar.update()
+
+    if globals.multivariate_results is not None:
+        plot_multivariate(globals.multivariate_results, group_var.get(), stats_fig, stats_canvas)
+
+    return tab
+
+def metadata_description():
+    """Short description of the loaded sample metadata."""
+    if globals.sample_metadata is None:
+        return "No metadata loaded"
+    return f"{len(globals.sample_metadata)} samples, {len(globals.sample_metadata.columns)} columns"
+
+def update_group_columns(group_combo, group_var):
+    """Offer the metadata columns as grouping variables."""
+    columns = [] if globals.sample_metadata is None else [str(c) for c in globals.sample_metadata.columns]
+    group_combo["values"] = [""] + columns
+    if group_var.get() not in columns:
+        group_var.set(columns[0] if columns else "")
+
+def update_group_levels(group_var, level_combos):
+    """Offer the values of the selected group column as groups A and B."""
+    levels = []
+    if globals.sample_metadata is not None and group_var.get() in globals.sample_metadata:
+        levels = sorted(globals.sample_metadata[group_var.get()].dropna().astype(str).unique())
+    for i, level_combo in enumerate(level_combos):
+        level_combo["values"] = levels
+        level_combo.set(levels[i] if len(levels) > i else "")
+
+def load_metadata(metadata_label, group_combo, group_var, level_combos):
+    """Load a sample metadata sheet (a Sample column plus group/covariate columns)."""
+    file = filedialog.askopenfilename(title="Select sample metadata",
+                                      filetypes=[("Excel files", "*.xlsx"), ("CSV files", "*.csv")])
+    if not file:
+        return
+    metadata = file_io.load_sample_metadata(file)
+    if metadata is None:
+        return
+    globals.sample_metadata = metadata
+    metadata_label.config(text=metadata_description())
+    update_group_columns(group_combo, group_var)
+    update_group_levels(group_var, level_combos)
+
+    if globals.binning_results is not None:
+        missing = [s for s in globals.binning_results.index if str(s) not in metadata.index]
+        if missing:
+            messagebox.showwarning("Warning", f"{len(missing)} binned samples have no metadata row, "
+                                              f"e.g. {', '.join(map(str, missing[:5]))}.")
+
+def run_multivariate(method_var, scaling_var, components_entry, group_var, result_label, stats_fig, stats_canvas):
+    """Run PCA or PLS-DA on the binning results and plot scores and loadings."""
+    if globals.binning_results is None:
+        messagebox.showerror("Error", "No binning results. Perform binning first.")
+        return
+
+    try:
+        n_components = int(components_entry.get())
+        if n_components < 1:
+            raise ValueError
+    except ValueError:
+        messagebox.showerror("Error", "Components must be a positive integer.")
+        return
+
+    group_column = group_var.get()
+    groups = multivariate_analysis.sample_groups(group_column, globals.binning_results.index) if group_column else None
+
+    try:
+        if method_var.get() == "PLS-DA":
+            if groups is None:
+                messagebox.showerror("Error", "PLS-DA needs sample metadata and a group column.")
+                return
+            results = multivariate_analysis.pls_da(globals.binning_results, groups, n_components, scaling_var.get())
+        else:
+            results = multivariate_analysis.pca(globals.binning_results, n_components, scaling_var.get())
+    except ValueError as e:
+        messagebox.showerror("Error", str(e))
+        return
+
+    globals.multivariate_results = results
+
+    explained = ", ".join(f"{name} {100 * value:.1f}%"
+                          for name, value in zip(results["scores"].columns, results["explained"]))
+    summary = f"{results['method']} ({results['scaling']} scaling)\nExplained: {explained}"
+    if results["method"] == "PLS-DA":
+        summary += f"\nTraining accuracy: {100 * results['accuracy']:.1f}%"
+        if results["cv_accuracy"] is not None:
+            summary += f"\nCross-validated accuracy: {100 * results['cv_accuracy']:.1f}%"
+    result_label.config(text=summary)
+
+    plot_multivariate(results, group_column, stats_fig, stats_canvas)
+
+def result_groups(results, group_column):
+    """Group label of every scored sample, or None."""
+    if "groups" in results:
+        return results["groups"]
+    groups = multivariate_analysis.sample_groups(group_column, results["scores"].index) if group_column else None
+    if groups is None:
+        return None
+    return groups.fillna("No metadata").astype(str).to_numpy()
+
+def plot_multivariate(results, group_column, stats_fig, stats_canvas):
+    """Scores of the first two components and loadings of the first component."""
+    stats_fig.clear()
+    scores = results["scores"]
+    loadings = results["loadings"]
+    names = list(scores.columns)
+
+    ax_scores = stats_fig.add_subplot(211)
+    gui.setup_plot_style(ax_scores)
+    x = scores[names[0]].to_numpy()
+    y = scores[names[1]].to_numpy() if len(names) > 1 else np.zeros(len(x))
+    groups = result_groups(results, group_column)
+    if groups is None:
+        ax_scores.scatter(x, y, color=gui.Theme.get_spectrum_color(0), s=25)
+    else:
+        groups = np.asarray(groups, dtype=str)
+        for i, group in enumerate(np.unique(groups)):
+            members = groups == group
+            ax_scores.scatter(x[members], y[members], color=gui.Theme.get_spectrum_color(i), s=25, label=group)
+        ax_scores.legend()
+    ax_scores.axhline(0, color=gui.Theme.PLOT_GRID, linewidth=1)
+    ax_scores.axvline(0, color=gui.Theme.PLOT_GRID, linewidth=1)
+    ax_scores.set_xlabel(f"{names[0]} ({100 * results['explained'][0]:.1f}%)")
+    if len(names) > 1:
+        ax_scores.set_ylabel(f"{names[1]} ({100 * results['explained'][1]:.1f}%)")
+    ax_scores.set_title(f"{results['method']} scores")
+
+    ax_loadings = stats_fig.add_subplot(212)
+    gui.setup_plot_style(ax_loadings)
+    ppm = np.array([float(column) for column in loadings.index])
+    order = np.argsort(ppm)
+    ax_loadings.plot(ppm[order], loadings[names[0]].to_numpy()[order],
+                     color=gui.Theme.get_spectrum_color(0), linewidth=1)
+    ax_loadings.set_xlabel("Chemical Shift (ppm)")
+    ax_loadings.set_ylabel(f"{names[0]} loading")
+    ax_loadings.invert_xaxis()
+    ax_loadings.set_title(f"{results['method']} loadings")
+
+    stats_fig.tight_layout()
+    stats_canvas.draw()
+
+def export_multivariate():
+    """Export scores, loadings and explained variance to Excel."""
+    results = globals.multivariate_results
+    if results is None:
+        messagebox.showerror("Error", "No multivariate results to export.")
+        return
+
+    filename = filedialog.asksaveasfilename(
+        defaultextension=".xlsx",
+        filetypes=[("Excel files", "*.xlsx")],
+        title="Save multivariate results as"
+    )
+
+    if filename:
+        summary = pd.DataFrame({"Component": results["scores"].columns, "Explained": results["explained"]})
+        with pd.ExcelWriter(filename) as writer:
+            results["scores"].to_excel(writer, sheet_name="Scores")
+            # Bins as rows: wide binning matrices exceed Excel's column limit
+            results["loadings"].to_excel(writer, sheet_name="Loadings")
+            summary.to_excel(writer, sheet_name="Summary", index=False)
+        messagebox.showinfo("Success", f"{results['method']} results saved to {filename}")
+
+def run_univariate(test_var, group_var, level_combos, result_label, stats_fig, stats_canvas):
+    """Compare groups A and B in every bin and draw the volcano plot."""
+    if globals.binning_results is None:
+        messagebox.showerror("Error", "No binning results. Perform binning first.")
+        return
+
+    group_column = group_var.get()
+    groups = multivariate_analysis.sample_groups(group_column, globals.binning_results.index) if group_column else None
+    if groups is None:
+        messagebox.showerror("Error", "Group comparison needs sample metadata and a group column.")
+        return
+
+    group_a, group_b = (level_combo.get() for level_combo in level_combos)
+    if not group_a or not group_b or group_a == group_b:
+        messagebox.showerror("Error", "Select two different groups to compare.")
+        return
+
+    try:
+        results = univariate_analysis.compare_groups(globals.binning_results, groups, group_a, group_b,
+                                                     test_var.get())
+    except ValueError as e:
+        messagebox.showerror("Error", str(e))
+        return
+
+    globals.univariate_results = results
+    hits = univariate_analysis.significant(results)
+    result_label.config(text=f"{results.attrs['test']}: {group_b} (n={results.attrs['n_b']}) vs "
+                             f"{group_a} (n={results.attrs['n_a']})\n"
+                             f"{hits.sum()} of {len(results)} bins with q < {univariate_analysis.SIGNIFICANCE_Q} "
+                             f"and |log2 FC| >= {univariate_analysis.FOLD_CHANGE_LOG2:g}")
+
+    plot_volcano(results, stats_fig, stats_canvas)
+
+def plot_volcano(results, stats_fig, stats_canvas):
+    """Volcano plot: log2 fold change against -log10 p, significant bins highlighted."""
+    stats_fig.clear()
+    ax = stats_fig.add_subplot(111)
+    gui.setup_plot_style(ax)
+
+    hits = univariate_analysis.significant(results)
+    x = results["Log2 Fold Change"].to_numpy()
+    # p-values that underflow to 0 are drawn at the smallest representable p
+    y = -np.log10(np.maximum(results["p-value"].to_numpy(), np.finfo(float).tiny))
+    ax.scatter(x[~hits], y[~hits], color=gui.Theme.PLOT_GRID, s=8, alpha=0.6, label="Not significant")
+    ax.scatter(x[hits], y[hits], color=gui.Theme.TEXT_ERROR, s=12, label="Significant")
+
+    # Label the strongest hits with their ppm (and metabolite)
+    top = results[hits].nsmallest(10, "p-value")
+    for _, row in top.iterrows():
+        label = f"{row['PPM']:.3f}" + (f" {row['Metabolite']}" if row["Metabolite"] else "")
+        ax.annotate(label, (row["Log2 Fold Change"], -np.log10(max(row["p-value"], np.finfo(float).tiny))), fontsize=8,
+                    xytext=(3, 3), textcoords='offset points')
+
+    for sign in (-1, 1):
+        ax.axvline(sign * univariate_analysis.FOLD_CHANGE_LOG2, color=gui.Theme.PLOT_GRID, linestyle='--', linewidth=1)
+    ax.set_xlabel(f"log2 fold change ({results.attrs['group_b']} / {results.attrs['group_a']})")
+    ax.set_ylabel("-log10 p")
+    ax.set_title(f"Volcano plot ({results.attrs['test']})")
+    ax.legend()
+
+    stats_fig.tight_layout()
+    stats_canvas.draw()
+
+def export_univariate():
+    """Export the per-bin group comparison to Excel."""
+    if globals.univariate_results is None:
+        messagebox.showerror("Error", "No group comparison to export.")
+        return
+
+    filename = filedialog.asksaveasfilename(
+        defaultextension=".xlsx",
+        filetypes=[("Excel files", "*.xlsx")],
+        title="Save group comparison as"
+    )
+
+    if filename:
+        with pd.ExcelWriter(filename) as writer:
+            globals.univariate_results.sort_values("p-value").to_excel(writer, sheet_name="Univariate Statistics",
+                                                                       index=False)
+        messagebox.showinfo("Success", f"Group comparison saved to {filename}")